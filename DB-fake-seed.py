@@ -1,80 +1,66 @@
-import requests
-import psycopg2
 from dotenv import load_dotenv
 import os
-from datetime import datetime, timedelta
 import json
 from itertools import zip_longest
 import sys
-import secrets
+import argparse
+from bulk import copy_merge, upsert_key_map
+from db import close_all, transaction
+from delta_sync import SPECS, sync_table
+from http_cache import get_json, open_body
+from http_client import print_stats
+import metrics
+from metrics import phase
+from invites import issue_invites
+from json_stream import iter_json_array
+from rbac import seed_rbac
+from spatial import refresh_station_mappings
+from forecast import FORECAST_CONCURRENCY, FORECAST_WORKERS, seed_weather_forecast
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Database connection parameters
-db_params = {
-    "dbname": os.getenv('DB_NAME'),
-    "user": os.getenv('DB_USER'),
-    "password": os.getenv('DB_PASSWORD'),
-    "host": os.getenv('DB_HOST'),
-    "port": os.getenv('DB_PORT')
-}
-
-db_paramsinvites = {
-    "dbname": "invites",
-    "user": os.getenv('DB_USER'),
-    "password": os.getenv('DB_PASSWORD'),
-    "host": os.getenv('DB_HOST'),
-    "port": os.getenv('DB_PORT')
-}
+# Upstream reference data sources, overridable to point at a local stand-in
+GEO_API_URL = os.getenv('GEO_API_URL', 'https://geo.api.gouv.fr').rstrip('/')
+DEPARTMENTS_URL = os.getenv('DEPARTMENTS_URL', "https://gist.githubusercontent.com/Tazeg/e0c05fdb39552010e9d0e8218aa3f23c/raw/792f846499b67f135b274ff54d72260ffad48dfe/depts.json")
+STATIONS_URL = os.getenv('STATIONS_URL', "https://meteo.comptoir.net/api/stations")
 
 def seed_city_locations(city_locations):
     try:
-        conn = psycopg2.connect(**db_params)
-        cur = conn.cursor()
-        insert_query = """
-            INSERT INTO "Cities" ("Name", "Latitude", "Longitude")
-            VALUES (%s, %s, %s)
-            ON CONFLICT DO NOTHING;
-        """
-        select_query = """
-            SELECT 1 FROM "Cities" WHERE "Name" = %s AND "Latitude" = %s AND "Longitude" = %s;
-        """
-
-        countInsert = 0  # Initialize countInsert
-
-        for city in city_locations:
-            cur.execute(select_query, city)
-            if not cur.fetchone():
-                cur.execute(insert_query, city)
-                countInsert += 1
-
-        conn.commit()
-        print(f"{countInsert} city locations were successfully inserted.")
-        cur.close()
-        conn.close()
+        with transaction() as cur:
+            # Cities seeded before the INSEE code was stored are recognised by name and position
+            countInsert, countSkip = copy_merge(cur, "Cities", ("Name", "Latitude", "Longitude", "Code"), city_locations,
+                                                key_columns=("Code",), fallback_columns=("Name", "Latitude", "Longitude"))
+
+        print(f"{countInsert} city locations were successfully inserted ({countSkip} already present).")
+        return countInsert, countSkip
 
     except Exception as e:
         print("Error inserting city location data:", e)
         sys.exit(1)
 
+def iter_french_cities():
+    """Yield (name, latitude, longitude, code) for every commune.
+
+    The response is read from the on-disk cache and parsed incrementally, so
+    memory use stays flat however large the gazetteer is.
+    """
+    url = f"{GEO_API_URL}/communes?fields=nom,code,centre&format=json&geometry=centre"
+    with open_body(url) as body:
+        for city in iter_json_array(body):
+            yield (city['nom'], city['centre']['coordinates'][1], city['centre']['coordinates'][0], city['code'])
+
 def fetch_french_cities():
-    url = "https://geo.api.gouv.fr/communes?fields=nom,centre&format=json&geometry=centre"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        cities = response.json()
-        return [(city['nom'], city['centre']['coordinates'][1], city['centre']['coordinates'][0]) for city in cities]
+        return list(iter_french_cities())
     except Exception as e:
         print("Error fetching French cities data:", e)
         sys.exit(1)
 
 def fetch_departments():
-    url = "https://gist.githubusercontent.com/Tazeg/e0c05fdb39552010e9d0e8218aa3f23c/raw/792f846499b67f135b274ff54d72260ffad48dfe/depts.json"
+    url = DEPARTMENTS_URL
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        departments = response.json()
+        departments = get_json(url)
         return departments
     except Exception as e:
         print("Error fetching department data:", e)
@@ -82,363 +68,217 @@ def fetch_departments():
 
 def seed_departments(departments):
     try:
-        conn = psycopg2.connect(**db_params)
-        cur = conn.cursor()
-        insert_query = """
-            INSERT INTO "Departements" ("Name", "Latitude", "Longitude", "Numero")
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT DO NOTHING;
-        """
-        select_query = """
-            SELECT 1 FROM "Departements" WHERE "Name" = %s AND "Latitude" = %s AND "Longitude" = %s AND "Numero" = %s;
-        """
-
-        countInsert = 0  # Initialize countInsert
-
-        for dept in departments:
-            dept_name = dept['nomShort']
-            latitude = dept['lat']
-            longitude = dept['lng']
-            numero = dept['numero']
-            cur.execute(select_query, (dept_name, latitude, longitude, numero))
-            if not cur.fetchone():
-                cur.execute(insert_query, (dept_name, latitude, longitude, numero))
-                countInsert += 1
-
-        conn.commit()
-        print(f"{countInsert} departments were successfully inserted.")
-        cur.close()
-        conn.close()
+        with transaction() as cur:
+            rows = ((dept['nomShort'], dept['lat'], dept['lng'], dept['numero']) for dept in departments)
+            countInsert, countSkip = copy_merge(cur, "Departements", ("Name", "Latitude", "Longitude", "Numero"), rows,
+                                                key_columns=("Numero",))
+
+        print(f"{countInsert} departments were successfully inserted ({countSkip} already present).")
 
     except Exception as e:
         print("Error inserting department data:", e)
         sys.exit(1)
 
 def fetch_weather_stations():
-    url = "https://meteo.comptoir.net/api/stations"
+    url = STATIONS_URL
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        stations = response.json().get('stations', [])
+        stations = get_json(url).get('stations', [])
         return [(station['name'], station['latitude'], station['longitude']) for station in stations]
     except Exception as e:
         print("Error fetching weather stations data:", e)
         sys.exit(1)
 
 def seed_weather_stations(weather_stations):
+    """Upsert the weather stations and return their {(name, latitude, longitude): Id} map."""
+    spec = SPECS["WeatherStation"]
     try:
-        conn = psycopg2.connect(**db_params)
-        cur = conn.cursor()
-        insert_query = """
-            INSERT INTO "WeatherStation" ("Name", "Latitude", "Longitude")
-            VALUES (%s, %s, %s)
-            ON CONFLICT DO NOTHING;
-        """
-        select_query = """
-            SELECT 1 FROM "WeatherStation" WHERE "Name" = %s AND "Latitude" = %s AND "Longitude" = %s;
-        """
-
-        countInsert = 0  # Initialize countInsert
-
-        for station in weather_stations:
-            cur.execute(select_query, station)
-            if not cur.fetchone():
-                cur.execute(insert_query, station)
-                countInsert += 1
-
-        conn.commit()
-        print(f"{countInsert} weather stations were successfully inserted.")
-        cur.close()
-        conn.close()
+        with transaction() as cur:
+            station_ids, countInsert, _ = upsert_key_map(
+                cur, "WeatherStation", spec.key_columns, spec.value_columns, weather_stations)
+
+        print(f"{countInsert} weather stations were successfully inserted "
+              f"({len(station_ids) - countInsert} already present).")
+        return station_ids
     except Exception as e:
         print("Error inserting weather station data:", e)
         sys.exit(1)
 
-def fetch_weather_forecast(latitude, longitude):
-    end_date = datetime.now().strftime('%Y-%m-%d')
-    start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-    url = f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&hourly=temperature_2m,relative_humidity_2m,dew_point_2m,apparent_temperature,precipitation,rain,snowfall,weather_code,pressure_msl,surface_pressure,cloud_cover,cloud_cover_low,cloud_cover_mid,cloud_cover_high,et0_fao_evapotranspiration,vapour_pressure_deficit,wind_speed_10m,wind_speed_20m,wind_speed_50m,wind_speed_100m,wind_speed_150m,wind_speed_200m,wind_direction_10m,wind_direction_20m,wind_direction_50m,wind_direction_100m,wind_direction_150m,wind_direction_200m,wind_gusts_10m,temperature_20m,temperature_50m,temperature_100m,temperature_150m,temperature_200m&start_date={start_date}&end_date={end_date}&models=meteofrance_seamless"
+def sync_reference_tables(weather_stations, french_cities, departments, dry_run=False):
+    """Apply only the upstream inserts, updates and deletes to the reference tables."""
+    # Upstream records laid out as (natural key..., compared values...)
+    records = {
+        "WeatherStation": ((name, lat, lon) for name, lat, lon in weather_stations),
+        "Cities": ((code, name, lat, lon) for name, lat, lon, code in french_cities),
+        "Departements": ((dept['numero'], dept['nomShort'], dept['lat'], dept['lng']) for dept in departments),
+    }
     try:
-        #print(url)
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.json()
+        with transaction() as cur:
+            reports = {table: sync_table(cur, SPECS[table], rows, dry_run=dry_run) for table, rows in records.items()}
+
+        for table, report in reports.items():
+            print(f"{table}: {report['inserted']} inserted, {report['updated']} updated, "
+                  f"{report['deleted']} deleted, {report['unchanged']} unchanged.")
+
     except Exception as e:
-        print(f"Error fetching weather forecast data for {latitude}, {longitude}:", e)
+        print("Error synchronising reference data:", e)
         sys.exit(1)
 
-def seed_weather_forecast(weather_stations):
+def refresh_nearest_stations():
+    """Recompute the city and department to nearest weather station mappings."""
     try:
-        # Establish database connection
-        conn = psycopg2.connect(**db_params)
-        cur = conn.cursor()
-
-        # SQL query to insert weather data
-        insert_query = """
-            INSERT INTO "WeatherDatas" (
-            "WeatherStationId", "Timestamp", "temperature_2m",
-            "relative_humidity_2m", "dew_point_2m", "apparent_temperature",
-            "precipitation", "rain", "snowfall", "weather_code",
-            "cloud_cover", "cloud_cover_low", "cloud_cover_mid",
-            "cloud_cover_high", "pressure_msl", "surface_pressure",
-            "vapour_pressure_deficit", "evapotranspiration", "wind_speed_10m",
-            "wind_speed_20m", "wind_speed_50m", "wind_speed_100m",
-            "wind_speed_150m", "wind_speed_200m", "wind_direction_10m",
-            "wind_direction_20m", "wind_direction_50m", "wind_direction_100m",
-            "wind_direction_150m", "wind_direction_200m", "wind_gusts_10m",
-            "temperature_20m", "temperature_50m", "temperature_100m",
-            "temperature_150m", "temperature_200m"
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT DO NOTHING;
-        """
-
-        # SQL query to check if weather data already exists
-        select_query = """
-            SELECT 1 FROM "WeatherDatas" WHERE "WeatherStationId" = %s AND "Timestamp" = %s AND
-            "temperature_2m" = %s AND "relative_humidity_2m" = %s AND "dew_point_2m" = %s AND
-            "apparent_temperature" = %s AND "precipitation" = %s AND "rain" = %s AND
-            "snowfall" = %s AND "weather_code" = %s AND "cloud_cover" = %s AND
-            "cloud_cover_low" = %s AND "cloud_cover_mid" = %s AND "cloud_cover_high" = %s AND
-            "pressure_msl" = %s AND "surface_pressure" = %s AND "vapour_pressure_deficit" = %s AND
-            "evapotranspiration" = %s AND "wind_speed_10m" = %s AND "wind_speed_20m" = %s AND
-            "wind_speed_50m" = %s AND "wind_speed_100m" = %s AND "wind_speed_150m" = %s AND
-            "wind_speed_200m" = %s AND "wind_direction_10m" = %s AND "wind_direction_20m" = %s AND
-            "wind_direction_50m" = %s AND "wind_direction_100m" = %s AND "wind_direction_150m" = %s AND
-            "wind_direction_200m" = %s AND "wind_gusts_10m" = %s AND "temperature_20m" = %s AND
-            "temperature_50m" = %s AND "temperature_100m" = %s AND "temperature_150m" = %s AND
-            "temperature_200m" = %s;
-        """
-
-        count_insert = 0  # Initialize count for inserted records
-
-        # Loop through weather stations to fetch and insert forecast data
-        for station in weather_stations:
-            latitude, longitude = station[1], station[2]
-            cur.execute('SELECT "Id" FROM "WeatherStation" WHERE "Latitude" = %s AND "Longitude" = %s', (latitude, longitude))
-            weather_station_id = cur.fetchone()
-
-            if weather_station_id:
-                weather_station_id = weather_station_id[0]
-                forecast_data = fetch_weather_forecast(latitude, longitude)
-
-                if forecast_data:
-                    # Extract the hourly times and weather data
-                    times = forecast_data.get('hourly', {}).get('time', [])
-                    temperature_2m = forecast_data.get('hourly', {}).get('temperature_2m', [])
-                    relative_humidity_2m = forecast_data.get('hourly', {}).get('relative_humidity_2m', [])
-                    dew_point_2m = forecast_data.get('hourly', {}).get('dew_point_2m', [])
-                    apparent_temperature = forecast_data.get('hourly', {}).get('apparent_temperature', [])
-                    precipitation = forecast_data.get('hourly', {}).get('precipitation', [])
-                    rain = forecast_data.get('hourly', {}).get('rain', [])
-                    snowfall = forecast_data.get('hourly', {}).get('snowfall', [])
-                    weather_code = forecast_data.get('hourly', {}).get('weather_code', [])
-                    cloud_cover = forecast_data.get('hourly', {}).get('cloud_cover', [])
-                    cloud_cover_low = forecast_data.get('hourly', {}).get('cloud_cover_low', [])
-                    cloud_cover_mid = forecast_data.get('hourly', {}).get('cloud_cover_mid', [])
-                    cloud_cover_high = forecast_data.get('hourly', {}).get('cloud_cover_high', [])
-                    pressure_msl = forecast_data.get('hourly', {}).get('pressure_msl', [])
-                    surface_pressure = forecast_data.get('hourly', {}).get('surface_pressure', [])
-                    vapour_pressure_deficit = forecast_data.get('hourly', {}).get('vapour_pressure_deficit', [])
-                    evapotranspiration = forecast_data.get('hourly', {}).get('et0_fao_evapotranspiration', [])
-                    wind_speed_10m = forecast_data.get('hourly', {}).get('wind_speed_10m', [])
-                    wind_speed_20m = forecast_data.get('hourly', {}).get('wind_speed_20m', [])
-                    wind_speed_50m = forecast_data.get('hourly', {}).get('wind_speed_50m', [])
-                    wind_speed_100m = forecast_data.get('hourly', {}).get('wind_speed_100m', [])
-                    wind_speed_150m = forecast_data.get('hourly', {}).get('wind_speed_150m', [])
-                    wind_speed_200m = forecast_data.get('hourly', {}).get('wind_speed_200m', [])
-                    wind_direction_10m = forecast_data.get('hourly', {}).get('wind_direction_10m', [])
-                    wind_direction_20m = forecast_data.get('hourly', {}).get('wind_direction_20m', [])
-                    wind_direction_50m = forecast_data.get('hourly', {}).get('wind_direction_50m', [])
-                    wind_direction_100m = forecast_data.get('hourly', {}).get('wind_direction_100m', [])
-                    wind_direction_150m = forecast_data.get('hourly', {}).get('wind_direction_150m', [])
-                    wind_direction_200m = forecast_data.get('hourly', {}).get('wind_direction_200m', [])
-                    wind_gusts_10m = forecast_data.get('hourly', {}).get('wind_gusts_10m', [])
-                    temperature_20m = forecast_data.get('hourly', {}).get('temperature_20m', [])
-                    temperature_50m = forecast_data.get('hourly', {}).get('temperature_50m', [])
-                    temperature_100m = forecast_data.get('hourly', {}).get('temperature_100m', [])
-                    temperature_150m = forecast_data.get('hourly', {}).get('temperature_150m', [])
-                    temperature_200m = forecast_data.get('hourly', {}).get('temperature_200m', [])
-
-                    # Loop through each timestamp (i)
-                    for i, timestamp in enumerate(times):
-                        # Prepare values for insertion
-                        data = [
-                            temperature_2m[i], relative_humidity_2m[i], dew_point_2m[i], apparent_temperature[i],
-                            precipitation[i], rain[i], snowfall[i], weather_code[i], cloud_cover[i],
-                            cloud_cover_low[i], cloud_cover_mid[i], cloud_cover_high[i], pressure_msl[i],
-                            surface_pressure[i], vapour_pressure_deficit[i], evapotranspiration[i],
-                            wind_speed_10m[i], wind_speed_20m[i], wind_speed_50m[i], wind_speed_100m[i],
-                            wind_speed_150m[i], wind_speed_200m[i], wind_direction_10m[i], wind_direction_20m[i],
-                            wind_direction_50m[i], wind_direction_100m[i], wind_direction_150m[i],
-                            wind_direction_200m[i], wind_gusts_10m[i], temperature_20m[i], temperature_50m[i],
-                            temperature_100m[i], temperature_150m[i], temperature_200m[i]
-                        ]
-                        values = (weather_station_id, timestamp, *data)
-
-                        # Check if data already exists for the given station and timestamp
-                        cur.execute(select_query, values)
-                        if not cur.fetchone():
-                            try:
-                                # Insert the data into the database
-                                cur.execute(insert_query, values)
-                                count_insert += 1
-                            except Exception as insert_error:
-                                print("Insert failed:", insert_error)
-
-        # Commit the changes
-        conn.commit()
-        print(f"{count_insert} records were successfully inserted.")
-        cur.close()
-        conn.close()
+        with transaction() as cur:
+            counts = refresh_station_mappings(cur)
+
+        for mapping, count in counts.items():
+            print(f"{count} rows written to {mapping}.")
 
     except Exception as e:
-        print("Error inserting weather forecast data:", e)
+        print("Error refreshing nearest weather stations:", e)
         sys.exit(1)
 
 def insert_permissions_and_roles():
     """Insert permissions and roles into the database."""
     try:
-        # Establish database connection
-        conn = psycopg2.connect(**db_paramsinvites)
-        cur = conn.cursor()
-
-        # Define permissions
-        permissions = [
-            'create data',
-            'edit data',
-            'delete data',
-            'view data',
-            'can invite',
-            'edit profile',
-            'view dashboard'
-        ]
-
-        # Define roles and their associated permissions
-        roles_permissions = {
-            'admin': permissions,
-            'manager': ['create data', 'edit data', 'view data', 'edit profile', 'view dashboard'],
-            'moderateur': ['view data', 'edit profile', 'view dashboard'],
-            'user': ['view data']
-        }
-
-        # Guard name to be used for both permissions and roles
-        guard_name = 'web'
-
-        # Create permissions if they don't already exist
-        for permission in permissions:
-            cur.execute("""
-                INSERT INTO permissions (name, guard_name)
-                SELECT %s, %s
-                WHERE NOT EXISTS (SELECT 1 FROM permissions WHERE name = %s);
-            """, (permission, guard_name, permission))
-
-        # Create roles and assign permissions
-        for role, perms in roles_permissions.items():
-            cur.execute("""
-                INSERT INTO roles (name, guard_name)
-                SELECT %s, %s
-                WHERE NOT EXISTS (SELECT 1 FROM roles WHERE name = %s);
-            """, (role, guard_name, role))
-
-            # Assign permission to the role (assuming many-to-many relationship through role_permissions table)
-            for perm in perms:
-                cur.execute("""
-                    INSERT INTO role_has_permissions (role_id, permission_id)
-                    SELECT r.id, p.id
-                    FROM roles r
-                    JOIN permissions p ON p.name = %s
-                    WHERE r.name = %s AND p.guard_name = %s
-                    ON CONFLICT DO NOTHING;
-                """, (perm, role, guard_name))
-
-        # Commit changes and close the connection
-        conn.commit()
+        # Borrow a pooled connection; the block commits on success
+        with transaction("invites") as cur:
+            # Define permissions
+            permissions = [
+                'create data',
+                'edit data',
+                'delete data',
+                'view data',
+                'can invite',
+                'edit profile',
+                'view dashboard'
+            ]
+
+            # Define roles and their associated permissions
+            roles_permissions = {
+                'admin': permissions,
+                'manager': ['create data', 'edit data', 'view data', 'edit profile', 'view dashboard'],
+                'moderateur': ['view data', 'edit profile', 'view dashboard'],
+                'user': ['view data']
+            }
+
+            # Permissions, roles and their links are each created in one statement
+            seed_rbac(cur, roles_permissions, guard_name='web', permissions=permissions)
 
         print("Permissions and roles inserted successfully.")
 
-        cur.close()
-        conn.close()
-
     except Exception as e:
         print(f"Error during seeding: {e}")
         sys.exit(1)
 
-def generate_token(length=32):
-    """Generate a random token of a specified length."""
-    return secrets.token_urlsafe(length)
-
 def insert_invite():
     """Insert a new invite into the 'invites' table."""
-    token = generate_token()  # Generate a random token
-    print(token)
-    expires_at = (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
-    created_at = updated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
     try:
-        conn = psycopg2.connect(**db_paramsinvites)
-        cur = conn.cursor()
+        with transaction("invites") as cur:
+            [(token, _)] = issue_invites(cur, 1)
+        print(token)
 
-        # Insert the invite into the 'invites' table
-        insert_query = """
-            INSERT INTO "invites" ("token", "expires_at", "created_at", "updated_at")
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT DO NOTHING;  -- Prevent duplicates (if needed)
-        """
+        print(f"Invite with token {token} inserted successfully.")
 
-        cur.execute(insert_query, (token, expires_at, created_at, updated_at))
-        conn.commit()
+    except Exception as e:
+        print(f"Error inserting invite data: {e}")
 
-        print(f"Invite with token {token} inserted successfully.")
+def main():
+    parser = argparse.ArgumentParser(description="Seed the laravel and invites databases.")
+    parser.add_argument("--forecast", action="store_true",
+                        help="also fetch and store the weather forecast of every station")
+    parser.add_argument("--concurrency", type=int, default=FORECAST_CONCURRENCY,
+                        help="number of forecast requests in flight at once (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=FORECAST_WORKERS,
+                        help="processes ingesting shards of the stations in parallel (default: %(default)s)")
+    parser.add_argument("--sync", action="store_true",
+                        help="apply upstream inserts, updates and deletes to the reference tables instead of only adding rows")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="with --sync, only print the change report")
+    parser.add_argument("--stream", action="store_true",
+                        help="parse the communes incrementally and stream them into the database with bounded memory")
+    args = parser.parse_args()
+
+    with phase("stations.fetch"):
+        weather_stations = fetch_weather_stations()
+    if not weather_stations:
+        print("No weather station data to insert.")
+        sys.exit(1)
+
+    # Fetch all French city location data, unless it is streamed into the database below
+    stream_cities = args.stream and not (args.sync or args.dry_run)
+    french_cities = None
+    if not stream_cities:
+        with phase("cities.fetch"):
+            french_cities = fetch_french_cities()
+        if not french_cities:
+            print("No French city location data to insert.")
+            sys.exit(1)
+
+    # Fetch all departments
+    with phase("departments.fetch"):
+        departments = fetch_departments()
+    if not departments:
+        print("No department data to insert.")
+        sys.exit(1)
 
-        cur.close()
-        conn.close()
+    station_ids = None
+    if args.sync or args.dry_run:
+        with phase("reference.sync"):
+            sync_reference_tables(weather_stations, french_cities, departments, dry_run=args.dry_run)
+    else:
+        with phase("stations.seed"):
+            station_ids = seed_weather_stations(weather_stations)
+        with phase("cities.seed"):
+            if stream_cities:
+                if not any(seed_city_locations(iter_french_cities())):
+                    print("No French city location data to insert.")
+                    sys.exit(1)
+            else:
+                seed_city_locations(french_cities)
+        with phase("departments.seed"):
+            seed_departments(departments)
+
+    # Map every city and department to its nearest weather stations
+    with phase("nearest_stations.refresh"):
+        refresh_nearest_stations()
+
+    # Run the seeding function
+    with phase("rbac.seed"):
+        insert_permissions_and_roles()
+
+    # Call the function to insert invite
+    with phase("invites.seed"):
+        insert_invite()
+
+    if args.forecast:
+        with phase("forecast"):
+            seed_weather_forecast(weather_stations, max_in_flight=args.concurrency, station_ids=station_ids,
+                                  workers=args.workers)
+
+    # Latency, retries and throttling of every upstream API, forecast workers included
+    print_stats(metrics.registry.snapshot()['http'])
+
+    try:
+        with transaction() as cur:
+            cur.execute("SELECT pg_size_pretty(pg_database_size('laravel'));")
+            db_size = cur.fetchone()
+            print(f"Database size: {db_size[0]}")
+            cur.execute("SELECT pg_size_pretty(pg_database_size('invites'));")
+            db_size = cur.fetchone()
+            print(f"Database size: {db_size[0]}")
 
     except Exception as e:
-        print(f"Error inserting invite data: {e}")
+        print("Error fetching database size:", e)
+        sys.exit(1)
+    finally:
+        close_all()
 
-weather_stations = fetch_weather_stations()
-if weather_stations:
-    seed_weather_stations(weather_stations)
-else:
-    print("No weather station data to insert.")
-    sys.exit(1)
-
-# Fetch and seed all French city location data
-french_cities = fetch_french_cities()
-if french_cities:
-    seed_city_locations(french_cities)
-else:
-    print("No French city location data to insert.")
-    sys.exit(1)
-
-# Fetch all departments and seed them
-departments = fetch_departments()
-if departments:
-    seed_departments(departments)
-else:
-    print("No department data to insert.")
-    sys.exit(1)
-
-# Run the seeding function
-insert_permissions_and_roles()
-
-# Call the function to insert invite
-insert_invite()
-
-#seed_weather_forecast(weather_stations)
-
-try:
-    conn = psycopg2.connect(**db_params)
-    cur = conn.cursor()
-    cur.execute("SELECT pg_size_pretty(pg_database_size('laravel'));")
-    db_size = cur.fetchone()
-    print(f"Database size: {db_size[0]}")
-    cur.execute("SELECT pg_size_pretty(pg_database_size('invites'));")
-    db_size = cur.fetchone()
-    print(f"Database size: {db_size[0]}")
-    cur.close()
-    conn.close()
-
-except Exception as e:
-    print("Error fetching database size:", e)
-    sys.exit(1)
+if __name__ == "__main__":
+    # Time every phase and statement of the run, and write them out however it ends
+    metrics.install()
+    try:
+        main()
+    finally:
+        metrics.print_summary()
+        paths = metrics.export("seed")
+        if paths:
+            print(f"Metrics written to {paths[0]} and {paths[1]}.")
@@ -0,0 +1,147 @@
+"""Local stand-in for the geo, station and Open-Meteo APIs used by the seeders.
+
+Every payload is synthetic and deterministic, sized by the number of
+stations, cities and forecast hours asked for.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from datetime import datetime, timedelta
+import argparse
+import json
+import math
+import threading
+import time
+
+# Variables returned as integers by Open-Meteo
+INTEGER_VARIABLES = {'weather_code', 'relative_humidity_2m', 'cloud_cover', 'cloud_cover_low',
+                     'cloud_cover_mid', 'cloud_cover_high'}
+
+
+def station_coordinates(i):
+    """Spread stations deterministically over metropolitan France."""
+    return round(42.0 + (i * 7919 % 9000) / 1000, 4), round(-4.5 + (i * 104729 % 12500) / 1000, 4)
+
+
+def stations_payload(count):
+    stations = []
+    for i in range(count):
+        latitude, longitude = station_coordinates(i)
+        stations.append({'name': f"Station {i:05d}", 'latitude': latitude, 'longitude': longitude})
+    return {'stations': stations}
+
+
+def communes_payload(count):
+    communes = []
+    for i in range(count):
+        latitude, longitude = station_coordinates(i * 31 + 7)
+        communes.append({'nom': f"Commune {i}", 'code': f"{i:05d}",
+                         'centre': {'type': 'Point', 'coordinates': [longitude, latitude]}})
+    return communes
+
+
+def departments_payload():
+    departments = []
+    for i in range(1, 102):
+        latitude, longitude = station_coordinates(i * 97)
+        departments.append({'numero': f"{i:02d}", 'nomShort': f"Departement {i}", 'lat': latitude, 'lng': longitude})
+    return departments
+
+
+def forecast_payload(latitude, longitude, variables, start, hours):
+    """Build an Open-Meteo style hourly payload of the given length."""
+    times = [(start + timedelta(hours=h)).strftime('%Y-%m-%dT%H:%M') for h in range(hours)]
+    hourly = {'time': times}
+    phase = latitude + longitude
+    for n, variable in enumerate(variables):
+        if variable.startswith('wind_direction'):
+            hourly[variable] = [int((phase * 10 + h * 3 + n) % 360) for h in range(hours)]
+        elif variable in INTEGER_VARIABLES:
+            hourly[variable] = [int((phase + h + n) % 100) for h in range(hours)]
+        else:
+            hourly[variable] = [round(10 + 8 * math.sin((h + n + phase) / 24 * 2 * math.pi), 1) for h in range(hours)]
+    return {'latitude': latitude, 'longitude': longitude, 'timezone': 'GMT',
+            'hourly_units': {variable: '' for variable in variables}, 'hourly': hourly}
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    server_version = "FakeApi/1.0"
+
+    def do_GET(self):
+        config = self.server.config
+        if config['latency']:
+            time.sleep(config['latency'])
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        self.server.requests[parsed.path] = self.server.requests.get(parsed.path, 0) + 1
+
+        if parsed.path == '/communes':
+            payload = config['communes']
+        elif parsed.path == '/depts.json':
+            payload = config['departments']
+        elif parsed.path == '/api/stations':
+            payload = config['stations']
+        elif parsed.path == '/v1/forecast':
+            variables = query.get('hourly', [''])[0].split(',')
+            hours = config['hours']
+            if 'start_hour' in query:
+                # Hour range requests return the hours between both bounds, inclusive
+                start = datetime.strptime(query['start_hour'][0], '%Y-%m-%dT%H:%M')
+                end = datetime.strptime(query['end_hour'][0], '%Y-%m-%dT%H:%M')
+                hours = max(0, min(hours, int((end - start).total_seconds() // 3600) + 1))
+            else:
+                start = datetime.strptime(query.get('start_date', [datetime.utcnow().strftime('%Y-%m-%d')])[0], '%Y-%m-%d')
+            # Coordinate lists get one result per location in an array, as Open-Meteo does
+            latitudes = query['latitude'][0].split(',')
+            longitudes = query['longitude'][0].split(',')
+            payload = [forecast_payload(float(latitude), float(longitude), variables, start, hours)
+                       for latitude, longitude in zip(latitudes, longitudes)]
+            if len(payload) == 1:
+                payload = payload[0]
+        else:
+            self.send_error(404)
+            return
+
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(stations=200, cities=35000, hours=168, latency_ms=0, host='127.0.0.1', port=0):
+    """Start the stand-in API on a background thread and return (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), FakeApiHandler)
+    server.daemon_threads = True
+    server.requests = {}
+    server.config = {
+        'stations': stations_payload(stations),
+        'communes': communes_payload(cities),
+        'departments': departments_payload(),
+        'hours': hours,
+        'latency': latency_ms / 1000,
+    }
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve synthetic geo, station and forecast data.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--stations", type=int, default=200)
+    parser.add_argument("--cities", type=int, default=35000)
+    parser.add_argument("--hours", type=int, default=168)
+    parser.add_argument("--latency-ms", type=int, default=0, help="delay added to every response")
+    args = parser.parse_args()
+
+    server, url = start_server(args.stations, args.cities, args.hours, args.latency_ms, port=args.port)
+    print(f"Serving on {url} (GEO_API_URL={url} STATIONS_URL={url}/api/stations "
+          f"DEPARTMENTS_URL={url}/depts.json OPEN_METEO_URL={url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
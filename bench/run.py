@@ -0,0 +1,316 @@
+"""Time every seeding stage against the local Postgres and a stand-in API.
+
+Reports rows/sec, database round trips, peak RSS and RSS growth per stage,
+and exits with status 1 when a stage regresses past the stored baseline.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import psycopg2.extensions  # noqa: E402
+import fake_api  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+_round_trips = 0
+_round_trips_lock = threading.Lock()
+
+
+def _count(n=1):
+    global _round_trips
+    with _round_trips_lock:
+        _round_trips += n
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Cursor counting every statement sent to the server."""
+
+    def execute(self, query, vars=None):
+        _count()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        _count(len(vars_list))
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        _count()
+        return super().copy_expert(sql, file, size)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    """Connection handing out counting cursors and counting commits and rollbacks."""
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault('cursor_factory', CountingCursor)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        _count()
+        return super().commit()
+
+    def rollback(self):
+        _count()
+        return super().rollback()
+
+
+def _proc_status_mb(field):
+    """Return a kB field of /proc/self/status in MiB, or None where it is not available."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def rss_mb():
+    """Current resident set size of this process, in MiB."""
+    current = _proc_status_mb('VmRSS')
+    return current if current is not None else peak_rss_mb()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process since the last reset_peak_rss(), in MiB."""
+    peak = _proc_status_mb('VmHWM')
+    return peak if peak is not None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss():
+    """Restart the peak RSS from the current RSS; returns False where Linux's clear_refs is not available.
+
+    Without it the peak of a stage is the peak of the whole run so far.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+@contextmanager
+def stage(name, results):
+    """Measure a stage; the block sets metrics['rows'] to the number of rows it handled.
+
+    peak_rss_mb is the highest RSS reached during the stage, memory kept from
+    earlier stages included; rss_growth_mb is how far above its starting RSS it went.
+    """
+    metrics = {'rows': 0}
+    start_trips = _round_trips
+    start_rss = rss_mb()
+    reset_peak_rss()
+    start = time.perf_counter()
+    yield metrics
+    elapsed = time.perf_counter() - start
+    peak = peak_rss_mb()
+    metrics.update({
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(metrics['rows'] / elapsed, 1) if elapsed else 0.0,
+        'round_trips': _round_trips - start_trips,
+        'peak_rss_mb': round(peak, 1),
+        'rss_growth_mb': round(max(peak - start_rss, 0.0), 1),
+    })
+    results[name] = metrics
+
+
+def load_seed_module():
+    """Import DB-fake-seed.py, whose file name is not a valid module name."""
+    spec = importlib.util.spec_from_file_location('db_fake_seed', os.path.join(ROOT, 'DB-fake-seed.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def count_rows(db, table):
+    with db.transaction() as cur:
+        cur.execute(f'SELECT count(*) FROM "{table}";')
+        return cur.fetchone()[0]
+
+
+def count_failed_stations(db):
+    """Number of stations whose last forecast attempt failed."""
+    with db.transaction() as cur:
+        cur.execute('SELECT count(*) FROM "ForecastWatermark" WHERE "LastError" IS NOT NULL;')
+        return cur.fetchone()[0]
+
+
+def stale_rollups(db):
+    """Return {rollup table: rows} a full rebuild would write; all zero when the incremental refreshes kept up."""
+    from rollups import all_buckets, refresh_rollups
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            written = refresh_rollups(cur, all_buckets(cur))
+        conn.rollback()
+    return written
+
+
+def compare(results, baseline, tolerance):
+    """Return the list of regressions of results against baseline."""
+    failures = []
+    for name, expected in baseline.get('stages', {}).items():
+        current = results.get(name)
+        if current is None:
+            continue
+        if current['rows_per_sec'] < expected['rows_per_sec'] * (1 - tolerance):
+            failures.append(f"{name}: {current['rows_per_sec']} rows/sec, baseline {expected['rows_per_sec']}")
+        if current['round_trips'] > expected['round_trips'] * (1 + tolerance):
+            failures.append(f"{name}: {current['round_trips']} round trips, baseline {expected['round_trips']}")
+        if current['peak_rss_mb'] > expected['peak_rss_mb'] * (1 + tolerance):
+            failures.append(f"{name}: {current['peak_rss_mb']} MiB peak RSS, baseline {expected['peak_rss_mb']}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the seeding stages.")
+    parser.add_argument("--stations", type=int, default=200, help="number of weather stations (N)")
+    parser.add_argument("--cities", type=int, default=35000, help="number of communes")
+    parser.add_argument("--hours", type=int, default=168, help="forecast hours per station (H, at most 336)")
+    parser.add_argument("--latency-ms", type=int, default=0, help="delay added to every API response")
+    parser.add_argument("--concurrency", type=int, default=8, help="forecast requests in flight")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="forecast ingestion processes (their round trips are not counted)")
+    parser.add_argument("--reset", action="store_true",
+                        help="empty the reference and weather tables first (use a dedicated database)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file (default: %(default)s)")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative regression before failing (default: %(default)s)")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    server, url = fake_api.start_server(args.stations, args.cities, args.hours, args.latency_ms)
+
+    # The seeders read their endpoints at import time
+    os.environ.update({
+        'GEO_API_URL': url,
+        'DEPARTMENTS_URL': f"{url}/depts.json",
+        'STATIONS_URL': f"{url}/api/stations",
+        'OPEN_METEO_URL': url,
+        'HTTP_CACHE_DIR': tempfile.mkdtemp(prefix='bench-http-cache-'),
+        'HTTP_CACHE_TTL': '0',
+    })
+    seed = load_seed_module()
+    import db
+    db.set_connection_factory(CountingConnection)
+
+    if args.reset:
+        with db.transaction() as cur:
+            cur.execute('TRUNCATE "WeatherStation", "Cities", "Departements" RESTART IDENTITY CASCADE;')
+
+    workload = {key: getattr(args, key) for key in ('stations', 'cities', 'hours', 'latency_ms', 'concurrency')}
+    if args.workers > 1:
+        # Kept out of single-process workloads so that existing baselines still compare
+        workload['workers'] = args.workers
+    results = {}
+
+    with stage('reference_fetch', results) as metrics:
+        weather_stations = seed.fetch_weather_stations()
+        french_cities = seed.fetch_french_cities()
+        departments = seed.fetch_departments()
+        metrics['rows'] = len(weather_stations) + len(french_cities) + len(departments)
+
+    with stage('station_seed', results) as metrics:
+        station_ids = seed.seed_weather_stations(weather_stations)
+        metrics['rows'] = len(weather_stations)
+
+    with stage('city_seed', results) as metrics:
+        seed.seed_city_locations(french_cities)
+        metrics['rows'] = len(french_cities)
+
+    with stage('department_seed', results) as metrics:
+        seed.seed_departments(departments)
+        metrics['rows'] = len(departments)
+
+    with stage('nearest_stations', results) as metrics:
+        # Department rollups only cover stations mapped to a department
+        seed.refresh_nearest_stations()
+        metrics['rows'] = count_rows(db, 'CityNearestStation') + count_rows(db, 'DepartementNearestStation')
+
+    before = count_rows(db, 'WeatherHourly')
+    with stage('forecast_ingest', results):
+        try:
+            seed.seed_weather_forecast(weather_stations, max_in_flight=args.concurrency, station_ids=station_ids,
+                                       workers=args.workers)
+        except SystemExit:
+            # The seeder exits when stations failed; the checks below report it
+            pass
+    results['forecast_ingest']['rows'] = rows = count_rows(db, 'WeatherHourly') - before
+    seconds = results['forecast_ingest']['seconds']
+    results['forecast_ingest']['rows_per_sec'] = round(rows / seconds, 1) if seconds else 0.0
+
+    # A stage that ran fast but wrote nothing must not pass as a speedup
+    broken = []
+    failed = count_failed_stations(db)
+    if failed:
+        broken.append(f"forecast_ingest: {failed} stations failed (see ForecastWatermark.LastError)")
+    if not rows:
+        broken.append("forecast_ingest: no hourly row written")
+    elif args.reset and rows != args.stations * args.hours:
+        broken.append(f"forecast_ingest: {rows} hourly rows written, expected {args.stations * args.hours}")
+    # The rollups refreshed from the touched days must match a rebuild from WeatherHourly
+    for table, count in stale_rollups(db).items():
+        if count:
+            broken.append(f"forecast_ingest: {count} {table} rows missing or stale after ingestion")
+    if rows and not count_rows(db, 'DepartementDailyRollup'):
+        broken.append("forecast_ingest: no DepartementDailyRollup row refreshed")
+
+    server.shutdown()
+    db.close_all()
+
+    print(f"{'stage':<18}{'rows':>10}{'seconds':>10}{'rows/sec':>12}{'round trips':>13}{'peak RSS MiB':>14}"
+          f"{'RSS growth MiB':>16}")
+    for name, metrics in results.items():
+        print(f"{name:<18}{metrics['rows']:>10}{metrics['seconds']:>10}{metrics['rows_per_sec']:>12}"
+              f"{metrics['round_trips']:>13}{metrics['peak_rss_mb']:>14}{metrics['rss_growth_mb']:>16}")
+    if not reset_peak_rss():
+        print("Peak RSS cannot be reset on this system: each stage reports the peak of the run so far.")
+
+    for failure in broken:
+        print(f"FAILED {failure}")
+
+    report = {'workload': workload, 'stages': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if broken:
+        sys.exit(1)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}.")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline stored yet; run with --update-baseline to create one.")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('workload') != workload:
+        print(f"Workload {workload} differs from the baseline's {baseline.get('workload')}; not comparing.")
+        sys.exit(1)
+    failures = compare(results, baseline, args.tolerance)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    if failures:
+        sys.exit(1)
+    print("No regression against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
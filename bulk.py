@@ -0,0 +1,242 @@
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+
+def _copy_value(value):
+    """Render a single value in PostgreSQL COPY text format."""
+    if value is None:
+        return '\\N'
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+class RowStream:
+    """File-like object that renders an iterable of rows as COPY text on demand.
+
+    Rows are pulled lazily as psycopg2 reads from the stream, so the full
+    payload is never materialised a second time in memory.
+    """
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ''
+        self.count = 0
+
+    def read(self, size=-1):
+        parts = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            line = '\t'.join(_copy_value(value) for value in row) + '\n'
+            parts.append(line)
+            length += len(line)
+            self.count += 1
+        data = ''.join(parts)
+        if size < 0:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    readline = read
+
+
+def copy_merge(cur, table, columns, rows, key_columns=None, fallback_columns=None):
+    """Bulk load rows into table, skipping rows that already exist.
+
+    The rows are streamed through COPY FROM STDIN into a temporary staging
+    table, then merged with a single INSERT ... SELECT that leaves out rows
+    already present (matched on key_columns, or on every column by default).
+    Existing rows whose key columns are NULL are matched on fallback_columns
+    instead and given the key of their staged row, so they are not inserted
+    a second time. Returns a tuple (inserted, skipped).
+    """
+    key_columns = key_columns or columns
+    staging = sql.Identifier(f'staging_{table}')
+    target = sql.Identifier(table)
+    column_list = sql.SQL(', ').join(map(sql.Identifier, columns))
+
+    # Staging table with the same column types as the target, dropped on commit
+    cur.execute(sql.SQL('DROP TABLE IF EXISTS {staging}').format(staging=staging))
+    cur.execute(sql.SQL(
+        'CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {columns} FROM {target} WITH NO DATA'
+    ).format(staging=staging, columns=column_list, target=target))
+
+    stream = RowStream(rows)
+    cur.copy_expert(
+        sql.SQL('COPY {staging} ({columns}) FROM STDIN').format(
+            staging=staging, columns=column_list
+        ).as_string(cur),
+        stream
+    )
+    cur.execute(sql.SQL('ANALYZE {staging}').format(staging=staging))
+
+    if fallback_columns:
+        # One row per key, and none taking a key another row already has
+        cur.execute(sql.SQL("""
+            UPDATE {target} t SET ({keys}) = ROW({matched_keys})
+            FROM (
+                SELECT DISTINCT ON ({source_keys}) o."Id", {source_keys}
+                FROM {staging} s JOIN {target} o ON {fallback_match}
+                WHERE {key_missing}
+                  AND NOT EXISTS (SELECT 1 FROM {target} k WHERE {key_match})
+                ORDER BY {source_keys}, o."Id"
+            ) m
+            WHERE t."Id" = m."Id";
+        """).format(
+            target=target,
+            staging=staging,
+            keys=sql.SQL(', ').join(map(sql.Identifier, key_columns)),
+            matched_keys=sql.SQL(', ').join(sql.SQL('m.{}').format(sql.Identifier(col)) for col in key_columns),
+            source_keys=sql.SQL(', ').join(sql.SQL('s.{}').format(sql.Identifier(col)) for col in key_columns),
+            fallback_match=sql.SQL(' AND ').join(
+                sql.SQL('o.{col} = s.{col}').format(col=sql.Identifier(col)) for col in fallback_columns),
+            key_missing=sql.SQL(' AND ').join(
+                sql.SQL('o.{} IS NULL').format(sql.Identifier(col)) for col in key_columns),
+            key_match=sql.SQL(' AND ').join(
+                sql.SQL('k.{col} = s.{col}').format(col=sql.Identifier(col)) for col in key_columns),
+        ))
+
+    # Set-based merge: one statement for the whole batch
+    match = sql.SQL(' AND ').join(
+        sql.SQL('t.{col} = s.{col}').format(col=sql.Identifier(col)) for col in key_columns
+    )
+    cur.execute(sql.SQL("""
+        INSERT INTO {target} ({columns})
+        SELECT DISTINCT ON ({source_keys}) {source_columns} FROM {staging} s
+        WHERE NOT EXISTS (SELECT 1 FROM {target} t WHERE {match});
+    """).format(
+        target=target,
+        columns=column_list,
+        source_keys=sql.SQL(', ').join(sql.SQL('s.{}').format(sql.Identifier(col)) for col in key_columns),
+        source_columns=sql.SQL(', ').join(sql.SQL('s.{}').format(sql.Identifier(col)) for col in columns),
+        staging=staging,
+        match=match
+    ))
+    inserted = cur.rowcount
+    return inserted, stream.count - inserted
+
+
+def copy_rows(cur, table, columns, rows):
+    """Stream rows straight into table with COPY FROM STDIN and return how many were sent."""
+    stream = RowStream(rows)
+    cur.copy_expert(
+        sql.SQL('COPY {table} ({columns}) FROM STDIN').format(
+            table=sql.Identifier(table),
+            columns=sql.SQL(', ').join(map(sql.Identifier, columns))
+        ).as_string(cur),
+        stream
+    )
+    return stream.count
+
+
+def _values_template(cur, table, columns):
+    """Return an execute_values template casting each value to its column's type.
+
+    A bare NULL literal, or a float compared with a numeric one, would not
+    otherwise get the column type.
+    """
+    cur.execute("""
+        SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped;
+    """, (sql.Identifier(table).as_string(cur),))
+    types = dict(cur.fetchall())
+    return '(' + ', '.join(f'%s::{types[column]}' for column in columns) + ')'
+
+
+def upsert_key_map(cur, table, key_columns, value_columns, rows, page_size=1000):
+    """Insert or update rows of (key..., value...) and return the Id of every key.
+
+    Each page is one statement: rows whose values changed are written and
+    return their Id, and the Ids of the unchanged rows are read back in the
+    same statement, so no tuple is rewritten just to learn its Id. The key
+    columns need a unique index. With no value columns existing rows are left
+    alone. Returns (key map, inserted, updated) where the map goes from the key
+    (a tuple, or the bare value for a single column) to Id.
+    """
+    columns = tuple(key_columns) + tuple(value_columns)
+    single = len(key_columns) == 1
+    # ON CONFLICT cannot touch the same row twice in one statement: last record wins
+    unique = {}
+    for row in rows:
+        unique[tuple(row[:len(key_columns)])] = row
+
+    def identifiers(names, prefix=None):
+        return sql.SQL(', ').join(
+            sql.SQL('{}.{}').format(sql.Identifier(prefix), sql.Identifier(name)) if prefix else sql.Identifier(name)
+            for name in names
+        )
+
+    if not value_columns:
+        conflict = sql.SQL('DO NOTHING')
+    elif len(value_columns) == 1:
+        # SET (a) = (b) is not accepted for a single column
+        conflict = sql.SQL('DO UPDATE SET {value} = excluded.{value} WHERE {current} IS DISTINCT FROM excluded.{value}').format(
+            value=sql.Identifier(value_columns[0]),
+            current=sql.SQL('{}.{}').format(sql.Identifier(table), sql.Identifier(value_columns[0])))
+    else:
+        conflict = sql.SQL('DO UPDATE SET ({values}) = ({excluded}) WHERE ({current}) IS DISTINCT FROM ({excluded})').format(
+            values=identifiers(value_columns),
+            excluded=identifiers(value_columns, 'excluded'),
+            current=identifiers(value_columns, table))
+
+    query = sql.SQL("""
+        WITH input ({columns}) AS (VALUES %s),
+        written AS (
+            INSERT INTO {target} ({columns}) SELECT {columns} FROM input
+            ON CONFLICT ({keys}) {conflict}
+            RETURNING {keys}, "Id", (xmax = 0) AS inserted
+        )
+        SELECT {keys}, "Id", inserted FROM written
+        UNION ALL
+        SELECT {target_keys}, t."Id", NULL FROM {target} t JOIN input USING ({keys})
+        WHERE NOT EXISTS (SELECT 1 FROM written w WHERE {match});
+    """).format(
+        target=sql.Identifier(table),
+        columns=identifiers(columns),
+        keys=identifiers(key_columns),
+        conflict=conflict,
+        target_keys=identifiers(key_columns, 't'),
+        match=sql.SQL(' AND ').join(
+            sql.SQL('w.{col} = input.{col}').format(col=sql.Identifier(col)) for col in key_columns
+        ),
+    ).as_string(cur)
+
+    template = _values_template(cur, table, columns)
+
+    key_map = {}
+    inserted = updated = 0
+    records = list(unique.values())
+    for start in range(0, len(records), page_size):
+        execute_values(cur, query, records[start:start + page_size], template=template, page_size=page_size)
+        for row in cur.fetchall():
+            key, row_id, is_insert = row[:len(key_columns)], row[-2], row[-1]
+            key_map[key[0] if single else tuple(key)] = row_id
+            if is_insert is True:
+                inserted += 1
+            elif is_insert is False:
+                updated += 1
+    return key_map, inserted, updated
+
+
+def load_key_map(cur, table, key_columns, keys, page_size=1000):
+    """Return {key: Id} for the rows of table whose natural key is in keys.
+
+    A single key column is matched in one statement and its keys are bare
+    values; several key columns are matched page by page and their keys are tuples.
+    """
+    if len(key_columns) == 1:
+        cur.execute(sql.SQL('SELECT {key}, "Id" FROM {table} WHERE {key} = ANY(%s)').format(
+            key=sql.Identifier(key_columns[0]), table=sql.Identifier(table)), (list(keys),))
+        return dict(cur.fetchall())
+    columns = sql.SQL(', ').join(map(sql.Identifier, key_columns))
+    query = sql.SQL('SELECT {columns}, "Id" FROM {table} JOIN (VALUES %s) AS input ({columns}) USING ({columns})').format(
+        columns=columns, table=sql.Identifier(table)).as_string(cur)
+    rows = execute_values(cur, query, [tuple(key) for key in keys], template=_values_template(cur, table, key_columns),
+                          page_size=page_size, fetch=True)
+    return {tuple(row[:-1]): row[-1] for row in rows}
@@ -0,0 +1,241 @@
+from dotenv import load_dotenv
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+import functools
+import hashlib
+import json
+import socket
+import threading
+import time
+import uuid
+from psycopg2.extras import execute_values
+from db import connection
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Prefix of every key written to the cache table, shared with the Laravel application
+CACHE_PREFIX = os.getenv('CACHE_PREFIX', 'pythonpop_')
+
+# Size bound and lifetime of the in-process front tier
+CACHE_MEMORY_BYTES = int(os.getenv('CACHE_MEMORY_BYTES', str(64 * 1024 * 1024)))
+CACHE_MEMORY_TTL = int(os.getenv('CACHE_MEMORY_TTL', '60'))
+
+# Seconds a computation holds its lock, and seconds others wait for its result
+CACHE_LOCK_TTL = int(os.getenv('CACHE_LOCK_TTL', '30'))
+CACHE_LOCK_WAIT = float(os.getenv('CACHE_LOCK_WAIT', '10'))
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe in-process cache bounded by the encoded size of its values.
+
+    Values are shared with the callers, who must not modify them.
+    """
+
+    def __init__(self, max_bytes=CACHE_MEMORY_BYTES, ttl=CACHE_MEMORY_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()  # key -> (value, size, expires at)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[2] <= time.monotonic():
+                self._remove(key)
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, size, ttl=None):
+        """Store value, whose encoded size is given, for at most ttl seconds (the tier's own TTL by default)."""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes or ttl <= 0:
+                return
+            self._entries[key] = (value, size, time.monotonic() + ttl)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+
+class Cache:
+    """Two-tier cache: an in-process LRU in front of the cache table of the invites database.
+
+    Values are stored as JSON. The front tier answers repeated lookups without
+    a round trip; the table is shared by every process and host. Each database
+    access is a single autocommitted statement, whatever the number of keys.
+    """
+
+    def __init__(self, prefix=CACHE_PREFIX, memory=None, database="invites"):
+        self.prefix = prefix
+        self.memory = memory if memory is not None else LRUCache()
+        self.database = database
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        """Return {key: value} for the keys found in either tier, fetching the missing ones in one query."""
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.memory.get(key, _MISSING)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        if not missing:
+            return found
+        now = int(time.time())
+        with connection(self.database, autocommit=True) as conn:
+            with conn.cursor() as cur:
+                cur.execute('SELECT "key", "value", "expiration" FROM "cache" WHERE "key" = ANY(%s) AND "expiration" > %s;',
+                            ([self._key(key) for key in missing], now))
+                rows = cur.fetchall()
+        for stored_key, encoded, expiration in rows:
+            key = stored_key[len(self.prefix):]
+            found[key] = json.loads(encoded)
+            self.memory.set(key, found[key], len(encoded), expiration - now)
+        return found
+
+    def set(self, key, value, ttl):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, values, ttl):
+        """Store every {key: value} for ttl seconds in both tiers with one statement."""
+        if not values:
+            return
+        expiration = int(time.time()) + ttl
+        rows = []
+        for key, value in values.items():
+            encoded = json.dumps(value)
+            rows.append((self._key(key), encoded, expiration))
+            self.memory.set(key, value, len(encoded), ttl)
+        with connection(self.database, autocommit=True) as conn:
+            with conn.cursor() as cur:
+                execute_values(cur, """
+                    INSERT INTO "cache" ("key", "value", "expiration") VALUES %s
+                    ON CONFLICT ("key") DO UPDATE SET "value" = EXCLUDED."value", "expiration" = EXCLUDED."expiration";
+                """, rows, page_size=500)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        with connection(self.database, autocommit=True) as conn:
+            with conn.cursor() as cur:
+                cur.execute('DELETE FROM "cache" WHERE "key" = %s;', (self._key(key),))
+
+    def acquire(self, name, owner, ttl=CACHE_LOCK_TTL):
+        """Try once to take the lock name for ttl seconds; an expired holder loses it. Returns True when taken."""
+        now = int(time.time())
+        with connection(self.database, autocommit=True) as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO "cache_locks" ("key", "owner", "expiration") VALUES (%s, %s, %s)
+                    ON CONFLICT ("key") DO UPDATE SET "owner" = EXCLUDED."owner", "expiration" = EXCLUDED."expiration"
+                    WHERE "cache_locks"."expiration" <= %s
+                    RETURNING 1;
+                """, (self._key(name), owner, now + ttl, now))
+                return cur.fetchone() is not None
+
+    def release(self, name, owner):
+        """Release the lock name if owner still holds it."""
+        with connection(self.database, autocommit=True) as conn:
+            with conn.cursor() as cur:
+                cur.execute('DELETE FROM "cache_locks" WHERE "key" = %s AND "owner" = %s;', (self._key(name), owner))
+
+    @contextmanager
+    def lock(self, name, ttl=CACHE_LOCK_TTL, wait=CACHE_LOCK_WAIT):
+        """Hold the distributed lock name for the block; yields False if it could not be taken within wait seconds."""
+        owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        deadline = time.monotonic() + wait
+        delay = 0.05
+        acquired = self.acquire(name, owner, ttl)
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+            acquired = self.acquire(name, owner, ttl)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.release(name, owner)
+
+    def remember(self, key, ttl, compute):
+        """Return the cached value of key, computing and storing it on a miss.
+
+        Concurrent misses across processes are serialised on a lock, so only
+        one of them runs compute and the others read its result.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self.lock(f"remember:{key}"):
+            # The previous holder of the lock may have stored it meanwhile
+            value = self.get(key, _MISSING)
+            if value is _MISSING:
+                value = compute()
+                self.set(key, value, ttl)
+        return value
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_cache():
+    """Return the cache instance shared by this process."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Cache()
+        return _shared
+
+
+def memoize(ttl, prefix=None, cache=None):
+    """Decorator caching the JSON-serialisable result of a function by its arguments for ttl seconds.
+
+    The wrapper gains prefetch(list of argument tuples), which loads the
+    cached results of many calls into the front tier with one query.
+    """
+    def decorate(function):
+        name = prefix or f"{function.__module__}.{function.__qualname__}"
+
+        def key(*args, **kwargs):
+            digest = hashlib.sha256(json.dumps([args, kwargs], sort_keys=True, default=str).encode('utf-8'))
+            return f"memo:{name}:{digest.hexdigest()}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return (cache or shared_cache()).remember(key(*args, **kwargs), ttl, lambda: function(*args, **kwargs))
+
+        def prefetch(calls):
+            (cache or shared_cache()).get_many([key(*args) for args in calls])
+
+        wrapper.prefetch = prefetch
+        return wrapper
+    return decorate
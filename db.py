@@ -0,0 +1,145 @@
+import psycopg2
+from psycopg2 import extensions, pool
+from dotenv import load_dotenv
+import os
+from contextlib import contextmanager
+import threading
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Databases reachable by name; both live on the same server
+DATABASES = {
+    "main": os.getenv('DB_NAME'),
+    "invites": "invites",
+}
+
+# Connections kept open per database, and the most handed out at once
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '8'))
+
+# Seconds a borrower waits for a connection when all DB_POOL_MAX are handed out
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+
+_pools = {}
+_pools_pid = os.getpid()
+_lock = threading.Lock()
+_connection_factory = None
+
+
+class BlockingConnectionPool(pool.ThreadedConnectionPool):
+    """Thread-safe pool whose getconn waits for a connection to come back instead of raising PoolError."""
+
+    def __init__(self, minconn, maxconn, *args, timeout=DB_POOL_TIMEOUT, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise pool.PoolError(f"no connection returned to the pool within {self.timeout} s")
+        try:
+            return super().getconn(key)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        super().putconn(conn, key, close)
+        self._slots.release()
+
+
+def connection_params(name="main"):
+    """Return the psycopg2 connection parameters of a named database."""
+    return {
+        "dbname": DATABASES[name],
+        "user": os.getenv('DB_USER'),
+        "password": os.getenv('DB_PASSWORD'),
+        "host": os.getenv('DB_HOST'),
+        "port": os.getenv('DB_PORT')
+    }
+
+
+def get_pool(name="main"):
+    """Return the connection pool of a named database, creating it on first use.
+
+    Pools are per process: a forked child gets fresh pools instead of sharing
+    the parent's sockets.
+    """
+    global _pools_pid
+    with _lock:
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pools_pid = os.getpid()
+        if name not in _pools:
+            _pools[name] = BlockingConnectionPool(
+                DB_POOL_MIN, max(DB_POOL_MAX, DB_POOL_MIN),
+                connection_factory=_connection_factory, **connection_params(name)
+            )
+        return _pools[name]
+
+
+def getconn(name="main"):
+    """Take a connection from the pool of a named database."""
+    return get_pool(name).getconn()
+
+
+def putconn(conn, name="main"):
+    """Return a connection to its pool, discarding any transaction left open."""
+    if conn.closed:
+        get_pool(name).putconn(conn, close=True)
+        return
+    if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+        conn.rollback()
+    conn.autocommit = False
+    get_pool(name).putconn(conn)
+
+
+@contextmanager
+def connection(name="main", autocommit=False):
+    """Borrow a pooled connection of a named database for the duration of the block."""
+    conn = getconn(name)
+    try:
+        conn.autocommit = autocommit
+        yield conn
+    finally:
+        putconn(conn, name)
+
+
+@contextmanager
+def transaction(name="main"):
+    """Run the block in one transaction of a named database and yield its cursor.
+
+    The transaction is committed when the block exits normally and rolled back
+    when it raises.
+    """
+    with connection(name) as conn:
+        cur = conn.cursor()
+        try:
+            yield cur
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+
+def close_all():
+    """Close every pooled connection of this process."""
+    with _lock:
+        if _pools_pid == os.getpid():
+            for connection_pool in _pools.values():
+                connection_pool.closeall()
+        _pools.clear()
+
+
+def set_connection_factory(factory):
+    """Open every future pooled connection with a psycopg2 connection subclass.
+
+    Existing pools are closed so that no connection of the previous class is
+    handed out again. Pass None to go back to the default class.
+    """
+    global _connection_factory
+    close_all()
+    _connection_factory = factory
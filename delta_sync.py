@@ -0,0 +1,115 @@
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from collections import namedtuple
+import hashlib
+from bulk import copy_merge
+
+# A reference table: its natural key columns and the columns compared for changes
+TableSpec = namedtuple('TableSpec', ['table', 'key_columns', 'value_columns'])
+
+SPECS = {
+    "Cities": TableSpec("Cities", ("Code",), ("Name", "Latitude", "Longitude")),
+    "Departements": TableSpec("Departements", ("Numero",), ("Name", "Latitude", "Longitude")),
+    # Distinct stations may share a name, so the coordinates are part of their key
+    "WeatherStation": TableSpec("WeatherStation", ("Name", "Latitude", "Longitude"), ()),
+}
+
+# Python type of the FLOAT columns; every other compared column is VARCHAR
+COLUMN_TYPES = {'Latitude': float, 'Longitude': float}
+
+
+def normalise(columns, values):
+    """Convert values to their column's type, so that 45 and 45.0 or 1 and '1' compare equal."""
+    return tuple(None if value is None else COLUMN_TYPES.get(column, str)(value)
+                 for column, value in zip(columns, values))
+
+
+def record_hash(values):
+    """Return a compact digest of a record's normalised values."""
+    return hashlib.blake2b(repr(tuple(values)).encode('utf-8'), digest_size=16).digest()
+
+
+def load_state(cur, spec):
+    """Read a table in one pass and return ({key: (Id, hash)}, [Ids without a usable key]).
+
+    Rows with a NULL key or repeating an earlier key cannot be matched upstream
+    and are returned as orphans.
+    """
+    columns = sql.SQL(', ').join(sql.Identifier(col) for col in spec.key_columns + spec.value_columns)
+    cur.execute(sql.SQL('SELECT "Id", {columns} FROM {table} ORDER BY "Id"').format(
+        columns=columns, table=sql.Identifier(spec.table)))
+    width = len(spec.key_columns)
+    state = {}
+    orphans = []
+    for row in cur:
+        key = normalise(spec.key_columns, row[1:1 + width])
+        values = normalise(spec.value_columns, row[1 + width:])
+        if None in key or key in state:
+            orphans.append(row[0])
+        else:
+            state[key] = (row[0], record_hash(values))
+    return state, orphans
+
+
+def diff(state, orphans, records, spec):
+    """Compare upstream records (key columns first) with the table state.
+
+    Returns (inserts, updates, deletes, unchanged): rows to insert, (Id, values)
+    pairs to update, Ids to delete and the number of untouched rows.
+    """
+    width = len(spec.key_columns)
+    upstream = {}
+    for record in records:
+        record = tuple(record)
+        upstream[normalise(spec.key_columns, record[:width])] = normalise(spec.value_columns, record[width:])
+
+    inserts, updates = [], []
+    unchanged = 0
+    for key, values in upstream.items():
+        current = state.get(key)
+        if current is None:
+            inserts.append(key + values)
+        elif current[1] != record_hash(values):
+            updates.append((current[0],) + values)
+        else:
+            unchanged += 1
+    deletes = orphans + [row_id for key, (row_id, _) in state.items() if key not in upstream]
+    return inserts, updates, deletes, unchanged
+
+
+def sync_table(cur, spec, records, dry_run=False):
+    """Bring a reference table in line with upstream records, touching only what changed.
+
+    records yields tuples holding the key columns then the value columns of spec.
+    Returns a change report {inserted, updated, deleted, unchanged}.
+    """
+    state, orphans = load_state(cur, spec)
+    inserts, updates, deletes, unchanged = diff(state, orphans, records, spec)
+    if not (inserts or updates or unchanged) and state:
+        raise ValueError(f"Upstream returned no {spec.table} records; refusing to empty the table")
+
+    if not dry_run:
+        if inserts:
+            copy_merge(cur, spec.table, spec.key_columns + spec.value_columns, inserts,
+                       key_columns=spec.key_columns)
+        if updates:
+            execute_values(cur, sql.SQL("""
+                UPDATE {table} AS t SET {assignments}
+                FROM (VALUES %s) AS data ("Id", {columns})
+                WHERE t."Id" = data."Id";
+            """).format(
+                table=sql.Identifier(spec.table),
+                assignments=sql.SQL(', ').join(
+                    sql.SQL('{col} = data.{col}').format(col=sql.Identifier(col)) for col in spec.value_columns),
+                columns=sql.SQL(', ').join(sql.Identifier(col) for col in spec.value_columns)
+            ).as_string(cur), updates, page_size=1000)
+        if deletes:
+            cur.execute(sql.SQL('DELETE FROM {table} WHERE "Id" = ANY(%s)').format(
+                table=sql.Identifier(spec.table)), (deletes,))
+
+    return {
+        'inserted': len(inserts),
+        'updated': len(updates),
+        'deleted': len(deletes),
+        'unchanged': unchanged,
+    }
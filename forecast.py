@@ -0,0 +1,513 @@
+from dotenv import load_dotenv
+import os
+from datetime import datetime, timedelta, timezone
+import multiprocessing
+import queue
+import signal
+import sys
+import threading
+from itertools import repeat
+from psycopg2.extras import execute_values
+from bulk import load_key_map
+from delta_sync import SPECS
+from cache import memoize
+from db import close_all, transaction
+import http_client
+import metrics
+from metrics import phase
+from partitions import manage_partitions
+from rollups import refresh_rollups
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Base URL of the forecast API, overridable to point at a local stub server
+OPEN_METEO_URL = os.getenv('OPEN_METEO_URL', 'https://api.open-meteo.com').rstrip('/')
+
+# Number of forecast requests allowed in flight at once (1 = sequential)
+FORECAST_CONCURRENCY = int(os.getenv('FORECAST_CONCURRENCY', '1'))
+
+# Number of fetched payloads allowed to wait for the database writer
+FORECAST_QUEUE_SIZE = int(os.getenv('FORECAST_QUEUE_SIZE', '16'))
+
+# Seconds a fetched forecast is reused from the shared cache (0 = always fetch)
+FORECAST_CACHE_TTL = int(os.getenv('FORECAST_CACHE_TTL', '0'))
+
+# Days fetched for a station never ingested before
+FORECAST_WINDOW_DAYS = int(os.getenv('FORECAST_WINDOW_DAYS', '7'))
+
+# Stations stored between two commits; a crash loses at most this much progress
+FORECAST_CHECKPOINT_STATIONS = int(os.getenv('FORECAST_CHECKPOINT_STATIONS', '50'))
+
+# Share of the stations allowed to fail before the run exits with status 1 (0 = any failure)
+FORECAST_MAX_FAILED_SHARE = float(os.getenv('FORECAST_MAX_FAILED_SHARE', '0'))
+
+# Processes ingesting shards of the stations in parallel (1 = this process only)
+FORECAST_WORKERS = int(os.getenv('FORECAST_WORKERS', '1'))
+
+# Stations whose forecasts are asked for in one multi-location request, and the longest URL sent
+FORECAST_BATCH_SIZE = int(os.getenv('FORECAST_BATCH_SIZE', '50'))
+FORECAST_MAX_URL_LENGTH = int(os.getenv('FORECAST_MAX_URL_LENGTH', '8000'))
+
+# Open-Meteo hourly variables and the "WeatherHourly" column each one is stored in
+HOURLY_COLUMNS = [
+    ('temperature_2m', 'temperature_2m'),
+    ('relative_humidity_2m', 'relative_humidity_2m'),
+    ('dew_point_2m', 'dew_point_2m'),
+    ('apparent_temperature', 'apparent_temperature'),
+    ('precipitation', 'precipitation'),
+    ('rain', 'rain'),
+    ('snowfall', 'snowfall'),
+    ('weather_code', 'weather_code'),
+    ('cloud_cover', 'cloud_cover_total'),
+    ('cloud_cover_low', 'cloud_cover_low'),
+    ('cloud_cover_mid', 'cloud_cover_mid'),
+    ('cloud_cover_high', 'cloud_cover_high'),
+    ('pressure_msl', 'pressure_msl'),
+    ('surface_pressure', 'surface_pressure'),
+    ('vapour_pressure_deficit', 'vapour_pressure_deficit'),
+    ('et0_fao_evapotranspiration', 'reference_evapotranspiration'),
+    ('wind_speed_10m', 'wind_speed_10m'),
+    ('wind_speed_20m', 'wind_speed_20m'),
+    ('wind_speed_50m', 'wind_speed_50m'),
+    ('wind_speed_100m', 'wind_speed_100m'),
+    ('wind_speed_150m', 'wind_speed_150m'),
+    ('wind_speed_200m', 'wind_speed_200m'),
+    ('wind_direction_10m', 'wind_direction_10m'),
+    ('wind_direction_20m', 'wind_direction_20m'),
+    ('wind_direction_50m', 'wind_direction_50m'),
+    ('wind_direction_100m', 'wind_direction_100m'),
+    ('wind_direction_150m', 'wind_direction_150m'),
+    ('wind_direction_200m', 'wind_direction_200m'),
+    ('wind_gusts_10m', 'wind_gusts_10m'),
+    ('temperature_20m', 'temperature_20m'),
+    ('temperature_50m', 'temperature_50m'),
+    ('temperature_100m', 'temperature_100m'),
+    ('temperature_150m', 'temperature_150m'),
+    ('temperature_200m', 'temperature_200m'),
+]
+
+HOURLY_VARIABLES = ','.join(variable for variable, _ in HOURLY_COLUMNS)
+
+_hourly_columns = ', '.join(f'"{column}"' for _, column in HOURLY_COLUMNS)
+
+# Upsert keyed on (station, hour); rows whose values did not change are left untouched.
+# WeatherHourly is partitioned, so xmax cannot be returned: a row is an insert when
+# its hour was missing from the statement's snapshot of the station's hours.
+UPSERT_FORECAST_QUERY = f"""
+    WITH existing AS (
+        SELECT "Timestamp" FROM "WeatherHourly"
+        WHERE "WeatherStationId" = %(station)s
+        AND "Timestamp" BETWEEN (%(first)s::timestamp AT TIME ZONE 'UTC') AND (%(last)s::timestamp AT TIME ZONE 'UTC')
+    ), written AS (
+        INSERT INTO "WeatherHourly" ("WeatherStationId", "Timestamp", {_hourly_columns})
+        VALUES %%s
+        ON CONFLICT ("WeatherStationId", "Timestamp") DO UPDATE SET
+        {', '.join(f'"{column}" = EXCLUDED."{column}"' for _, column in HOURLY_COLUMNS)}
+        WHERE ({', '.join(f'"WeatherHourly"."{column}"' for _, column in HOURLY_COLUMNS)})
+        IS DISTINCT FROM ({', '.join(f'EXCLUDED."{column}"' for _, column in HOURLY_COLUMNS)})
+        RETURNING "Timestamp"
+    )
+    SELECT NOT EXISTS (SELECT 1 FROM existing e WHERE e."Timestamp" = w."Timestamp"),
+           (w."Timestamp" AT TIME ZONE 'UTC')::date
+    FROM written w;
+"""
+
+# Open-Meteo returns GMT wall-clock times, stored as UTC instants
+UPSERT_FORECAST_TEMPLATE = "(%s, %s::timestamp AT TIME ZONE 'UTC', " + ', '.join(['%s'] * len(HOURLY_COLUMNS)) + ")"
+
+# Success resets the failure count; the watermark never moves backwards
+UPDATE_WATERMARKS_QUERY = """
+    INSERT INTO "ForecastWatermark" ("WeatherStationId", "LastHour", "LastSuccessAt", "LastAttemptAt", "Failures", "LastError")
+    VALUES %s
+    ON CONFLICT ("WeatherStationId") DO UPDATE SET
+        "LastHour" = greatest("ForecastWatermark"."LastHour", EXCLUDED."LastHour"),
+        "LastSuccessAt" = coalesce(EXCLUDED."LastSuccessAt", "ForecastWatermark"."LastSuccessAt"),
+        "LastAttemptAt" = EXCLUDED."LastAttemptAt",
+        "Failures" = CASE WHEN EXCLUDED."LastError" IS NULL THEN 0 ELSE "ForecastWatermark"."Failures" + 1 END,
+        "LastError" = EXCLUDED."LastError";
+"""
+
+def forecast_url(coordinates, start_hour=None):
+    """Return the forecast URL of a list of (latitude, longitude) until the end of today (UTC).
+
+    start_hour, a 'YYYY-MM-DDTHH:00' UTC hour, limits the request to the
+    hours from then on; by default the last FORECAST_WINDOW_DAYS days are
+    asked for.
+    """
+    today = datetime.now(timezone.utc)
+    if start_hour:
+        window = f"start_hour={start_hour}&end_hour={today:%Y-%m-%d}T23:00"
+    else:
+        start_date = (today - timedelta(days=FORECAST_WINDOW_DAYS)).strftime('%Y-%m-%d')
+        window = f"start_date={start_date}&end_date={today:%Y-%m-%d}"
+    latitudes = ','.join(str(latitude) for latitude, _ in coordinates)
+    longitudes = ','.join(str(longitude) for _, longitude in coordinates)
+    return f"{OPEN_METEO_URL}/v1/forecast?latitude={latitudes}&longitude={longitudes}&hourly={HOURLY_VARIABLES}&{window}&models=meteofrance_seamless"
+
+def fetch_weather_forecasts(coordinates, start_hour=None):
+    """Fetch the hourly forecasts of a list of (latitude, longitude) in one request.
+
+    Returns one payload per coordinate, in order. Errors are raised to the
+    caller.
+    """
+    url = forecast_url(coordinates, start_hour)
+    try:
+        #print(url)
+        with phase("forecast.fetch"):
+            response = http_client.get(url)
+            response.raise_for_status()
+        with phase("forecast.parse"):
+            payload = response.json()
+        # A single location is answered with an object, several with an array
+        payloads = payload if isinstance(payload, list) else [payload]
+        if len(payloads) != len(coordinates):
+            raise ValueError(f"{len(payloads)} forecasts returned for {len(coordinates)} locations")
+        return payloads
+    except Exception as e:
+        print(f"Error fetching weather forecast data for {len(coordinates)} locations from {coordinates[0]}:", e)
+        raise
+
+def fetch_weather_forecast(latitude, longitude, start_hour=None):
+    """Fetch the hourly forecast of one coordinate; see fetch_weather_forecasts."""
+    return fetch_weather_forecasts([(latitude, longitude)], start_hour)[0]
+
+def forecast_batches(targets, start_hours, batch_size=FORECAST_BATCH_SIZE, max_url_length=FORECAST_MAX_URL_LENGTH):
+    """Group (Id, latitude, longitude) targets into (start hour, [targets]) multi-location requests.
+
+    Stations share a request only when they resume from the same hour. A
+    batch holds at most batch_size stations and its URL stays within
+    max_url_length characters.
+    """
+    by_start = {}
+    for target in targets:
+        by_start.setdefault(start_hours.get(target[0]), []).append(target)
+    for start_hour, group in by_start.items():
+        base_length = len(forecast_url([], start_hour))
+        batch, length = [], base_length
+        for target in group:
+            # Each location adds its latitude, its longitude and a comma before each of them
+            added = len(str(target[1])) + len(str(target[2])) + 2
+            if batch and (len(batch) >= batch_size or length + added > max_url_length):
+                yield start_hour, batch
+                batch, length = [], base_length
+            batch.append(target)
+            length += added
+        if batch:
+            yield start_hour, batch
+
+def fetch_concurrently(items, fetch, max_in_flight, queue_size=FORECAST_QUEUE_SIZE):
+    """Run fetch(item) on a pool of threads and yield (item, result) pairs as they complete.
+
+    At most max_in_flight fetches run at once and at most queue_size results
+    wait for the consumer, so a slow consumer applies back-pressure to the
+    fetchers instead of letting payloads pile up in memory.
+    """
+    pending = queue.Queue()
+    for item in items:
+        pending.put(item)
+    results = queue.Queue(maxsize=max(queue_size, 1))
+    stop = threading.Event()
+    done = object()
+
+    def worker():
+        error = None
+        try:
+            while not stop.is_set():
+                try:
+                    item = pending.get_nowait()
+                except queue.Empty:
+                    break
+                results.put((item, fetch(item)))
+        except BaseException as e:
+            # Hand the failure (including sys.exit from a fetcher) to the consumer
+            error = e
+        finally:
+            results.put((done, error))
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(max(max_in_flight, 1))]
+    for thread in workers:
+        thread.start()
+
+    try:
+        running = len(workers)
+        while running:
+            item, result = results.get()
+            if item is done:
+                if result is not None:
+                    raise result
+                running -= 1
+                continue
+            yield item, result
+    finally:
+        # Stop the workers and unblock any of them waiting on a full queue
+        stop.set()
+        while any(thread.is_alive() for thread in workers):
+            try:
+                results.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+def hourly_rows(weather_station_id, forecast_data):
+    """Transpose the columnar 'hourly' arrays of a forecast into one row per hour."""
+    hourly = forecast_data.get('hourly', {})
+    times = hourly.get('time', [])
+    columns = [hourly.get(variable) or repeat(None) for variable, _ in HOURLY_COLUMNS]
+    return zip(repeat(weather_station_id), times, *columns)
+
+def insert_forecast(cur, weather_station_id, forecast_data, touched=None):
+    """Upsert the hourly forecast of one station and return (inserted, updated) counts.
+
+    When given a set, touched receives the (station Id, UTC day) of every row
+    actually written, for the rollup refresh.
+    """
+    rows = list(hourly_rows(weather_station_id, forecast_data))
+    if not rows:
+        return 0, 0
+    # Bind the station and its hour range, leaving the VALUES placeholder to execute_values
+    times = [row[1] for row in rows]
+    query = cur.mogrify(UPSERT_FORECAST_QUERY, {'station': weather_station_id, 'first': min(times), 'last': max(times)})
+    written = execute_values(cur, query, rows, template=UPSERT_FORECAST_TEMPLATE, page_size=1000, fetch=True)
+    if touched is not None:
+        touched.update((weather_station_id, day) for _, day in written)
+    inserted = sum(1 for is_insert, _ in written if is_insert)
+    return inserted, len(written) - inserted
+
+def load_watermarks(cur, station_ids):
+    """Return {station Id: first hour to fetch as 'YYYY-MM-DDTHH:00'} for the stations already ingested.
+
+    The last ingested hour is fetched again since its values may still be
+    revised, and nothing older than the forecast window is asked for.
+    """
+    cur.execute("""
+        SELECT "WeatherStationId", "LastHour" FROM "ForecastWatermark"
+        WHERE "WeatherStationId" = ANY(%s) AND "LastHour" IS NOT NULL;
+    """, (list(station_ids),))
+    oldest = datetime.now(timezone.utc) - timedelta(days=FORECAST_WINDOW_DAYS)
+    return {station_id: max(last_hour, oldest).astimezone(timezone.utc).strftime('%Y-%m-%dT%H:00')
+            for station_id, last_hour in cur.fetchall()}
+
+def last_past_hour(forecast_data, now):
+    """Return the latest hour of a forecast that is not in the future, as a UTC datetime."""
+    last = None
+    for stamp in forecast_data.get('hourly', {}).get('time', []):
+        hour = datetime.strptime(stamp, '%Y-%m-%dT%H:%M').replace(tzinfo=timezone.utc)
+        if hour <= now and (last is None or hour > last):
+            last = hour
+    return last
+
+def ingest_forecasts(cur, targets, max_in_flight=FORECAST_CONCURRENCY, stop=None):
+    """Fetch and store the forecasts of (Id, latitude, longitude) targets with the connection of cur.
+
+    Stations are fetched FORECAST_BATCH_SIZE at a time with multi-location
+    requests. With max_in_flight > 1 the requests run concurrently and feed this
+    function, the single database writer, through a bounded queue.
+
+    Progress is committed every FORECAST_CHECKPOINT_STATIONS stations. A
+    station whose fetch or insert fails is recorded in ForecastWatermark and
+    retried by the next run instead of aborting this one. Once the stop event
+    is set, the progress made so far is committed and the rest is left for
+    the next run. Returns {'inserted', 'updated', 'rollups', 'failed', 'stopped'}.
+    """
+    start_hours = load_watermarks(cur, [target[0] for target in targets])
+
+    # Stations resuming from the same hour share multi-location requests
+    batches = [(start_hour, [(latitude, longitude) for _, latitude, longitude in batch], batch)
+               for start_hour, batch in forecast_batches(targets, start_hours)]
+
+    fetch_forecasts = fetch_weather_forecasts
+    if FORECAST_CACHE_TTL > 0:
+        # Load every cached batch in one query; only the misses reach Open-Meteo
+        fetch_forecasts = memoize(FORECAST_CACHE_TTL, prefix="forecast")(fetch_weather_forecasts)
+        fetch_forecasts.prefetch([(coordinates, start_hour) for start_hour, coordinates, _ in batches])
+
+    def fetch(batch):
+        # A failed fetch is handed to the writer to be recorded against each station, not raised
+        start_hour, coordinates, batch_targets = batch
+        try:
+            payloads = fetch_forecasts(coordinates, start_hour)
+            return [(target, (data, None)) for target, data in zip(batch_targets, payloads)]
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            return [(target, (None, error)) for target in batch_targets]
+
+    if max_in_flight > 1:
+        fetched = fetch_concurrently(batches, fetch, max_in_flight)
+    else:
+        fetched = ((batch, fetch(batch)) for batch in batches)
+    # Split every response back into per-station payloads
+    forecasts = (station for _, stations in fetched for station in stations)
+
+    report = {'inserted': 0, 'updated': 0, 'rollups': 0, 'failed': [], 'stopped': False}
+    touched = set()
+    watermarks = []
+
+    def checkpoint():
+        nonlocal touched, watermarks
+        # Only the days and weeks whose hourly rows changed are re-aggregated
+        with phase("forecast.rollups"):
+            report['rollups'] += sum(refresh_rollups(cur, touched).values())
+        with phase("forecast.commit"):
+            if watermarks:
+                execute_values(cur, UPDATE_WATERMARKS_QUERY, watermarks)
+            cur.connection.commit()
+        touched, watermarks = set(), []
+
+    for stored, ((weather_station_id, _, _), (forecast_data, error)) in enumerate(forecasts, start=1):
+        now = datetime.now(timezone.utc)
+        if error is None and forecast_data:
+            cur.execute('SAVEPOINT station;')
+            try:
+                station_touched = set()
+                with phase("forecast.write"):
+                    inserted, updated = insert_forecast(cur, weather_station_id, forecast_data, station_touched)
+                cur.execute('RELEASE SAVEPOINT station;')
+                report['inserted'] += inserted
+                report['updated'] += updated
+                touched |= station_touched
+            except Exception as e:
+                cur.execute('ROLLBACK TO SAVEPOINT station;')
+                error = str(e)
+        if error is None:
+            watermarks.append((weather_station_id, last_past_hour(forecast_data or {}, now), now, now, 0, None))
+        else:
+            report['failed'].append(weather_station_id)
+            watermarks.append((weather_station_id, None, None, now, 1, error))
+        if stop is not None and stop.is_set():
+            report['stopped'] = True
+            break
+        if stored % FORECAST_CHECKPOINT_STATIONS == 0:
+            checkpoint()
+    if report['stopped']:
+        # Stop the fetcher threads before committing
+        fetched.close()
+    checkpoint()
+    return report
+
+def _ingest_shard(shard, targets, max_in_flight, shares, stop, results):
+    """Worker process: ingest one shard of the stations on its own connection and report to the parent."""
+    # The parent handles Ctrl-C and tells the workers through stop; a
+    # SIGTERM sent to the whole group also lets the current checkpoint commit
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    # Forked workers start with a copy of the parent's metrics, which the parent already counts
+    metrics.registry.reset()
+    metrics.install()
+    # The upstream rate limits are shared by every worker
+    http_client.divide_rate_limits(shares)
+    try:
+        with transaction() as cur:
+            report = ingest_forecasts(cur, targets, max_in_flight, stop)
+        report['error'] = None
+    except Exception as e:
+        report = {'error': str(e) or type(e).__name__}
+    finally:
+        close_all()
+    report['metrics'] = metrics.registry.snapshot()
+    results.put((shard, report))
+
+def ingest_sharded(targets, workers, max_in_flight=FORECAST_CONCURRENCY):
+    """Ingest targets with one process per shard of the stations, each writing on its own connection.
+
+    Stations are dealt round-robin to the workers, which share the HTTP rate
+    limits. A worker that fails only loses its own uncommitted checkpoint.
+    Ctrl-C or SIGTERM lets every worker commit its progress before exiting.
+    Returns the same report as ingest_forecasts, summed over the shards.
+    """
+    shards = [shard for shard in (targets[i::workers] for i in range(workers)) if shard]
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    handle_signals = threading.current_thread() is threading.main_thread()
+    if handle_signals:
+        previous_sigterm = signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    processes = [multiprocessing.Process(target=_ingest_shard, args=(i, shard, max_in_flight, len(shards), stop, results))
+                 for i, shard in enumerate(shards)]
+    for process in processes:
+        process.start()
+
+    reports = {}
+    try:
+        while len(reports) < len(processes):
+            try:
+                shard, report = results.get(timeout=0.5)
+                reports[shard] = report
+            except queue.Empty:
+                for shard, process in enumerate(processes):
+                    # A worker killed before reporting, e.g. by the OOM killer
+                    if shard not in reports and process.exitcode is not None and results.empty():
+                        reports[shard] = {'error': f"worker exited with code {process.exitcode}"}
+            except KeyboardInterrupt:
+                print("Stopping: every worker commits its progress first.")
+                stop.set()
+        for process in processes:
+            process.join()
+    finally:
+        if handle_signals:
+            signal.signal(signal.SIGTERM, previous_sigterm)
+
+    total = {'inserted': 0, 'updated': 0, 'rollups': 0, 'failed': [], 'stopped': stop.is_set()}
+    for shard, report in sorted(reports.items()):
+        if 'metrics' in report:
+            metrics.registry.merge(report['metrics'])
+        if report['error'] is not None:
+            # Its committed checkpoints are kept; the rest resumes from the watermarks next run
+            print(f"Shard {shard} of {len(shards)} stopped:", report['error'])
+            total['failed'] += [target[0] for target in shards[shard]]
+            continue
+        for key in ('inserted', 'updated', 'rollups', 'failed'):
+            total[key] += report[key]
+    return total
+
+def seed_weather_forecast(weather_stations, max_in_flight=FORECAST_CONCURRENCY, station_ids=None, workers=FORECAST_WORKERS):
+    """Fetch and store the forecast of every known station, resuming from each station's watermark.
+
+    weather_stations holds (name, latitude, longitude) records; station_ids,
+    the {(name, latitude, longitude): Id} map returned by the station seeding,
+    saves looking them up.
+    With workers > 1 the stations are sharded across that many processes,
+    each running max_in_flight requests; see ingest_forecasts and
+    ingest_sharded. Returns the list of failed station Ids.
+
+    Exits with status 1 when there were stations to fetch and none was
+    ingested, or when more than FORECAST_MAX_FAILED_SHARE of them failed.
+    """
+    try:
+        with transaction() as cur:
+            # Make sure every day of the forecast window has a partition to land in
+            manage_partitions(cur, "WeatherHourly")
+
+            # Resolve the stations known to the database before fetching anything, in one statement
+            if station_ids is None:
+                station_ids = load_key_map(cur, "WeatherStation", SPECS["WeatherStation"].key_columns,
+                                           weather_stations)
+            targets = list({station_ids[station]: (station_ids[station], station[1], station[2])
+                            for station in map(tuple, weather_stations) if station in station_ids}.values())
+
+            if workers <= 1:
+                # One pooled connection for the whole run, committed at every checkpoint
+                report = ingest_forecasts(cur, targets, max_in_flight)
+        if workers > 1:
+            # The partitions are committed above, before the workers write into them
+            report = ingest_sharded(targets, workers, max_in_flight)
+
+        print(f"{report['inserted']} records were successfully inserted, {report['updated']} updated.")
+        print(f"{report['rollups']} rollup rows refreshed.")
+        if report['failed']:
+            print(f"{len(report['failed'])} stations failed and will be retried on the next run (see ForecastWatermark).")
+        if report['stopped']:
+            print("Stopped before the end; the next run resumes from the committed progress.")
+
+        # The failures are recorded for the next run, but must not look like a success
+        failed = len(report['failed'])
+        if targets and failed == len(targets):
+            print("No station forecast was ingested.")
+            sys.exit(1)
+        if failed > FORECAST_MAX_FAILED_SHARE * len(targets):
+            print(f"{failed} of {len(targets)} stations failed, more than FORECAST_MAX_FAILED_SHARE "
+                  f"({FORECAST_MAX_FAILED_SHARE:.0%}) allows.")
+            sys.exit(1)
+        return report['failed']
+
+    except Exception as e:
+        print("Error inserting weather forecast data:", e)
+        sys.exit(1)
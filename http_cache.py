@@ -0,0 +1,168 @@
+import requests
+from dotenv import load_dotenv
+import http_client
+import os
+import gzip
+import hashlib
+import json
+import shutil
+import tempfile
+import time
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Directory holding the cached responses
+HTTP_CACHE_DIR = os.getenv('HTTP_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'http'))
+
+# Seconds a cached response is served without revalidation
+HTTP_CACHE_TTL = int(os.getenv('HTTP_CACHE_TTL', '86400'))
+
+# Upper bound of the compressed cache size; least recently used entries go first
+HTTP_CACHE_MAX_BYTES = int(os.getenv('HTTP_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+# Serve from the cache only, never touching the network
+HTTP_CACHE_OFFLINE = os.getenv('HTTP_CACHE_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+# Seconds to wait for the upstream server
+HTTP_CACHE_TIMEOUT = float(os.getenv('HTTP_CACHE_TIMEOUT', '60'))
+
+
+class CacheMiss(Exception):
+    """Raised in offline mode when a URL has never been cached."""
+
+
+def _entry_paths(url):
+    """Return the (body, metadata) paths of the cache entry of url."""
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return os.path.join(HTTP_CACHE_DIR, f"{key}.gz"), os.path.join(HTTP_CACHE_DIR, f"{key}.json")
+
+
+def _load_meta(meta_path, body_path):
+    if not (os.path.exists(meta_path) and os.path.exists(body_path)):
+        return None
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomically(path, write):
+    """Write a file through a temporary sibling so readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=HTTP_CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _save_meta(meta_path, meta):
+    _write_atomically(meta_path, lambda f: f.write(json.dumps(meta).encode('utf-8')))
+
+
+def _touch(body_path):
+    """Mark an entry as recently used for the eviction policy."""
+    os.utime(body_path)
+    return body_path
+
+
+def evict(max_bytes=HTTP_CACHE_MAX_BYTES):
+    """Delete least recently used entries until the cache fits in max_bytes."""
+    if not os.path.isdir(HTTP_CACHE_DIR):
+        return 0
+    entries = []
+    for name in os.listdir(HTTP_CACHE_DIR):
+        if name.endswith('.gz'):
+            stat = os.stat(os.path.join(HTTP_CACHE_DIR, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        for path in (os.path.join(HTTP_CACHE_DIR, name), os.path.join(HTTP_CACHE_DIR, name[:-3] + '.json')):
+            if os.path.exists(path):
+                os.unlink(path)
+        total -= size
+        removed += 1
+    return removed
+
+
+def fetch(url, ttl=HTTP_CACHE_TTL, offline=HTTP_CACHE_OFFLINE):
+    """Return the path of the gzip-compressed body of url, downloading it when needed.
+
+    A fresh entry (younger than ttl) is served as is. A stale entry is
+    revalidated with If-None-Match / If-Modified-Since, so an unchanged
+    resource costs one 304 round trip. When the server cannot be reached a
+    stale entry is served rather than failing. In offline mode only the cache
+    is used and CacheMiss is raised for unknown URLs.
+    """
+    os.makedirs(HTTP_CACHE_DIR, exist_ok=True)
+    body_path, meta_path = _entry_paths(url)
+    meta = _load_meta(meta_path, body_path)
+
+    if offline:
+        if meta is None:
+            raise CacheMiss(f"{url} is not cached and offline mode is enabled")
+        return _touch(body_path)
+    if meta is not None and time.time() - meta['stored_at'] < ttl:
+        return _touch(body_path)
+
+    headers = {}
+    if meta is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        response = http_client.get(url, headers=headers, stream=True, timeout=HTTP_CACHE_TIMEOUT)
+    except requests.RequestException as e:
+        if meta is None:
+            raise
+        print(f"Serving stale cache for {url}: {e}")
+        return _touch(body_path)
+
+    with response:
+        if response.status_code == 304 and meta is not None:
+            meta['stored_at'] = time.time()
+            _save_meta(meta_path, meta)
+            return _touch(body_path)
+        response.raise_for_status()
+
+        # Stream the body to disk so large payloads never sit in memory
+        def write_body(f):
+            with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    gz.write(chunk)
+
+        _write_atomically(body_path, write_body)
+        _save_meta(meta_path, {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'stored_at': time.time(),
+        })
+
+    evict()
+    return body_path
+
+
+def open_body(url, ttl=HTTP_CACHE_TTL, offline=HTTP_CACHE_OFFLINE):
+    """Open the cached body of url as a binary file, fetching it when needed."""
+    return gzip.open(fetch(url, ttl, offline), 'rb')
+
+
+def get_json(url, ttl=HTTP_CACHE_TTL, offline=HTTP_CACHE_OFFLINE):
+    """Return the decoded JSON body of url, served from the cache when possible."""
+    with open_body(url, ttl, offline) as f:
+        return json.load(f)
+
+
+def clear():
+    """Remove every cached response."""
+    shutil.rmtree(HTTP_CACHE_DIR, ignore_errors=True)
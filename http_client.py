@@ -0,0 +1,234 @@
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Requests per second allowed per host, and overrides as "host=rate,host=rate"
+HTTP_RATE_LIMIT = float(os.getenv('HTTP_RATE_LIMIT', '10'))
+HTTP_RATE_LIMITS = os.getenv('HTTP_RATE_LIMITS', '')
+
+# Requests a host may receive back to back before the rate applies
+HTTP_BURST = int(os.getenv('HTTP_BURST', '10'))
+
+# Attempts after the first one for connection errors, 429 and 5xx, and their backoff bounds in seconds
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '5'))
+HTTP_BACKOFF_BASE = float(os.getenv('HTTP_BACKOFF_BASE', '0.5'))
+HTTP_BACKOFF_MAX = float(os.getenv('HTTP_BACKOFF_MAX', '30'))
+
+# Seconds to wait for a server, and keep-alive connections kept per host
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '60'))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '16'))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Brotli responses are only decoded when one of its packages is installed
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        ACCEPT_ENCODING = 'gzip, deflate, br'
+    except ImportError:
+        ACCEPT_ENCODING = 'gzip, deflate'
+
+
+def _parse_rate_limits(value):
+    limits = {}
+    for item in value.split(','):
+        if '=' in item:
+            host, rate = item.split('=', 1)
+            limits[host.strip()] = float(rate)
+    return limits
+
+
+class TokenBucket:
+    """Thread-safe token bucket: rate tokens per second, at most burst stored."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until one is available; return the seconds waited."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserve the token now, possibly going negative, and sleep off the debt outside the lock
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class HostStats:
+    """Request counters and latencies of one host."""
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.throttled = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.statuses = {}
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'errors': self.errors,
+            'throttled': self.throttled,
+            'mean_ms': round(self.seconds / self.requests * 1000, 1) if self.requests else 0.0,
+            'total_s': round(self.seconds, 3),
+            'max_ms': round(self.max_seconds * 1000, 1),
+            'rate_limit_wait_s': round(self.wait_seconds, 3),
+            'statuses': dict(self.statuses),
+        }
+
+
+class HttpClient:
+    """Shared HTTP client: keep-alive connection pools, compression, per-host rate limits and retries.
+
+    Connection errors, 429 and 5xx responses are retried with jittered
+    exponential backoff, honouring Retry-After. Every attempt is counted in
+    the per-host statistics.
+    """
+
+    def __init__(self, rate=HTTP_RATE_LIMIT, rate_limits=None, burst=HTTP_BURST, retries=HTTP_RETRIES,
+                 timeout=HTTP_TIMEOUT, pool_size=HTTP_POOL_SIZE):
+        self.rate = rate
+        self.rate_limits = _parse_rate_limits(HTTP_RATE_LIMITS) if rate_limits is None else rate_limits
+        self.burst = burst
+        self.retries = retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        self._buckets = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate_limits.get(host, self.rate), self.burst)
+                self._stats[host] = HostStats()
+            return self._buckets[host], self._stats[host]
+
+    def _record(self, stats, **changes):
+        with self._lock:
+            for name, value in changes.items():
+                setattr(stats, name, getattr(stats, name) + value)
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+        # Full jitter keeps concurrent fetchers from retrying in lockstep
+        return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+    def request(self, method, url, **kwargs):
+        """Send a request through the shared session and return the last response.
+
+        Raises the last requests exception when every attempt failed to connect.
+        A response is returned as is once retries are exhausted; callers still
+        call raise_for_status().
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        bucket, stats = self._host(urlsplit(url).netloc)
+        for attempt in range(self.retries + 1):
+            waited = bucket.acquire()
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._record(stats, requests=1, errors=1, wait_seconds=waited, seconds=time.monotonic() - start)
+                if attempt == self.retries:
+                    raise
+                self._record(stats, retries=1)
+                time.sleep(self._backoff(attempt))
+                continue
+            elapsed = time.monotonic() - start
+            with self._lock:
+                stats.requests += 1
+                stats.seconds += elapsed
+                stats.max_seconds = max(stats.max_seconds, elapsed)
+                stats.wait_seconds += waited
+                stats.statuses[response.status_code] = stats.statuses.get(response.status_code, 0) + 1
+                if response.status_code == 429:
+                    stats.throttled += 1
+            if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                return response
+            delay = self._backoff(attempt, response)
+            response.close()
+            self._record(stats, retries=1)
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def stats(self):
+        """Return {host: counters} of every host contacted."""
+        with self._lock:
+            return {host: stats.as_dict() for host, stats in self._stats.items()}
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the HTTP client of this process; a forked child gets its own connections."""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = HttpClient()
+            _client_pid = os.getpid()
+        return _client
+
+
+def divide_rate_limits(shares):
+    """Give this process's client 1/shares of every per-host rate, for processes sharing one upstream quota."""
+    global _client, _client_pid
+    with _client_lock:
+        _client = HttpClient(rate=HTTP_RATE_LIMIT / shares,
+                             rate_limits={host: rate / shares for host, rate in _parse_rate_limits(HTTP_RATE_LIMITS).items()},
+                             burst=max(HTTP_BURST // shares, 1))
+        _client_pid = os.getpid()
+        return _client
+
+
+def get(url, **kwargs):
+    """GET url through the shared client."""
+    return get_client().get(url, **kwargs)
+
+
+def print_stats(stats=None):
+    """Print the request counters of every host, by default those contacted by this process.
+
+    Pass metrics.registry.snapshot()['http'] to include the counters merged
+    from worker processes.
+    """
+    for host, stats in (get_client().stats() if stats is None else stats).items():
+        print(f"{host}: {stats['requests']} requests, {stats['retries']} retries, {stats['errors']} errors, "
+              f"{stats['throttled']} throttled, {stats['mean_ms']} ms mean, {stats['max_ms']} ms max, "
+              f"{round(stats['rate_limit_wait_s'], 3)} s rate-limited.")
@@ -0,0 +1,283 @@
+from dotenv import load_dotenv
+import os
+from collections import namedtuple
+from datetime import datetime, timezone
+import argparse
+import json
+import re
+import sys
+from psycopg2 import errors
+from db import DATABASES, close_all, connection
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Statements of pg_stat_statements considered, by total execution time
+INDEX_AUDIT_TOP_QUERIES = int(os.getenv('INDEX_AUDIT_TOP_QUERIES', '50'))
+
+# Tables with fewer live rows are cheap to scan and never get a proposal
+INDEX_AUDIT_MIN_ROWS = int(os.getenv('INDEX_AUDIT_MIN_ROWS', '1000'))
+
+Index = namedtuple('Index', 'table name columns unique primary constraint partitioned method '
+                            'expressions predicate opclasses size scans writes definition')
+
+# Sizes and scans are summed over the partitions of a partitioned index or table; sums of
+# bigint counters are numeric, cast back so that Python gets ints rather than Decimals
+INDEXES_QUERY = """
+    SELECT t.relname, i.relname,
+           array(SELECT a.attname FROM unnest(x.indkey) WITH ORDINALITY AS k(attnum, ord)
+                 JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = k.attnum
+                 ORDER BY k.ord),
+           x.indisunique, x.indisprimary, con.conname,
+           t.relkind = 'p', am.amname,
+           pg_get_expr(x.indexprs, x.indrelid), pg_get_expr(x.indpred, x.indrelid),
+           x.indclass::text,
+           (SELECT coalesce(sum(pg_relation_size(p.relid)), 0)::bigint FROM pg_partition_tree(i.oid) p),
+           (SELECT coalesce(sum(s.idx_scan), 0)::bigint FROM pg_partition_tree(i.oid) p
+            JOIN pg_stat_user_indexes s ON s.indexrelid = p.relid),
+           (SELECT coalesce(sum(s.n_tup_ins + s.n_tup_upd - s.n_tup_hot_upd), 0)::bigint FROM pg_partition_tree(t.oid) p
+            JOIN pg_stat_user_tables s ON s.relid = p.relid),
+           pg_get_indexdef(i.oid)
+    FROM pg_index x
+    JOIN pg_class i ON i.oid = x.indexrelid
+    JOIN pg_class t ON t.oid = x.indrelid
+    JOIN pg_am am ON am.oid = i.relam
+    LEFT JOIN pg_constraint con ON con.conindid = x.indexrelid AND con.conrelid = x.indrelid
+    WHERE t.relnamespace = current_schema()::regnamespace AND NOT t.relispartition
+    ORDER BY t.relname, i.relname;
+"""
+
+TABLES_QUERY = """
+    SELECT t.relname,
+           array(SELECT a.attname FROM pg_attribute a
+                 WHERE a.attrelid = t.oid AND a.attnum > 0 AND NOT a.attisdropped),
+           (SELECT coalesce(sum(s.n_live_tup), 0)::bigint FROM pg_partition_tree(t.oid) p
+            JOIN pg_stat_user_tables s ON s.relid = p.relid),
+           (SELECT coalesce(sum(s.seq_scan), 0)::bigint FROM pg_partition_tree(t.oid) p
+            JOIN pg_stat_user_tables s ON s.relid = p.relid),
+           (SELECT coalesce(sum(s.seq_tup_read), 0)::bigint FROM pg_partition_tree(t.oid) p
+            JOIN pg_stat_user_tables s ON s.relid = p.relid)
+    FROM pg_class t
+    WHERE t.relnamespace = current_schema()::regnamespace AND t.relkind IN ('r', 'p') AND NOT t.relispartition;
+"""
+
+STATEMENTS_QUERY = """
+    SELECT query, calls, {total_time}
+    FROM pg_stat_statements
+    WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+    ORDER BY 3 DESC
+    LIMIT %s;
+"""
+
+_TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+(?:ONLY\s+)?"?(\w+)"?', re.I)
+_EQUALITY = re.compile(r'"?(\w+)"?\s*(?:=\s*(?:ANY\s*\()?|\bIN\s*\()\s*\$\d+', re.I)
+_RANGE = re.compile(r'"?(\w+)"?\s*(?:<=|>=|<|>|\bBETWEEN\b)\s*\$\d+', re.I)
+
+
+def load_indexes(cur):
+    """Return every index of the current schema, partitioned ones counted once for all partitions."""
+    cur.execute(INDEXES_QUERY)
+    return [Index(*row) for row in cur.fetchall()]
+
+
+def stats_age_days(cur):
+    """Days of activity covered by the statistics counters of the current database."""
+    cur.execute("""
+        SELECT coalesce(stats_reset, pg_postmaster_start_time())
+        FROM pg_stat_database WHERE datname = current_database();
+    """)
+    since = cur.fetchone()[0]
+    return max((datetime.now(timezone.utc) - since).total_seconds() / 86400, 1 / 24)
+
+
+def _same_shape(a, b):
+    """True when two indexes can serve the same lookups apart from their column lists."""
+    return (a.table == b.table and a.method == b.method == 'btree'
+            and a.expressions == b.expressions and a.predicate == b.predicate)
+
+
+def duplicate_indexes(indexes):
+    """Return [(redundant index, covering index)].
+
+    An index is redundant when another one has the same columns, or starts
+    with all of its columns and the redundant one enforces no uniqueness.
+    Indexes backing a constraint are never the redundant side.
+    """
+    found = []
+    for a in indexes:
+        if a.constraint or a.expressions:
+            continue
+        for b in indexes:
+            if a is b or not _same_shape(a, b):
+                continue
+            opclasses_a, opclasses_b = a.opclasses.split(), b.opclasses.split()
+            if opclasses_b[:len(opclasses_a)] != opclasses_a:
+                continue
+            if a.columns == b.columns and (b.unique or not a.unique):
+                # Of two identical plain indexes keep the first by name
+                if b.constraint or b.unique != a.unique or b.name < a.name:
+                    found.append((a, b))
+                    break
+            elif b.columns[:len(a.columns)] == a.columns and len(b.columns) > len(a.columns) and not a.unique:
+                found.append((a, b))
+                break
+    return found
+
+
+def unused_indexes(indexes):
+    """Return the indexes never scanned that enforce nothing."""
+    return [index for index in indexes
+            if not index.scans and not index.unique and not index.constraint]
+
+
+def load_statements(cur, limit=INDEX_AUDIT_TOP_QUERIES):
+    """Return [(query, calls, total_ms)] from pg_stat_statements, or None when it is not installed."""
+    for total_time in ('total_exec_time', 'total_time'):
+        cur.execute('SAVEPOINT statements;')
+        try:
+            cur.execute(STATEMENTS_QUERY.format(total_time=total_time), (limit,))
+            return cur.fetchall()
+        except errors.UndefinedColumn:
+            cur.execute('ROLLBACK TO SAVEPOINT statements;')
+        except (errors.UndefinedTable, errors.ObjectNotInPrerequisiteState):
+            cur.execute('ROLLBACK TO SAVEPOINT statements;')
+            return None
+    return None
+
+
+def _covered(index, equality, range_column):
+    leading = index.columns[:len(equality)]
+    if index.expressions or index.predicate or set(leading) != set(equality):
+        return False
+    return range_column is None or index.columns[len(equality):len(equality) + 1] == [range_column]
+
+
+def missing_indexes(cur, indexes, statements, min_rows=INDEX_AUDIT_MIN_ROWS):
+    """Propose indexes for the filters of the observed statements that no index serves.
+
+    Returns [{'table', 'columns', 'calls', 'total_ms', 'seq_scans', 'query'}],
+    the most expensive first. Equality columns lead, followed by at most one
+    range column.
+    """
+    cur.execute(TABLES_QUERY)
+    tables = {name: (set(columns), live, seq_scans, seq_read)
+              for name, columns, live, seq_scans, seq_read in cur.fetchall()}
+    proposals = {}
+    for query, calls, total_ms in statements:
+        referenced = [name for name in _TABLE_REFERENCE.findall(query) if name in tables]
+        if not referenced:
+            continue
+        equality = {}
+        ranges = {}
+        for pattern, target in ((_EQUALITY, equality), (_RANGE, ranges)):
+            for column in pattern.findall(query):
+                owners = [name for name in referenced if column in tables[name][0]]
+                if len(owners) == 1:
+                    target.setdefault(owners[0], [])
+                    if column not in target[owners[0]]:
+                        target[owners[0]].append(column)
+        for table in set(equality) | set(ranges):
+            columns, live, seq_scans, _ = tables[table]
+            if live < min_rows or not seq_scans:
+                continue
+            eq = equality.get(table, [])
+            range_column = next((c for c in ranges.get(table, []) if c not in eq), None)
+            if any(_covered(index, eq, range_column) for index in indexes if index.table == table):
+                continue
+            key = (table, tuple(eq) + ((range_column,) if range_column else ()))
+            proposal = proposals.setdefault(key, {'table': table, 'columns': list(key[1]), 'calls': 0,
+                                                  'total_ms': 0.0, 'seq_scans': seq_scans, 'query': query})
+            proposal['calls'] += calls
+            proposal['total_ms'] += total_ms
+    return sorted(proposals.values(), key=lambda proposal: proposal['total_ms'], reverse=True)
+
+
+def audit(cur, statements_limit=INDEX_AUDIT_TOP_QUERIES, min_rows=INDEX_AUDIT_MIN_ROWS):
+    """Return the audit report of the current database as a dict."""
+    indexes = load_indexes(cur)
+    days = stats_age_days(cur)
+
+    def cost(index):
+        return {'table': index.table, 'index': index.name, 'size_bytes': index.size, 'scans': index.scans,
+                'writes_per_day': round(index.writes / days), 'partitioned': index.partitioned}
+
+    duplicates = duplicate_indexes(indexes)
+    redundant = {index.name for index, _ in duplicates}
+    statements = load_statements(cur, statements_limit)
+    return {
+        'stats_days': round(days, 1),
+        'duplicates': [dict(cost(index), covered_by=covering.name) for index, covering in duplicates],
+        'unused': [cost(index) for index in unused_indexes(indexes) if index.name not in redundant],
+        'missing': None if statements is None else missing_indexes(cur, indexes, statements, min_rows),
+    }
+
+
+def statements_sql(report):
+    """Render the recommendations of a report as DDL to copy into a migration."""
+    lines = []
+    for entry in report['duplicates'] + report['unused']:
+        # Indexes of partitioned tables cannot be dropped concurrently
+        concurrently = '' if entry['partitioned'] else ' CONCURRENTLY'
+        lines.append(f'DROP INDEX{concurrently} IF EXISTS "{entry["index"]}";')
+    for proposal in report['missing'] or []:
+        name = f"{proposal['table']}_{'_'.join(proposal['columns'])}_index"
+        columns = ', '.join(f'"{column}"' for column in proposal['columns'])
+        lines.append(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON "{proposal["table"]}" ({columns});')
+    return lines
+
+
+def _mb(size):
+    return f"{size / 1024 / 1024:.1f} MiB"
+
+
+def print_report(name, report):
+    print(f"== {name} (statistics cover {report['stats_days']} days)")
+    print("Duplicate indexes:")
+    for entry in report['duplicates']:
+        print(f"  {entry['table']}.{entry['index']} is covered by {entry['covered_by']}: "
+              f"{_mb(entry['size_bytes'])}, {entry['writes_per_day']} index writes/day, {entry['scans']} scans")
+    print("Unused indexes:")
+    for entry in report['unused']:
+        print(f"  {entry['table']}.{entry['index']}: "
+              f"{_mb(entry['size_bytes'])}, {entry['writes_per_day']} index writes/day, never scanned")
+    print("Missing indexes:")
+    if report['missing'] is None:
+        print("  pg_stat_statements is not available; add it to shared_preload_libraries "
+              "and run CREATE EXTENSION pg_stat_statements to get proposals.")
+    for proposal in report['missing'] or []:
+        print(f"  {proposal['table']} ({', '.join(proposal['columns'])}): {proposal['calls']} calls, "
+              f"{proposal['total_ms']:.0f} ms total, {proposal['seq_scans']} sequential scans")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Flag duplicate and unused indexes and propose missing ones.")
+    parser.add_argument("--database", choices=sorted(DATABASES), action="append",
+                        help="only this database (repeatable, default: all)")
+    parser.add_argument("--top", type=int, default=INDEX_AUDIT_TOP_QUERIES,
+                        help="statements of pg_stat_statements considered (default: %(default)s)")
+    parser.add_argument("--min-rows", type=int, default=INDEX_AUDIT_MIN_ROWS,
+                        help="smallest table worth a new index (default: %(default)s)")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--json", action="store_true", help="print the report as JSON")
+    output.add_argument("--sql", action="store_true", help="print the recommended DDL")
+    args = parser.parse_args()
+
+    try:
+        reports = {}
+        for name in args.database or DATABASES:
+            with connection(name) as conn:
+                with conn.cursor() as cur:
+                    reports[name] = audit(cur, args.top, args.min_rows)
+        if args.json:
+            print(json.dumps(reports, indent=2))
+        for name, report in reports.items():
+            if args.sql:
+                print(f"-- {name}")
+                print("\n".join(statements_sql(report)))
+            elif not args.json:
+                print_report(name, report)
+    except Exception as e:
+        print("Error auditing indexes:", e)
+        sys.exit(1)
+    finally:
+        close_all()
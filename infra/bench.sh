@@ -0,0 +1,16 @@
+#!/bin/bash
+
+# Start the throwaway Postgres container used by the tests
+echo "Starting the Docker container..."
+docker-compose -f ./infra/docker-compose-test.yml up -d
+
+echo "Installing required Python libraries..."
+pip install psycopg2-binary python-dotenv requests
+
+# Create the schema, then benchmark every seeding stage against a local stand-in API
+python DB-create.py || exit 1
+python bench/run.py --reset "$@"
+status=$?
+
+echo "Benchmark finished with status $status."
+exit $status
@@ -0,0 +1,117 @@
+from dotenv import load_dotenv
+import os
+from datetime import datetime, timedelta
+import argparse
+import csv
+import json
+import secrets
+import sys
+from psycopg2.extras import execute_values
+from db import close_all, transaction
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Random bytes per token (the URL-safe text is about 4/3 as long)
+INVITE_TOKEN_BYTES = int(os.getenv('INVITE_TOKEN_BYTES', '32'))
+
+# Days an invite stays valid
+INVITE_TTL_DAYS = int(os.getenv('INVITE_TTL_DAYS', '7'))
+
+# Invites inserted per statement
+INVITE_PAGE_SIZE = int(os.getenv('INVITE_PAGE_SIZE', '5000'))
+
+# Rounds of regenerating colliding tokens before giving up
+INVITE_MAX_RETRIES = 5
+
+
+def generate_tokens(count, length=INVITE_TOKEN_BYTES):
+    """Return count distinct random tokens."""
+    tokens = set()
+    while len(tokens) < count:
+        tokens.add(secrets.token_urlsafe(length))
+    return list(tokens)
+
+
+def insert_tokens(cur, tokens, expires_at, now):
+    """Insert one page of invites in one statement and return the tokens that did not collide."""
+    rows = [(token, expires_at, now, now) for token in tokens]
+    inserted = execute_values(cur, """
+        INSERT INTO "invites" ("token", "expires_at", "created_at", "updated_at") VALUES %s
+        ON CONFLICT ("token") DO NOTHING
+        RETURNING "token";
+    """, rows, page_size=len(rows), fetch=True)
+    return [token for (token,) in inserted]
+
+
+def issue_invites(cur, count, days=INVITE_TTL_DAYS, length=INVITE_TOKEN_BYTES, page_size=INVITE_PAGE_SIZE):
+    """Insert count new invites in the caller's transaction and yield (token, expires_at) page by page.
+
+    A token already taken is replaced by a fresh one; only the colliding
+    rows are sent again. The tokens become valid when the caller commits.
+    """
+    now = datetime.now().replace(microsecond=0)
+    expires_at = now + timedelta(days=days)
+    remaining = count
+    while remaining > 0:
+        wanted = min(page_size, remaining)
+        issued = []
+        for _ in range(INVITE_MAX_RETRIES + 1):
+            issued += insert_tokens(cur, generate_tokens(wanted - len(issued), length), expires_at, now)
+            if len(issued) == wanted:
+                break
+        else:
+            raise RuntimeError(f"Could not find {wanted - len(issued)} unused tokens after {INVITE_MAX_RETRIES} retries")
+        remaining -= wanted
+        for token in issued:
+            yield token, expires_at
+
+
+def write_csv(invites, f):
+    """Stream (token, expires_at) pairs to f as CSV with a header; return how many were written."""
+    writer = csv.writer(f)
+    writer.writerow(("token", "expires_at"))
+    count = 0
+    for token, expires_at in invites:
+        writer.writerow((token, expires_at.isoformat(sep=' ')))
+        count += 1
+    return count
+
+
+def write_json(invites, f):
+    """Stream (token, expires_at) pairs to f as a JSON array; return how many were written."""
+    f.write("[")
+    count = 0
+    for token, expires_at in invites:
+        f.write(",\n" if count else "\n")
+        f.write(json.dumps({"token": token, "expires_at": expires_at.isoformat(sep=' ')}))
+        count += 1
+    f.write("\n]\n")
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Issue invites in bulk and print their tokens.")
+    parser.add_argument("count", type=int, help="number of invites")
+    parser.add_argument("--days", type=int, default=INVITE_TTL_DAYS, help="validity in days (default: %(default)s)")
+    parser.add_argument("--format", choices=("csv", "json"), default="csv")
+    parser.add_argument("--output", help="file to write the tokens to (default: standard output)")
+    args = parser.parse_args()
+
+    write = write_csv if args.format == "csv" else write_json
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        # One transaction: either every invite is issued or none is
+        with transaction("invites") as cur:
+            issued = write(issue_invites(cur, args.count, args.days), output)
+        print(f"{issued} invites issued.", file=sys.stderr)
+    except Exception as e:
+        print("Error issuing invites, none were issued:", e, file=sys.stderr)
+        if args.output:
+            output.close()
+            os.unlink(args.output)
+        sys.exit(1)
+    finally:
+        if args.output and not output.closed:
+            output.close()
+        close_all()
@@ -0,0 +1,82 @@
+import codecs
+import json
+
+# Bytes read from the underlying file at a time
+JSON_STREAM_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = _WHITESPACE + ',]'
+
+
+def iter_json_array(f, chunk_size=JSON_STREAM_CHUNK_SIZE):
+    """Yield the elements of a top-level JSON array read incrementally from a binary file.
+
+    Only the current chunk and the element being decoded are held in memory,
+    so memory use does not grow with the size of the array.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        """Append the next chunk to the buffer; return False at end of file."""
+        nonlocal buffer, pos, eof
+        if eof:
+            return False
+        data = f.read(chunk_size)
+        if not data:
+            eof = True
+            buffer = buffer[pos:] + utf8.decode(b'', final=True)
+            pos = 0
+            return False
+        # Drop what was already consumed so the buffer stays bounded
+        buffer = buffer[pos:] + utf8.decode(data)
+        pos = 0
+        return True
+
+    def next_token():
+        """Skip whitespace and return the next character without consuming it ('' at end)."""
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not fill():
+                return ''
+
+    if next_token() != '[':
+        raise ValueError("Expected a JSON array")
+    pos += 1
+    if next_token() == ']':
+        return
+
+    while True:
+        token = next_token()
+        if not token:
+            raise ValueError("Unexpected end of JSON array")
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if fill():
+                    continue
+                raise
+            # A number or literal cut by the chunk boundary decodes as a shorter value;
+            # only trust it once the following delimiter has been read
+            if (not isinstance(value, (dict, list, str))
+                    and (end == len(buffer) or buffer[end] not in _DELIMITERS) and fill()):
+                continue
+            break
+        pos = end
+        yield value
+
+        token = next_token()
+        if token == ',':
+            pos += 1
+        elif token == ']':
+            return
+        else:
+            raise ValueError(f"Expected ',' or ']' in JSON array, got {token!r}")
@@ -0,0 +1,297 @@
+import psycopg2.extensions
+from dotenv import load_dotenv
+import os
+from contextlib import contextmanager
+import json
+import tempfile
+import threading
+import time
+import http_client
+from db import set_connection_factory
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Where each run writes <run>.json and <run>.prom
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics'))
+
+# Set to 0 to run without instrumented connections and without writing metrics files
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, float('inf'))
+
+# Prefix of every exported metric name
+METRICS_PREFIX = 'pythonpop'
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, as Prometheus exposes them."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            buckets['+Inf' if bound == float('inf') else repr(bound)] = cumulative
+        return {'count': self.count, 'sum': round(self.sum, 6), 'max': round(self.max, 6), 'buckets': buckets}
+
+    def merge(self, data):
+        """Add the observations of another histogram's as_dict()."""
+        previous = 0
+        for i, cumulative in enumerate(data['buckets'].values()):
+            self.counts[i] += cumulative - previous
+            previous = cumulative
+        self.count += data['count']
+        self.sum += data['sum']
+        self.max = max(self.max, data['max'])
+
+
+def _merge_http(into, stats):
+    """Add the HTTP counters of one host to those already in into."""
+    if into is None:
+        return {**stats, 'statuses': dict(stats['statuses'])}
+    for key in ('requests', 'retries', 'errors', 'throttled', 'total_s', 'rate_limit_wait_s'):
+        into[key] += stats[key]
+    into['max_ms'] = max(into['max_ms'], stats['max_ms'])
+    into['mean_ms'] = round(into['total_s'] / into['requests'] * 1000, 1) if into['requests'] else 0.0
+    for status, count in stats['statuses'].items():
+        into['statuses'][status] = into['statuses'].get(status, 0) + count
+    return into
+
+
+class Registry:
+    """Thread-safe store of the phase timings and database statement metrics of this process."""
+
+    def __init__(self):
+        self._phases = {}  # phase -> Histogram
+        self._statements = {}  # (database, statement) -> [Histogram, rows]
+        self._http = {}  # host -> HTTP counters merged from other processes
+        self._lock = threading.Lock()
+
+    def observe_phase(self, name, seconds):
+        with self._lock:
+            self._phases.setdefault(name, Histogram()).observe(seconds)
+
+    def observe_statement(self, database, statement, seconds, rows):
+        with self._lock:
+            entry = self._statements.setdefault((database, statement), [Histogram(), 0])
+            entry[0].observe(seconds)
+            if rows > 0:
+                entry[1] += rows
+
+    def snapshot(self):
+        """Return every metric as a JSON-serialisable dict, HTTP counters included."""
+        with self._lock:
+            phases = {name: histogram.as_dict() for name, histogram in self._phases.items()}
+            statements = [{'database': database, 'statement': statement, 'rows': rows, **histogram.as_dict()}
+                          for (database, statement), (histogram, rows) in sorted(self._statements.items())]
+            http = {host: _merge_http(None, stats) for host, stats in self._http.items()}
+        for host, stats in http_client.get_client().stats().items():
+            http[host] = _merge_http(http.get(host), stats)
+        return {'phases': phases, 'statements': statements, 'http': http}
+
+    def merge(self, snapshot):
+        """Add the metrics of another process, as returned by its snapshot()."""
+        with self._lock:
+            for name, histogram in snapshot['phases'].items():
+                self._phases.setdefault(name, Histogram()).merge(histogram)
+            for entry in snapshot['statements']:
+                merged = self._statements.setdefault((entry['database'], entry['statement']), [Histogram(), 0])
+                merged[0].merge(entry)
+                merged[1] += entry['rows']
+            for host, stats in snapshot['http'].items():
+                self._http[host] = _merge_http(self._http.get(host), stats)
+
+    def reset(self):
+        with self._lock:
+            self._phases.clear()
+            self._statements.clear()
+            self._http.clear()
+
+
+registry = Registry()
+
+
+@contextmanager
+def phase(name):
+    """Time the block as one occurrence of the named phase.
+
+    Phases timed on several threads at once add up to more than the wall time.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe_phase(name, time.perf_counter() - start)
+
+
+def statement_kind(query):
+    """Return the leading keyword of a statement, e.g. SELECT, INSERT or WITH."""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    words = query.lstrip(' \t\r\n(').split(None, 1)
+    return words[0].upper().rstrip(';') if words else ''
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor recording the latency and rows affected of every statement."""
+
+    def _observe(self, query, start):
+        if not isinstance(query, (str, bytes)):
+            # A psycopg2.sql composable
+            query = query.as_string(self)
+        registry.observe_statement(self.connection.info.dbname, statement_kind(query),
+                                   time.perf_counter() - start, self.rowcount)
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._observe(query, start)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._observe(query, start)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            self._observe(sql, start)
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Connection handing out instrumented cursors and timing commits and rollbacks."""
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault('cursor_factory', InstrumentedCursor)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            registry.observe_statement(self.info.dbname, 'COMMIT', time.perf_counter() - start, 0)
+
+    def rollback(self):
+        start = time.perf_counter()
+        try:
+            return super().rollback()
+        finally:
+            registry.observe_statement(self.info.dbname, 'ROLLBACK', time.perf_counter() - start, 0)
+
+
+def install():
+    """Open every future pooled connection as an instrumented one; a no-op when metrics are disabled."""
+    if METRICS_ENABLED:
+        set_connection_factory(InstrumentedConnection)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _histogram_lines(name, labels, histogram):
+    lines = []
+    for bound, count in histogram['buckets'].items():
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {count}")
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram['sum']}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram['count']}")
+    return lines
+
+
+def prometheus_text(snapshot, run):
+    """Render a snapshot in the Prometheus text exposition format."""
+    p = METRICS_PREFIX
+    lines = [f"# HELP {p}_phase_seconds Time spent in each phase of the run.",
+             f"# TYPE {p}_phase_seconds histogram"]
+    for name, histogram in snapshot['phases'].items():
+        lines += _histogram_lines(f"{p}_phase_seconds", {'run': run, 'phase': name}, histogram)
+
+    lines += [f"# HELP {p}_db_statement_seconds Latency of the database statements by leading keyword.",
+              f"# TYPE {p}_db_statement_seconds histogram"]
+    for entry in snapshot['statements']:
+        labels = {'run': run, 'database': entry['database'], 'statement': entry['statement']}
+        lines += _histogram_lines(f"{p}_db_statement_seconds", labels, entry)
+    lines += [f"# HELP {p}_db_rows_total Rows affected or returned by the database statements.",
+              f"# TYPE {p}_db_rows_total counter"]
+    for entry in snapshot['statements']:
+        labels = {'run': run, 'database': entry['database'], 'statement': entry['statement']}
+        lines.append(f"{p}_db_rows_total{_labels(**labels)} {entry['rows']}")
+
+    http = [('requests', 'requests_total', 'counter', 'HTTP responses received, retried ones included.'),
+            ('retries', 'retries_total', 'counter', 'HTTP requests sent again after an error, 429 or 5xx.'),
+            ('errors', 'errors_total', 'counter', 'HTTP requests that failed to connect or timed out.'),
+            ('throttled', 'throttled_total', 'counter', 'HTTP 429 responses.'),
+            ('total_s', 'request_seconds_total', 'counter', 'Time spent waiting for HTTP responses.'),
+            ('max_ms', 'request_max_milliseconds', 'gauge', 'Slowest HTTP response.'),
+            ('rate_limit_wait_s', 'rate_limit_wait_seconds_total', 'counter', 'Time spent waiting for the rate limiter.')]
+    for key, name, kind, description in http:
+        lines += [f"# HELP {p}_http_{name} {description}", f"# TYPE {p}_http_{name} {kind}"]
+        for host, stats in snapshot['http'].items():
+            lines.append(f"{p}_http_{name}{_labels(run=run, host=host)} {stats[key]}")
+    return '\n'.join(lines) + '\n'
+
+
+def _write_atomically(path, text):
+    """Write a file through a temporary sibling so scrapers never read a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def export(run, directory=METRICS_DIR):
+    """Write the metrics of this process to <directory>/<run>.json and <run>.prom; return both paths."""
+    if not METRICS_ENABLED:
+        return None
+    snapshot = registry.snapshot()
+    snapshot['run'] = run
+    snapshot['finished_at'] = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    os.makedirs(directory, exist_ok=True)
+    json_path = os.path.join(directory, f"{run}.json")
+    prom_path = os.path.join(directory, f"{run}.prom")
+    _write_atomically(json_path, json.dumps(snapshot, indent=2) + '\n')
+    _write_atomically(prom_path, prometheus_text(snapshot, run))
+    return json_path, prom_path
+
+
+def print_summary():
+    """Print the time spent per phase and the busiest statement kinds."""
+    snapshot = registry.snapshot()
+    for name, histogram in snapshot['phases'].items():
+        print(f"{name}: {histogram['sum']:.3f} s over {histogram['count']} runs (longest {histogram['max']:.3f} s).")
+    statements = sorted(snapshot['statements'], key=lambda entry: entry['sum'], reverse=True)
+    for entry in statements[:10]:
+        print(f"{entry['database']} {entry['statement']}: {entry['count']} statements, {entry['sum']:.3f} s, "
+              f"{entry['rows']} rows (longest {entry['max'] * 1000:.1f} ms).")
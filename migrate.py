@@ -0,0 +1,248 @@
+from dotenv import load_dotenv
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import hashlib
+import importlib.util
+import re
+import sys
+import psycopg2
+from psycopg2 import errors
+from db import DATABASES, close_all, connection
+
+# Load environment variables from .env file
+load_dotenv()
+
+# One sub-directory of versioned migrations per database name of db.py
+MIGRATIONS_DIR = os.getenv('MIGRATIONS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
+
+# First line of a .sql migration that must run outside a transaction (CREATE INDEX CONCURRENTLY)
+NO_TRANSACTION_MARKER = '-- migrate:no-transaction'
+
+# Key of the advisory lock serialising concurrent migration runs on one database
+MIGRATION_LOCK_KEY = 7_270_412
+
+_FILE_NAME = re.compile(r'^(\d+)_(\w+)\.(sql|py)$')
+_STATEMENT_END = re.compile(r';[ \t]*$', re.M)
+_CONCURRENT_INDEX = re.compile(r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(?:"([^"]+)"|(\w+))',
+                               re.I)
+
+Migration = namedtuple('Migration', 'version name path kind checksum transactional')
+
+
+class MigrationError(Exception):
+    """Raised when the migration files and the applied history disagree."""
+
+
+def load_migrations(database):
+    """Return the migrations of a database ordered by version.
+
+    Files are named NNNN_description.sql or NNNN_description.py; a .py
+    migration defines migrate(cur).
+    """
+    directory = os.path.join(MIGRATIONS_DIR, database)
+    migrations = []
+    if not os.path.isdir(directory):
+        return migrations
+    for file_name in sorted(os.listdir(directory)):
+        match = _FILE_NAME.match(file_name)
+        if not match:
+            continue
+        path = os.path.join(directory, file_name)
+        with open(path, 'rb') as f:
+            content = f.read()
+        transactional = not content.decode('utf-8').startswith(NO_TRANSACTION_MARKER)
+        migrations.append(Migration(int(match.group(1)), match.group(2), path, match.group(3),
+                                    hashlib.sha256(content).hexdigest(), transactional))
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise MigrationError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+def applied_migrations(conn):
+    """Return {version: checksum} of the migrations already applied, creating the history table if needed."""
+    with conn.cursor() as cur:
+        try:
+            cur.execute('SELECT version, checksum FROM schema_migrations;')
+            applied = dict(cur.fetchall())
+        except errors.UndefinedTable:
+            conn.rollback()
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name VARCHAR NOT NULL,
+                    checksum CHAR(64) NOT NULL,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+            """)
+            applied = {}
+    conn.commit()
+    return applied
+
+
+def pending_migrations(migrations, applied):
+    """Return the migrations not applied yet, rejecting any applied file that changed."""
+    known = {migration.version for migration in migrations}
+    for migration in migrations:
+        checksum = applied.get(migration.version)
+        if checksum is not None and checksum != migration.checksum:
+            raise MigrationError(f"Migration {os.path.basename(migration.path)} was modified after being applied")
+    missing = sorted(set(applied) - known)
+    if missing:
+        raise MigrationError(f"Applied migrations {missing} have no file anymore")
+    return [migration for migration in migrations if migration.version not in applied]
+
+
+def invalid_indexes(cur, names):
+    """Return the names among names of the indexes of the current schema marked invalid."""
+    cur.execute("""
+        SELECT c.relname FROM pg_index x JOIN pg_class c ON c.oid = x.indexrelid
+        WHERE c.relnamespace = current_schema()::regnamespace AND c.relname = ANY(%s) AND NOT x.indisvalid;
+    """, (list(names),))
+    return [name for (name,) in cur.fetchall()]
+
+
+def _run_sql(cur, migration):
+    with open(migration.path) as f:
+        script = f.read()
+    if migration.transactional:
+        cur.execute(script)
+        return
+    # A CREATE INDEX CONCURRENTLY that failed partway leaves an invalid index,
+    # which IF NOT EXISTS would then keep: drop it so the retry builds it again
+    indexes = [quoted or bare for quoted, bare in _CONCURRENT_INDEX.findall(script)]
+    for name in invalid_indexes(cur, indexes):
+        cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}";')
+    # Outside a transaction every statement has to be sent on its own
+    for statement in _STATEMENT_END.split(script):
+        if statement.strip() and not all(line.strip().startswith('--') or not line.strip()
+                                         for line in statement.splitlines()):
+            cur.execute(statement)
+    invalid = invalid_indexes(cur, indexes)
+    if invalid:
+        raise MigrationError(f"Migration {os.path.basename(migration.path)} left invalid indexes {invalid}")
+
+
+def _run_python(cur, migration):
+    spec = importlib.util.spec_from_file_location(f"migration_{migration.version:04d}", migration.path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.migrate(cur)
+
+
+def apply_migration(conn, migration):
+    """Apply one migration and record it, atomically unless it opted out of transactions."""
+    conn.autocommit = not migration.transactional
+    try:
+        with conn.cursor() as cur:
+            if migration.kind == 'py':
+                _run_python(cur, migration)
+            else:
+                _run_sql(cur, migration)
+            cur.execute(
+                "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s);",
+                (migration.version, migration.name, migration.checksum)
+            )
+        if migration.transactional:
+            conn.commit()
+    except BaseException:
+        if migration.transactional:
+            conn.rollback()
+        raise
+    finally:
+        conn.autocommit = False
+
+
+def migrate_database(name):
+    """Bring a named database up to date and return the list of migrations applied.
+
+    An up-to-date database costs one query. Otherwise the run holds an
+    advisory lock so that containers booting together apply each migration once.
+    """
+    migrations = load_migrations(name)
+    with connection(name) as conn:
+        if not pending_migrations(migrations, applied_migrations(conn)):
+            return []
+        with conn.cursor() as cur:
+            cur.execute('SELECT pg_advisory_lock(%s);', (MIGRATION_LOCK_KEY,))
+        conn.commit()
+        try:
+            # Another process may have applied some while we waited for the lock
+            pending = pending_migrations(migrations, applied_migrations(conn))
+            for migration in pending:
+                apply_migration(conn, migration)
+            return pending
+        finally:
+            with conn.cursor() as cur:
+                cur.execute('SELECT pg_advisory_unlock(%s);', (MIGRATION_LOCK_KEY,))
+            conn.commit()
+
+
+def ensure_database(name):
+    """Create a named database on the server of the main database when connecting to it fails for lack of it.
+
+    Returns True when the database was created.
+    """
+    try:
+        with connection(name):
+            return False
+    except psycopg2.OperationalError as e:
+        if 'does not exist' not in str(e):
+            raise
+    with connection("main", autocommit=True) as conn:
+        with conn.cursor() as cur:
+            try:
+                cur.execute(f'CREATE DATABASE "{DATABASES[name]}" WITH OWNER = "{os.getenv("DB_USER")}";')
+            except errors.DuplicateDatabase:
+                return False
+    return True
+
+
+def _migrate(name):
+    created = name != "main" and ensure_database(name)
+    return created, migrate_database(name)
+
+
+def migrate_all(names=None):
+    """Migrate every database of db.py concurrently; return {name: (created, applied migrations)}."""
+    names = list(names or DATABASES)
+    with ThreadPoolExecutor(max_workers=len(names)) as executor:
+        futures = {name: executor.submit(_migrate, name) for name in names}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def migration_status(name):
+    """Return [(migration, applied)] for a named database."""
+    migrations = load_migrations(name)
+    with connection(name) as conn:
+        applied = applied_migrations(conn)
+    pending_migrations(migrations, applied)
+    return [(migration, migration.version in applied) for migration in migrations]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the versioned schema migrations.")
+    parser.add_argument("command", nargs="?", choices=("apply", "status"), default="apply")
+    parser.add_argument("--database", choices=sorted(DATABASES), action="append",
+                        help="only this database (repeatable, default: all)")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "apply":
+            for name, (created, applied) in migrate_all(args.database).items():
+                if created:
+                    print(f"Database '{DATABASES[name]}' created.")
+                for migration in applied:
+                    print(f"{name}: applied {os.path.basename(migration.path)}")
+                print(f"{name}: up to date.")
+        else:
+            for name in args.database or DATABASES:
+                for migration, applied in migration_status(name):
+                    print(f"{name}\t{'applied' if applied else 'pending'}\t{os.path.basename(migration.path)}")
+    except Exception as e:
+        print("Error applying migrations:", e)
+        sys.exit(1)
+    finally:
+        close_all()
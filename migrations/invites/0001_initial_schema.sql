@@ -0,0 +1,136 @@
+-- Baseline schema of the invites database. Every statement is idempotent so it
+-- also applies cleanly to databases created before migrations existed.
+
+CREATE TABLE IF NOT EXISTS "permissions" (
+    "id" SERIAL PRIMARY KEY,
+    "name" VARCHAR NOT NULL,
+    "guard_name" VARCHAR NOT NULL,
+    "created_at" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    "updated_at" TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE UNIQUE INDEX IF NOT EXISTS "permissions_unique_index"
+ON "permissions" ("name", "guard_name");
+
+CREATE TABLE IF NOT EXISTS "roles" (
+    "id" SERIAL PRIMARY KEY,
+    "name" VARCHAR NOT NULL,
+    "guard_name" VARCHAR NOT NULL,
+    "created_at" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    "updated_at" TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE UNIQUE INDEX IF NOT EXISTS "Roles_unique_index"
+ON "roles" ("name", "guard_name");
+
+CREATE TABLE IF NOT EXISTS "model_has_permissions" (
+    "permission_id" INTEGER NOT NULL,
+    "model_type" VARCHAR NOT NULL,
+    "model_id" INTEGER NOT NULL,
+    PRIMARY KEY ("permission_id", "model_id", "model_type"),
+    FOREIGN KEY ("permission_id") REFERENCES "permissions" ("id") ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS "ModelHasPermissions_model_id_model_type_index"
+ON "model_has_permissions" ("model_id", "model_type");
+
+CREATE TABLE IF NOT EXISTS "model_has_roles" (
+    "role_id" INTEGER NOT NULL,
+    "model_type" VARCHAR NOT NULL,
+    "model_id" INTEGER NOT NULL,
+    PRIMARY KEY ("role_id", "model_id", "model_type"),
+    FOREIGN KEY ("role_id") REFERENCES "roles" ("id") ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS "ModelHasRoles_model_id_model_type_index"
+ON "model_has_roles" ("model_id", "model_type");
+
+CREATE TABLE IF NOT EXISTS "role_has_permissions" (
+    "permission_id" INTEGER NOT NULL,
+    "role_id" INTEGER NOT NULL,
+    PRIMARY KEY ("permission_id", "role_id"),
+    FOREIGN KEY ("permission_id") REFERENCES "permissions" ("id") ON DELETE CASCADE,
+    FOREIGN KEY ("role_id") REFERENCES "roles" ("id") ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS "users" (
+    "id" SERIAL PRIMARY KEY,
+    "firstname" VARCHAR NOT NULL,
+    "lastname" VARCHAR NOT NULL,
+    "email" VARCHAR NOT NULL UNIQUE,
+    "password" VARCHAR NOT NULL,
+    "manager_id" INTEGER,
+    "created_at" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    "updated_at" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY ("manager_id") REFERENCES "users" ("id")
+);
+
+CREATE TABLE IF NOT EXISTS "invites" (
+    "id" SERIAL PRIMARY KEY,
+    "token" VARCHAR NOT NULL UNIQUE,
+    "expires_at" TIMESTAMP,
+    "created_at" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    "updated_at" TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS "sessions" (
+    "id" VARCHAR PRIMARY KEY,
+    "user_id" INTEGER,
+    "ip_address" VARCHAR(45),
+    "user_agent" TEXT,
+    "payload" TEXT,
+    "last_activity" INTEGER,
+    FOREIGN KEY ("user_id") REFERENCES "users" ("id") ON DELETE SET NULL
+);
+CREATE INDEX IF NOT EXISTS "sessions_user_id_index" ON "sessions" ("user_id");
+CREATE INDEX IF NOT EXISTS "sessions_last_activity_index" ON "sessions" ("last_activity");
+
+CREATE TABLE IF NOT EXISTS "password_reset_tokens" (
+    "email" VARCHAR(255) NOT NULL,
+    "token" VARCHAR(255) NOT NULL,
+    "created_at" TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY ("email")
+);
+
+CREATE TABLE IF NOT EXISTS "jobs" (
+    "id" SERIAL PRIMARY KEY,
+    "queue" VARCHAR NOT NULL,
+    "payload" TEXT NOT NULL,
+    "attempts" INTEGER NOT NULL,
+    "reserved_at" INTEGER,
+    "available_at" INTEGER NOT NULL,
+    "created_at" INTEGER NOT NULL
+);
+-- Reservation scans the jobs of one queue that are due
+CREATE INDEX IF NOT EXISTS "jobs_queue_available_at_index" ON "jobs" ("queue", "available_at");
+
+CREATE TABLE IF NOT EXISTS "job_batches" (
+    "id" VARCHAR PRIMARY KEY,
+    "name" VARCHAR NOT NULL,
+    "total_jobs" INTEGER NOT NULL,
+    "pending_jobs" INTEGER NOT NULL,
+    "failed_jobs" INTEGER NOT NULL,
+    "failed_job_ids" TEXT NOT NULL,
+    "options" TEXT,
+    "cancelled_at" INTEGER,
+    "created_at" INTEGER NOT NULL,
+    "finished_at" INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS "failed_jobs" (
+    "id" SERIAL PRIMARY KEY,
+    "uuid" VARCHAR NOT NULL UNIQUE,
+    "connection" TEXT NOT NULL,
+    "queue" TEXT NOT NULL,
+    "payload" TEXT NOT NULL,
+    "exception" TEXT NOT NULL,
+    "failed_at" TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS "cache" (
+    "key" VARCHAR PRIMARY KEY,
+    "value" TEXT,
+    "expiration" INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS "cache_locks" (
+    "key" VARCHAR PRIMARY KEY,
+    "owner" VARCHAR,
+    "expiration" INTEGER
+);
@@ -0,0 +1,5 @@
+-- migrate:no-transaction
+-- Left by databases created before migrations existed; both duplicate an
+-- index backing a constraint (see index_audit.py)
+DROP INDEX CONCURRENTLY IF EXISTS "Users_index_0";
+DROP INDEX CONCURRENTLY IF EXISTS "invites_token_unique_index";
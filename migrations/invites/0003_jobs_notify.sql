@@ -0,0 +1,18 @@
+-- Wake idle queue workers (queue_worker.py) as soon as a job is queued. NOTIFY
+-- folds identical payloads of one transaction, so a bulk dispatch sends one
+-- notification per queue
+CREATE OR REPLACE FUNCTION jobs_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('jobs', NEW."queue");
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS "jobs_notify_trigger" ON "jobs";
+CREATE TRIGGER "jobs_notify_trigger"
+AFTER INSERT ON "jobs"
+FOR EACH ROW EXECUTE FUNCTION jobs_notify();
+
+-- Superseded by "jobs_queue_available_at_index" on databases created before
+-- migrations existed
+DROP INDEX IF EXISTS "jobs_queue_index";
@@ -0,0 +1,4 @@
+-- Cache entries and locks can be rebuilt at any time: skip the WAL for them
+-- (they are emptied after a crash and not replicated)
+ALTER TABLE "cache" SET UNLOGGED;
+ALTER TABLE "cache_locks" SET UNLOGGED;
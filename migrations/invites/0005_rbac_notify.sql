@@ -0,0 +1,61 @@
+-- Tell the in-process permission caches of rbac.py what changed: the model
+-- whose roles or direct permissions moved, or 'roles' when role definitions did
+CREATE OR REPLACE FUNCTION rbac_notify() RETURNS trigger AS $$
+DECLARE
+    changed RECORD;
+BEGIN
+    IF TG_LEVEL = 'STATEMENT' THEN
+        PERFORM pg_notify('rbac', 'all');
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        changed := OLD;
+    ELSE
+        changed := NEW;
+    END IF;
+    IF TG_TABLE_NAME IN ('model_has_roles', 'model_has_permissions') THEN
+        PERFORM pg_notify('rbac', 'model:' || changed.model_type || ':' || changed.model_id);
+        IF TG_OP = 'UPDATE' THEN
+            PERFORM pg_notify('rbac', 'model:' || OLD.model_type || ':' || OLD.model_id);
+        END IF;
+    ELSE
+        PERFORM pg_notify('rbac', 'roles');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS "permissions_rbac_notify" ON "permissions";
+CREATE TRIGGER "permissions_rbac_notify" AFTER INSERT OR UPDATE OR DELETE ON "permissions"
+FOR EACH ROW EXECUTE FUNCTION rbac_notify();
+DROP TRIGGER IF EXISTS "permissions_rbac_notify_truncate" ON "permissions";
+CREATE TRIGGER "permissions_rbac_notify_truncate" AFTER TRUNCATE ON "permissions"
+FOR EACH STATEMENT EXECUTE FUNCTION rbac_notify();
+
+DROP TRIGGER IF EXISTS "roles_rbac_notify" ON "roles";
+CREATE TRIGGER "roles_rbac_notify" AFTER INSERT OR UPDATE OR DELETE ON "roles"
+FOR EACH ROW EXECUTE FUNCTION rbac_notify();
+DROP TRIGGER IF EXISTS "roles_rbac_notify_truncate" ON "roles";
+CREATE TRIGGER "roles_rbac_notify_truncate" AFTER TRUNCATE ON "roles"
+FOR EACH STATEMENT EXECUTE FUNCTION rbac_notify();
+
+DROP TRIGGER IF EXISTS "role_has_permissions_rbac_notify" ON "role_has_permissions";
+CREATE TRIGGER "role_has_permissions_rbac_notify" AFTER INSERT OR UPDATE OR DELETE ON "role_has_permissions"
+FOR EACH ROW EXECUTE FUNCTION rbac_notify();
+DROP TRIGGER IF EXISTS "role_has_permissions_rbac_notify_truncate" ON "role_has_permissions";
+CREATE TRIGGER "role_has_permissions_rbac_notify_truncate" AFTER TRUNCATE ON "role_has_permissions"
+FOR EACH STATEMENT EXECUTE FUNCTION rbac_notify();
+
+DROP TRIGGER IF EXISTS "model_has_roles_rbac_notify" ON "model_has_roles";
+CREATE TRIGGER "model_has_roles_rbac_notify" AFTER INSERT OR UPDATE OR DELETE ON "model_has_roles"
+FOR EACH ROW EXECUTE FUNCTION rbac_notify();
+DROP TRIGGER IF EXISTS "model_has_roles_rbac_notify_truncate" ON "model_has_roles";
+CREATE TRIGGER "model_has_roles_rbac_notify_truncate" AFTER TRUNCATE ON "model_has_roles"
+FOR EACH STATEMENT EXECUTE FUNCTION rbac_notify();
+
+DROP TRIGGER IF EXISTS "model_has_permissions_rbac_notify" ON "model_has_permissions";
+CREATE TRIGGER "model_has_permissions_rbac_notify" AFTER INSERT OR UPDATE OR DELETE ON "model_has_permissions"
+FOR EACH ROW EXECUTE FUNCTION rbac_notify();
+DROP TRIGGER IF EXISTS "model_has_permissions_rbac_notify_truncate" ON "model_has_permissions";
+CREATE TRIGGER "model_has_permissions_rbac_notify_truncate" AFTER TRUNCATE ON "model_has_permissions"
+FOR EACH STATEMENT EXECUTE FUNCTION rbac_notify();
@@ -0,0 +1,151 @@
+-- Baseline schema of the main database. Every statement is idempotent so it
+-- also applies cleanly to databases created before migrations existed.
+
+-- SQL script to create tables and indices
+CREATE TABLE IF NOT EXISTS "WeatherStation" (
+    "Id" SERIAL PRIMARY KEY,
+    "Name" VARCHAR NOT NULL,
+    "Latitude" FLOAT NOT NULL,
+    "Longitude" FLOAT NOT NULL
+);
+
+DROP FUNCTION IF EXISTS delete_old_weather_data() CASCADE;
+
+-- Compact weather stores: one table per measurement family, REAL/SMALLINT
+-- columns ordered widest first to keep alignment padding out of the tuples
+CREATE TABLE IF NOT EXISTS "WeatherCurrent" (
+    "WeatherStationId" INTEGER PRIMARY KEY,
+    "Timestamp" TIMESTAMPTZ NOT NULL,
+    "temperature_2m" REAL,
+    "relative_humidity_2m" REAL,
+    "apparent_temperature" REAL,
+    "precipitation" REAL,
+    "rain" REAL,
+    "showers" REAL,
+    "snowfall" REAL,
+    "cloud_cover" REAL,
+    "pressure_msl" REAL,
+    "surface_pressure" REAL,
+    "wind_speed_10m" REAL,
+    "wind_gusts_10m" REAL,
+    "weather_code" SMALLINT,
+    "wind_direction_10m" SMALLINT,
+    "is_day" BOOLEAN,
+    FOREIGN KEY ("WeatherStationId") REFERENCES "WeatherStation" ("Id")
+        ON UPDATE NO ACTION ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS "WeatherHourly" (
+    "WeatherStationId" INTEGER NOT NULL,
+    "Timestamp" TIMESTAMPTZ NOT NULL,
+    "temperature_2m" REAL,
+    "relative_humidity_2m" REAL,
+    "dew_point_2m" REAL,
+    "apparent_temperature" REAL,
+    "precipitation" REAL,
+    "rain" REAL,
+    "snowfall" REAL,
+    "cloud_cover_total" REAL,
+    "cloud_cover_low" REAL,
+    "cloud_cover_mid" REAL,
+    "cloud_cover_high" REAL,
+    "pressure_msl" REAL,
+    "surface_pressure" REAL,
+    "vapour_pressure_deficit" REAL,
+    "reference_evapotranspiration" REAL,
+    "wind_speed_10m" REAL,
+    "wind_speed_20m" REAL,
+    "wind_speed_50m" REAL,
+    "wind_speed_100m" REAL,
+    "wind_speed_150m" REAL,
+    "wind_speed_200m" REAL,
+    "wind_gusts_10m" REAL,
+    "temperature_20m" REAL,
+    "temperature_50m" REAL,
+    "temperature_100m" REAL,
+    "temperature_150m" REAL,
+    "temperature_200m" REAL,
+    "weather_code" SMALLINT,
+    "wind_direction_10m" SMALLINT,
+    "wind_direction_20m" SMALLINT,
+    "wind_direction_50m" SMALLINT,
+    "wind_direction_100m" SMALLINT,
+    "wind_direction_150m" SMALLINT,
+    "wind_direction_200m" SMALLINT,
+    PRIMARY KEY ("WeatherStationId", "Timestamp"),
+    FOREIGN KEY ("WeatherStationId") REFERENCES "WeatherStation" ("Id")
+        ON UPDATE NO ACTION ON DELETE CASCADE
+) PARTITION BY RANGE ("Timestamp");
+
+CREATE TABLE IF NOT EXISTS "WeatherDaily" (
+    "WeatherStationId" INTEGER NOT NULL,
+    "Date" DATE NOT NULL,
+    "sunrise" TIMESTAMPTZ,
+    "sunset" TIMESTAMPTZ,
+    "daylight_duration" INTEGER,
+    "sunshine_duration" INTEGER,
+    "max_temperature_2m" REAL,
+    "min_temperature_2m" REAL,
+    "max_apparent_temperature" REAL,
+    "min_apparent_temperature" REAL,
+    "uv_index" REAL,
+    "uv_index_clear_sky" REAL,
+    "precipitation_sum" REAL,
+    "rain_sum" REAL,
+    "showers_sum" REAL,
+    "snowfall_sum" REAL,
+    "precipitation_probability_max" REAL,
+    "max_wind_speed_10m" REAL,
+    "max_wind_gusts_10m" REAL,
+    "shortwave_radiation_sum" REAL,
+    "reference_evapotranspiration" REAL,
+    "weather_code" SMALLINT,
+    "precipitation_hours" SMALLINT,
+    "dominant_wind_direction_10m" SMALLINT,
+    PRIMARY KEY ("WeatherStationId", "Date"),
+    FOREIGN KEY ("WeatherStationId") REFERENCES "WeatherStation" ("Id")
+        ON UPDATE NO ACTION ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS "Cities" (
+    "Id" SERIAL PRIMARY KEY,
+    "Name" VARCHAR NOT NULL,
+    "Latitude" FLOAT NOT NULL,
+    "Longitude" FLOAT NOT NULL,
+    "Code" VARCHAR
+);
+-- INSEE code, the natural key used by the delta sync
+ALTER TABLE "Cities" ADD COLUMN IF NOT EXISTS "Code" VARCHAR;
+
+CREATE TABLE IF NOT EXISTS "Departements" (
+    "Id" SERIAL PRIMARY KEY,
+    "Name" VARCHAR NOT NULL,
+    "Latitude" FLOAT NOT NULL,
+    "Longitude" FLOAT NOT NULL,
+    "Numero" VARCHAR NOT NULL
+);
+
+-- Precomputed nearest weather stations (see spatial.py)
+CREATE TABLE IF NOT EXISTS "CityNearestStation" (
+    "CityId" INTEGER NOT NULL,
+    "Rank" SMALLINT NOT NULL,
+    "WeatherStationId" INTEGER NOT NULL,
+    "DistanceKm" REAL NOT NULL,
+    PRIMARY KEY ("CityId", "Rank"),
+    FOREIGN KEY ("CityId") REFERENCES "Cities" ("Id") ON DELETE CASCADE,
+    FOREIGN KEY ("WeatherStationId") REFERENCES "WeatherStation" ("Id") ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS "CityNearestStation_station_index"
+ON "CityNearestStation" ("WeatherStationId");
+
+CREATE TABLE IF NOT EXISTS "DepartementNearestStation" (
+    "DepartementId" INTEGER NOT NULL,
+    "Rank" SMALLINT NOT NULL,
+    "WeatherStationId" INTEGER NOT NULL,
+    "DistanceKm" REAL NOT NULL,
+    PRIMARY KEY ("DepartementId", "Rank"),
+    FOREIGN KEY ("DepartementId") REFERENCES "Departements" ("Id") ON DELETE CASCADE,
+    FOREIGN KEY ("WeatherStationId") REFERENCES "WeatherStation" ("Id") ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS "DepartementNearestStation_station_index"
+ON "DepartementNearestStation" ("WeatherStationId");
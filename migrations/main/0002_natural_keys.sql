@@ -0,0 +1,31 @@
+-- migrate:no-transaction
+-- Secondary indexes on "Id" left by databases created before migrations
+-- existed; they duplicate the primary keys (see index_audit.py) and only
+-- cost writes and storage
+DROP INDEX CONCURRENTLY IF EXISTS "WeatherStation_index_0";
+DROP INDEX CONCURRENTLY IF EXISTS "Cities_index_0";
+DROP INDEX CONCURRENTLY IF EXISTS "Departements_index_0";
+DROP INDEX CONCURRENTLY IF EXISTS "WeatherDatas_index_0";
+
+-- Natural keys of the reference tables, needed by bulk.upsert_key_map and
+-- matched on by the delta sync. Duplicates left by earlier seeds are removed
+-- first, keeping the oldest row (and the data referencing it). Distinct
+-- stations may share a name, so a station is only a duplicate of another one
+-- at the same coordinates
+DELETE FROM "WeatherStation" w USING "WeatherStation" d
+WHERE w."Name" = d."Name" AND w."Latitude" = d."Latitude" AND w."Longitude" = d."Longitude"
+  AND w."Id" > d."Id";
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "WeatherStation_name_coordinates_unique_index"
+ON "WeatherStation" ("Name", "Latitude", "Longitude");
+
+DELETE FROM "Departements" w USING "Departements" d
+WHERE w."Numero" = d."Numero" AND w."Id" > d."Id";
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "Departements_numero_unique_index"
+ON "Departements" ("Numero");
+
+-- Cities seeded before "Code" existed keep a NULL code until the next seed
+-- fills it in (see bulk.copy_merge), so they are not duplicates of each other
+DELETE FROM "Cities" w USING "Cities" d
+WHERE w."Code" = d."Code" AND w."Id" > d."Id";
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "Cities_code_unique_index"
+ON "Cities" ("Code");
@@ -0,0 +1,55 @@
+-- Pre-aggregated weather for charts, refreshed per touched bucket by rollups.py.
+-- Days are UTC days, weeks start on Monday; rollups outlive the raw partitions
+CREATE TABLE IF NOT EXISTS "StationDailyRollup" (
+    "WeatherStationId" INTEGER NOT NULL,
+    "Date" DATE NOT NULL,
+    "temperature_2m_min" REAL,
+    "temperature_2m_max" REAL,
+    "temperature_2m_mean" REAL,
+    "precipitation_sum" REAL,
+    "wind_gusts_10m_max" REAL,
+    "hours" SMALLINT NOT NULL,
+    PRIMARY KEY ("WeatherStationId", "Date"),
+    FOREIGN KEY ("WeatherStationId") REFERENCES "WeatherStation" ("Id") ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS "StationWeeklyRollup" (
+    "WeatherStationId" INTEGER NOT NULL,
+    "Week" DATE NOT NULL,
+    "temperature_2m_min" REAL,
+    "temperature_2m_max" REAL,
+    "temperature_2m_mean" REAL,
+    "precipitation_sum" REAL,
+    "wind_gusts_10m_max" REAL,
+    "hours" SMALLINT NOT NULL,
+    PRIMARY KEY ("WeatherStationId", "Week"),
+    FOREIGN KEY ("WeatherStationId") REFERENCES "WeatherStation" ("Id") ON DELETE CASCADE
+);
+
+-- Department figures combine the stations of DepartementNearestStation:
+-- extremes over all of them, precipitation averaged across them
+CREATE TABLE IF NOT EXISTS "DepartementDailyRollup" (
+    "DepartementId" INTEGER NOT NULL,
+    "Date" DATE NOT NULL,
+    "temperature_2m_min" REAL,
+    "temperature_2m_max" REAL,
+    "temperature_2m_mean" REAL,
+    "precipitation_sum" REAL,
+    "wind_gusts_10m_max" REAL,
+    "hours" INTEGER NOT NULL,
+    PRIMARY KEY ("DepartementId", "Date"),
+    FOREIGN KEY ("DepartementId") REFERENCES "Departements" ("Id") ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS "DepartementWeeklyRollup" (
+    "DepartementId" INTEGER NOT NULL,
+    "Week" DATE NOT NULL,
+    "temperature_2m_min" REAL,
+    "temperature_2m_max" REAL,
+    "temperature_2m_mean" REAL,
+    "precipitation_sum" REAL,
+    "wind_gusts_10m_max" REAL,
+    "hours" INTEGER NOT NULL,
+    PRIMARY KEY ("DepartementId", "Week"),
+    FOREIGN KEY ("DepartementId") REFERENCES "Departements" ("Id") ON DELETE CASCADE
+);
@@ -0,0 +1,11 @@
+-- Per-station progress of the forecast loader: the next run of a station
+-- starts at its last ingested hour, and failed stations are kept for a retry
+CREATE TABLE IF NOT EXISTS "ForecastWatermark" (
+    "WeatherStationId" INTEGER PRIMARY KEY,
+    "LastHour" TIMESTAMPTZ,
+    "LastSuccessAt" TIMESTAMPTZ,
+    "LastAttemptAt" TIMESTAMPTZ NOT NULL,
+    "Failures" INTEGER NOT NULL DEFAULT 0,
+    "LastError" TEXT,
+    FOREIGN KEY ("WeatherStationId") REFERENCES "WeatherStation" ("Id") ON DELETE CASCADE
+);
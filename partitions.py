@@ -0,0 +1,103 @@
+from psycopg2 import sql
+from dotenv import load_dotenv
+import os
+from datetime import datetime, timedelta, timezone
+import sys
+from db import close_all, transaction
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Days of data kept; older daily partitions are dropped
+PARTITION_RETENTION_DAYS = int(os.getenv('PARTITION_RETENTION_DAYS', '7'))
+
+# Days of partitions created ahead of today
+PARTITION_PRECREATE_DAYS = int(os.getenv('PARTITION_PRECREATE_DAYS', '7'))
+
+# Tables partitioned by day and maintained by this module
+PARTITIONED_TABLES = ("WeatherHourly",)
+
+
+def partition_name(table, day):
+    """Name of the daily partition of table holding day."""
+    return f"{table}_p{day:%Y%m%d}"
+
+
+def list_partitions(cur, table):
+    """Return {partition name: day} for the daily partitions of table."""
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass;
+    """, (sql.Identifier(table).as_string(cur),))
+    prefix = f"{table}_p"
+    partitions = {}
+    for (name,) in cur.fetchall():
+        if name.startswith(prefix):
+            try:
+                partitions[name] = datetime.strptime(name[len(prefix):], '%Y%m%d').date()
+            except ValueError:
+                continue
+    return partitions
+
+
+def ensure_partitions(cur, table, first_day, last_day):
+    """Create the missing daily partitions of table from first_day to last_day inclusive.
+
+    Partition bounds are UTC midnights. Returns the names of the created partitions.
+    """
+    existing = list_partitions(cur, table)
+    created = []
+    day = first_day
+    while day <= last_day:
+        name = partition_name(table, day)
+        if name not in existing:
+            lower = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+            cur.execute(sql.SQL(
+                "CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)"
+            ).format(partition=sql.Identifier(name), table=sql.Identifier(table)),
+                (lower, lower + timedelta(days=1)))
+            created.append(name)
+        day += timedelta(days=1)
+    return created
+
+
+def drop_expired_partitions(cur, table, retention_days=PARTITION_RETENTION_DAYS):
+    """Drop the daily partitions of table lying entirely before the retention window.
+
+    Returns the names of the dropped partitions.
+    """
+    cutoff = datetime.now(timezone.utc).date() - timedelta(days=retention_days)
+    dropped = []
+    for name, day in sorted(list_partitions(cur, table).items(), key=lambda item: item[1]):
+        if day + timedelta(days=1) <= cutoff:
+            cur.execute(sql.SQL("DROP TABLE IF EXISTS {partition}").format(partition=sql.Identifier(name)))
+            dropped.append(name)
+    return dropped
+
+
+def manage_partitions(cur, table="WeatherHourly", retention_days=PARTITION_RETENTION_DAYS,
+                      precreate_days=PARTITION_PRECREATE_DAYS):
+    """Pre-create upcoming partitions of table and drop the expired ones.
+
+    Returns a tuple (created, dropped) of partition names.
+    """
+    today = datetime.now(timezone.utc).date()
+    created = ensure_partitions(cur, table, today - timedelta(days=retention_days),
+                                today + timedelta(days=precreate_days))
+    dropped = drop_expired_partitions(cur, table, retention_days)
+    return created, dropped
+
+
+if __name__ == "__main__":
+    try:
+        with transaction() as cur:
+            for table in PARTITIONED_TABLES:
+                created, dropped = manage_partitions(cur, table)
+                print(f"{table}: {len(created)} partitions created, {len(dropped)} expired partitions dropped.")
+    except Exception as e:
+        print("Error managing partitions:", e)
+        sys.exit(1)
+    finally:
+        close_all()
@@ -0,0 +1,323 @@
+from dotenv import load_dotenv
+import os
+from collections import Counter, defaultdict
+import argparse
+import json
+import multiprocessing
+import select
+import signal
+import sys
+import time
+import traceback
+import uuid
+from psycopg2.extras import execute_values
+from db import close_all, connection, transaction
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Jobs reserved per round trip by one worker process
+QUEUE_BATCH_SIZE = int(os.getenv('QUEUE_BATCH_SIZE', '10'))
+
+# Seconds after which a reservation is considered abandoned and the job runs again
+QUEUE_RETRY_AFTER = int(os.getenv('QUEUE_RETRY_AFTER', '90'))
+
+# Seconds an idle worker waits for a notification before checking for delayed jobs
+QUEUE_IDLE_TIMEOUT = float(os.getenv('QUEUE_IDLE_TIMEOUT', '5'))
+
+# Attempts before a job is moved to failed_jobs, and seconds between them
+QUEUE_MAX_TRIES = int(os.getenv('QUEUE_MAX_TRIES', '3'))
+QUEUE_BACKOFF = int(os.getenv('QUEUE_BACKOFF', '10'))
+
+# Queue the jobs of this package go to; Laravel's own workers consume 'default' and
+# this worker fails the jobs it has no handler for, so the two must not share a queue
+QUEUE_NAME = os.getenv('QUEUE_NAME', 'python')
+
+# Channel the jobs_notify trigger publishes queue names on
+QUEUE_CHANNEL = 'jobs'
+
+# Connection name recorded in failed_jobs, as Laravel does for the database driver
+QUEUE_CONNECTION = 'database'
+
+RESERVE_QUERY = """
+    UPDATE "jobs" SET "reserved_at" = %(now)s, "attempts" = "attempts" + 1
+    WHERE "id" IN (
+        SELECT "id" FROM "jobs"
+        WHERE "queue" = %(queue)s AND "available_at" <= %(now)s
+          AND ("reserved_at" IS NULL OR "reserved_at" <= %(now)s - %(retry_after)s)
+        ORDER BY "id"
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING "id", "payload", "attempts";
+"""
+
+# A batch is finished once every job either succeeded or failed for good
+FINISH_BATCH = """
+    "finished_at" = CASE WHEN "pending_jobs" - %(done)s - ("failed_jobs" + %(failed)s) <= 0
+                         THEN %(now)s ELSE "finished_at" END
+"""
+
+HANDLERS = {}
+
+
+def job(name):
+    """Register the decorated function as the handler of jobs called name; it receives the job data."""
+    def register(function):
+        HANDLERS[name] = function
+        return function
+    return register
+
+
+def make_payload(name, data, max_tries=QUEUE_MAX_TRIES, backoff=QUEUE_BACKOFF, batch_id=None):
+    """Serialise a job the way the jobs table stores it."""
+    return json.dumps({
+        'uuid': str(uuid.uuid4()),
+        'displayName': name,
+        'job': name,
+        'maxTries': max_tries,
+        'backoff': backoff,
+        'batchId': batch_id,
+        'data': data,
+    })
+
+
+def dispatch(cur, name, data, queue=QUEUE_NAME, delay=0, max_tries=QUEUE_MAX_TRIES):
+    """Queue one job in the caller's transaction and return its id."""
+    now = int(time.time())
+    cur.execute("""
+        INSERT INTO "jobs" ("queue", "payload", "attempts", "available_at", "created_at")
+        VALUES (%s, %s, 0, %s, %s) RETURNING "id";
+    """, (queue, make_payload(name, data, max_tries), now + delay, now))
+    return cur.fetchone()[0]
+
+
+def dispatch_batch(cur, batch_name, name, items, queue=QUEUE_NAME, max_tries=QUEUE_MAX_TRIES):
+    """Queue one job per data item under a new job_batches row and return the batch id."""
+    items = list(items)
+    now = int(time.time())
+    batch_id = str(uuid.uuid4())
+    cur.execute("""
+        INSERT INTO "job_batches" ("id", "name", "total_jobs", "pending_jobs", "failed_jobs",
+                                   "failed_job_ids", "created_at")
+        VALUES (%s, %s, %s, %s, 0, '[]', %s);
+    """, (batch_id, batch_name, len(items), len(items), now))
+    execute_values(cur, """
+        INSERT INTO "jobs" ("queue", "payload", "attempts", "available_at", "created_at") VALUES %s;
+    """, [(queue, make_payload(name, data, max_tries, batch_id=batch_id), 0, now, now) for data in items])
+    return batch_id
+
+
+def reserve(cur, queue, limit=QUEUE_BATCH_SIZE, retry_after=QUEUE_RETRY_AFTER):
+    """Reserve up to limit due jobs of a queue, skipping those other workers hold.
+
+    Returns [(id, payload dict, attempts)]. The reservation must be committed
+    before the jobs run so that other workers see it.
+    """
+    cur.execute(RESERVE_QUERY, {'now': int(time.time()), 'queue': queue, 'limit': limit,
+                                'retry_after': retry_after})
+    return [(job_id, json.loads(payload), attempts) for job_id, payload, attempts in cur.fetchall()]
+
+
+def cancelled_batches(cur, batch_ids):
+    """Return the ids among batch_ids of the batches that were cancelled."""
+    if not batch_ids:
+        return set()
+    cur.execute('SELECT "id" FROM "job_batches" WHERE "id" = ANY(%s) AND "cancelled_at" IS NOT NULL;',
+                (list(batch_ids),))
+    return {batch_id for (batch_id,) in cur.fetchall()}
+
+
+def run_job(payload):
+    """Run the handler of a job; return None on success or the formatted exception."""
+    try:
+        handler = HANDLERS[payload['job']]
+        handler(payload.get('data'))
+        return None
+    except (Exception, SystemExit):
+        # Handlers reuse loaders that report errors with sys.exit
+        return traceback.format_exc()
+
+
+def settle(cur, queue, outcomes):
+    """Record the outcome of a reserved batch in one transaction.
+
+    outcomes is [(id, payload, attempts, error)]; error None means done.
+    Done jobs are deleted, failed ones released for a retry after their
+    backoff or moved to failed_jobs once out of attempts, and the job_batches
+    counters follow. Returns a Counter of 'done', 'retried' and 'failed'.
+    """
+    now = int(time.time())
+    counts = Counter()
+    done_ids = []
+    failed_rows = []
+    batches = defaultdict(lambda: {'done': 0, 'failed': []})
+    for job_id, payload, attempts, error in outcomes:
+        batch_id = payload.get('batchId')
+        if error is None:
+            done_ids.append(job_id)
+            counts['done'] += 1
+            if batch_id:
+                batches[batch_id]['done'] += 1
+        # Laravel serialises an unset maxTries or backoff as null
+        elif attempts < (payload.get('maxTries') or QUEUE_MAX_TRIES):
+            cur.execute('UPDATE "jobs" SET "reserved_at" = NULL, "available_at" = %s WHERE "id" = %s;',
+                        (now + (payload.get('backoff') or QUEUE_BACKOFF), job_id))
+            counts['retried'] += 1
+        else:
+            done_ids.append(job_id)
+            failed_rows.append((payload['uuid'], QUEUE_CONNECTION, queue, json.dumps(payload), error))
+            counts['failed'] += 1
+            if batch_id:
+                batches[batch_id]['failed'].append(payload['uuid'])
+
+    if done_ids:
+        cur.execute('DELETE FROM "jobs" WHERE "id" = ANY(%s);', (done_ids,))
+    if failed_rows:
+        execute_values(cur, """
+            INSERT INTO "failed_jobs" ("uuid", "connection", "queue", "payload", "exception") VALUES %s
+            ON CONFLICT ("uuid") DO NOTHING;
+        """, failed_rows)
+    for batch_id, batch in batches.items():
+        cur.execute(f"""
+            UPDATE "job_batches" SET
+                {FINISH_BATCH},
+                "pending_jobs" = "pending_jobs" - %(done)s,
+                "failed_jobs" = "failed_jobs" + %(failed)s,
+                "failed_job_ids" = ("failed_job_ids"::jsonb || %(failed_ids)s::jsonb)::text
+            WHERE "id" = %(id)s;
+        """, {'id': batch_id, 'now': now, 'done': batch['done'], 'failed': len(batch['failed']),
+              'failed_ids': json.dumps(batch['failed'])})
+    return counts
+
+
+def work_batch(queue, limit=QUEUE_BATCH_SIZE, retry_after=QUEUE_RETRY_AFTER):
+    """Reserve, run and settle one batch of jobs; return the number of jobs reserved."""
+    with transaction("invites") as cur:
+        reserved = reserve(cur, queue, limit, retry_after)
+        cancelled = cancelled_batches(cur, {payload.get('batchId') for _, payload, _ in reserved} - {None})
+    if not reserved:
+        return 0
+    outcomes = []
+    for job_id, payload, attempts in reserved:
+        # Jobs of a cancelled batch are dropped without running
+        error = None if payload.get('batchId') in cancelled else run_job(payload)
+        outcomes.append((job_id, payload, attempts, error))
+    with transaction("invites") as cur:
+        counts = settle(cur, queue, outcomes)
+    print(f"[{os.getpid()}] {queue}: {counts['done']} done, {counts['retried']} retried, {counts['failed']} failed.")
+    return len(reserved)
+
+
+def work(queues=(QUEUE_NAME,), limit=QUEUE_BATCH_SIZE, retry_after=QUEUE_RETRY_AFTER,
+         idle_timeout=QUEUE_IDLE_TIMEOUT, stop=None):
+    """Process jobs of the given queues until stop is set, sleeping on LISTEN while they are empty.
+
+    A notification wakes the worker within milliseconds of a dispatch; the
+    idle timeout only bounds how late delayed and abandoned jobs are picked up.
+    """
+    stop = stop or multiprocessing.Event()
+    with connection("invites", autocommit=True) as listener:
+        with listener.cursor() as cur:
+            cur.execute(f'LISTEN "{QUEUE_CHANNEL}";')
+        while not stop.is_set():
+            busy = False
+            for queue in queues:
+                while not stop.is_set() and work_batch(queue, limit, retry_after) == limit:
+                    busy = True
+            if busy or stop.is_set():
+                continue
+            if select.select([listener], [], [], idle_timeout)[0]:
+                listener.poll()
+                listener.notifies.clear()
+
+
+def _worker_process(queues, limit, retry_after, idle_timeout, stop):
+    # The parent handles Ctrl-C and tells the children through stop; a
+    # SIGTERM sent to the whole group also lets the current batch finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        work(queues, limit, retry_after, idle_timeout, stop)
+    finally:
+        close_all()
+
+
+def run_workers(processes, queues=(QUEUE_NAME,), limit=QUEUE_BATCH_SIZE, retry_after=QUEUE_RETRY_AFTER,
+                idle_timeout=QUEUE_IDLE_TIMEOUT):
+    """Run worker processes until SIGINT or SIGTERM, then let them finish their current batch."""
+    stop = multiprocessing.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    workers = [multiprocessing.Process(target=_worker_process, args=(queues, limit, retry_after, idle_timeout, stop))
+               for _ in range(max(processes, 1))]
+    for process in workers:
+        process.start()
+    try:
+        while any(process.is_alive() for process in workers) and not stop.is_set():
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for process in workers:
+        process.join()
+
+
+@job("forecast.refresh")
+def refresh_forecast(data):
+    """Fetch and store the forecast of the stations listed as [name, latitude, longitude]."""
+    from forecast import seed_weather_forecast
+    # Jobs are already spread over the worker processes
+    seed_weather_forecast([tuple(station) for station in data['stations']], workers=1)
+
+
+@job("rollups.rebuild")
+def rebuild_rollups(data):
+    """Recompute every weather rollup from WeatherHourly."""
+    from rollups import all_buckets, refresh_rollups
+    with transaction() as cur:
+        refresh_rollups(cur, all_buckets(cur))
+
+
+def enqueue_forecast_refresh(chunk_size, queue=QUEUE_NAME):
+    """Queue one forecast.refresh job per chunk of known stations under one batch; return (batch id, jobs)."""
+    with transaction() as cur:
+        cur.execute('SELECT "Name", "Latitude", "Longitude" FROM "WeatherStation" ORDER BY "Id";')
+        stations = [list(row) for row in cur.fetchall()]
+    chunks = [{'stations': stations[start:start + chunk_size]} for start in range(0, len(stations), chunk_size)]
+    with transaction("invites") as cur:
+        batch_id = dispatch_batch(cur, "forecast refresh", "forecast.refresh", chunks, queue)
+    return batch_id, len(chunks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process the jobs table of the invites database.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    work_parser = subparsers.add_parser("work", help="run worker processes")
+    work_parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                             help="worker processes (default: %(default)s)")
+    work_parser.add_argument("--queue", action="append", help=f"queue to process (repeatable, default: {QUEUE_NAME})")
+    work_parser.add_argument("--batch", type=int, default=QUEUE_BATCH_SIZE,
+                             help="jobs reserved at once (default: %(default)s)")
+    forecast_parser = subparsers.add_parser("enqueue-forecast", help="queue a forecast refresh of every station")
+    forecast_parser.add_argument("--chunk", type=int, default=50, help="stations per job (default: %(default)s)")
+    forecast_parser.add_argument("--queue", default=QUEUE_NAME, help="queue to dispatch to (default: %(default)s)")
+    rollups_parser = subparsers.add_parser("enqueue-rollups", help="queue a rebuild of the weather rollups")
+    rollups_parser.add_argument("--queue", default=QUEUE_NAME, help="queue to dispatch to (default: %(default)s)")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "work":
+            close_all()
+            run_workers(args.processes, tuple(args.queue or (QUEUE_NAME,)), args.batch)
+        elif args.command == "enqueue-forecast":
+            batch_id, count = enqueue_forecast_refresh(args.chunk, args.queue)
+            print(f"{count} forecast jobs queued in batch {batch_id}.")
+        else:
+            with transaction("invites") as cur:
+                job_id = dispatch(cur, "rollups.rebuild", {}, args.queue)
+            print(f"Rollup rebuild queued as job {job_id}.")
+    except Exception as e:
+        print("Error running the queue worker:", e)
+        sys.exit(1)
+    finally:
+        close_all()
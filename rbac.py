@@ -0,0 +1,232 @@
+from dotenv import load_dotenv
+import os
+from collections import OrderedDict
+import argparse
+import select
+import sys
+import threading
+import time
+from db import close_all, connection
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Guard of the permissions and roles checked by default, as in the Laravel application
+RBAC_GUARD = os.getenv('RBAC_GUARD', 'web')
+
+# Models whose roles and direct permissions are kept in memory
+RBAC_CACHE_SIZE = int(os.getenv('RBAC_CACHE_SIZE', '10000'))
+
+# Channel the rbac_notify trigger publishes invalidations on
+RBAC_CHANNEL = 'rbac'
+
+
+def bitset(ids):
+    """Pack permission ids into an integer with bit id set for each of them."""
+    mask = 0
+    for permission_id in ids:
+        mask |= 1 << permission_id
+    return mask
+
+
+class PermissionCache:
+    """Answers permission checks from memory.
+
+    Each role's permissions are held as one bitset indexed by permission id,
+    and each model seen as its role ids plus a bitset of its direct
+    permissions, so a check is a few integer ORs. A listener thread applies
+    the invalidations sent by the rbac_notify triggers.
+    """
+
+    def __init__(self, database="invites", size=RBAC_CACHE_SIZE):
+        self.database = database
+        self.size = size
+        self._permissions = {}  # (name, guard) -> bit
+        self._roles = {}  # role id -> bitset
+        self._models = OrderedDict()  # (model type, model id) -> (role ids, direct bitset)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._loaded = False
+        self._listener = None
+        self._stop = threading.Event()
+
+    def load(self):
+        """(Re)load the permission names and the bitset of every role."""
+        with self._lock:
+            self._generation += 1
+        with connection(self.database, autocommit=True) as conn:
+            with conn.cursor() as cur:
+                cur.execute('SELECT "id", "name", "guard_name" FROM "permissions";')
+                permissions = {(name, guard): 1 << permission_id for permission_id, name, guard in cur.fetchall()}
+                cur.execute("""
+                    SELECT r."id", coalesce(array_agg(rp."permission_id") FILTER (WHERE rp."permission_id" IS NOT NULL), '{}')
+                    FROM "roles" r
+                    LEFT JOIN "role_has_permissions" rp ON rp."role_id" = r."id"
+                    GROUP BY r."id";
+                """)
+                roles = {role_id: bitset(ids) for role_id, ids in cur.fetchall()}
+        # Swapped whole so that readers never see a half-loaded state
+        self._permissions, self._roles = permissions, roles
+        self._loaded = True
+
+    def _model(self, model_type, model_id):
+        key = (model_type, model_id)
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None:
+                self._models.move_to_end(key)
+                return entry
+            generation = self._generation
+        with connection(self.database, autocommit=True) as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT
+                        (SELECT coalesce(array_agg("role_id"), '{}') FROM "model_has_roles"
+                         WHERE "model_type" = %(type)s AND "model_id" = %(id)s),
+                        (SELECT coalesce(array_agg("permission_id"), '{}') FROM "model_has_permissions"
+                         WHERE "model_type" = %(type)s AND "model_id" = %(id)s);
+                """, {'type': model_type, 'id': model_id})
+                role_ids, permission_ids = cur.fetchone()
+        entry = (tuple(role_ids), bitset(permission_ids))
+        with self._lock:
+            # An invalidation during the query may make this result stale: do not keep it
+            if generation == self._generation:
+                self._models[key] = entry
+                while len(self._models) > self.size:
+                    self._models.popitem(last=False)
+        return entry
+
+    def permissions_of(self, model_type, model_id):
+        """Return the bitset of every permission a model has, directly or through its roles."""
+        if not self._loaded:
+            self.load()
+        role_ids, mask = self._model(model_type, model_id)
+        roles = self._roles
+        for role_id in role_ids:
+            mask |= roles.get(role_id, 0)
+        return mask
+
+    def can(self, model_type, model_id, permission, guard=RBAC_GUARD):
+        """True when the model has the named permission."""
+        if not self._loaded:
+            self.load()
+        bit = self._permissions.get((permission, guard))
+        return bit is not None and bool(self.permissions_of(model_type, model_id) & bit)
+
+    def invalidate(self, message):
+        """Apply one rbac_notify payload: 'model:<type>:<id>', 'roles' or 'all'."""
+        if message.startswith('model:'):
+            model_type, _, model_id = message[len('model:'):].rpartition(':')
+            with self._lock:
+                self._generation += 1
+                self._models.pop((model_type, int(model_id)), None)
+        elif message == 'roles':
+            self.load()
+        else:
+            self.clear()
+
+    def clear(self):
+        """Forget everything; the next check reloads."""
+        with self._lock:
+            self._generation += 1
+            self._models.clear()
+            self._loaded = False
+
+    def start(self, idle_timeout=5.0):
+        """Start the background thread listening for invalidations."""
+        if self._listener is None:
+            self._stop.clear()
+            self._listener = threading.Thread(target=self._listen, args=(idle_timeout,), daemon=True)
+            self._listener.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._listener is not None:
+            self._listener.join()
+            self._listener = None
+
+    def _listen(self, idle_timeout):
+        while not self._stop.is_set():
+            try:
+                with connection(self.database, autocommit=True) as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(f'LISTEN "{RBAC_CHANNEL}";')
+                    # Changes made before LISTEN took effect were not notified
+                    self.clear()
+                    while not self._stop.is_set():
+                        if select.select([conn], [], [], idle_timeout)[0]:
+                            conn.poll()
+                            while conn.notifies:
+                                self.invalidate(conn.notifies.pop(0).payload)
+            except Exception as e:
+                print("RBAC listener disconnected, retrying:", e)
+                self.clear()
+                time.sleep(1)
+
+
+def seed_rbac(cur, roles_permissions, guard_name=RBAC_GUARD, permissions=()):
+    """Create the permissions, roles and role permissions missing from {role: [permission, ...]}.
+
+    permissions lists extra permissions granted to no role yet. Three
+    statements whatever the number of roles and permissions.
+    """
+    permissions = sorted(set(permissions) | {permission for perms in roles_permissions.values() for permission in perms})
+    cur.execute("""
+        INSERT INTO "permissions" ("name", "guard_name")
+        SELECT name, %s FROM unnest(%s::varchar[]) AS name
+        ON CONFLICT ("name", "guard_name") DO NOTHING;
+    """, (guard_name, permissions))
+    cur.execute("""
+        INSERT INTO "roles" ("name", "guard_name")
+        SELECT name, %s FROM unnest(%s::varchar[]) AS name
+        ON CONFLICT ("name", "guard_name") DO NOTHING;
+    """, (guard_name, list(roles_permissions)))
+    pairs = [(role, permission) for role, perms in roles_permissions.items() for permission in perms]
+    cur.execute("""
+        INSERT INTO "role_has_permissions" ("role_id", "permission_id")
+        SELECT r."id", p."id"
+        FROM unnest(%s::varchar[], %s::varchar[]) AS x (role, permission)
+        JOIN "roles" r ON r."name" = x.role AND r."guard_name" = %s
+        JOIN "permissions" p ON p."name" = x.permission AND p."guard_name" = %s
+        ON CONFLICT DO NOTHING;
+    """, ([role for role, _ in pairs], [permission for _, permission in pairs], guard_name, guard_name))
+    return cur.rowcount
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_permissions():
+    """Return the permission cache of this process, listening for invalidations."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = PermissionCache()
+            _shared.start()
+        return _shared
+
+
+def can(model_type, model_id, permission, guard=RBAC_GUARD):
+    """True when the model has the named permission, answered from the shared cache."""
+    return shared_permissions().can(model_type, model_id, permission, guard)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check a permission of a model.")
+    parser.add_argument("model_type", help="e.g. App\\Models\\User")
+    parser.add_argument("model_id", type=int)
+    parser.add_argument("permission")
+    parser.add_argument("--guard", default=RBAC_GUARD)
+    args = parser.parse_args()
+
+    try:
+        cache = PermissionCache()
+        allowed = cache.can(args.model_type, args.model_id, args.permission, args.guard)
+        print("allowed" if allowed else "denied")
+        sys.exit(0 if allowed else 2)
+    except Exception as e:
+        print("Error checking permission:", e)
+        sys.exit(1)
+    finally:
+        close_all()
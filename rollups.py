@@ -0,0 +1,144 @@
+from dotenv import load_dotenv
+import argparse
+import sys
+from db import close_all, transaction
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Serialises the department refresh of concurrent writers until their commit
+DEPARTEMENT_ROLLUP_LOCK_KEY = 7_270_413
+
+# Aggregated columns shared by every rollup table
+ROLLUP_COLUMNS = ("temperature_2m_min", "temperature_2m_max", "temperature_2m_mean",
+                  "precipitation_sum", "wind_gusts_10m_max", "hours")
+
+# Touched (station, day) buckets, passed as two parallel arrays
+TOUCHED = "unnest(%(stations)s::integer[], %(days)s::date[]) AS t (station_id, day)"
+
+# Combining finer rollups: the mean is weighted by the hours behind each row. Sums
+# of REAL columns are accumulated as double precision: a REAL sum depends on the
+# order rows are read in, so a rebuild could disagree with an incremental refresh
+_COMBINE = """
+    min(r."temperature_2m_min"), max(r."temperature_2m_max"),
+    sum(r."temperature_2m_mean"::float8 * r."hours") / nullif(sum(r."hours") FILTER (WHERE r."temperature_2m_mean" IS NOT NULL), 0),
+    {precipitation}(r."precipitation_sum"::float8), max(r."wind_gusts_10m_max"), sum(r."hours")
+"""
+
+
+def _upsert(table, key_columns):
+    """ON CONFLICT clause rewriting a bucket only when one of its aggregates changed."""
+    keys = ', '.join(f'"{column}"' for column in key_columns)
+    columns = ', '.join(f'"{column}"' for column in ROLLUP_COLUMNS)
+    excluded = ', '.join(f'EXCLUDED."{column}"' for column in ROLLUP_COLUMNS)
+    current = ', '.join(f'"{table}"."{column}"' for column in ROLLUP_COLUMNS)
+    return (f'ON CONFLICT ({keys}) DO UPDATE SET ({columns}) = ({excluded}) '
+            f'WHERE ({current}) IS DISTINCT FROM ({excluded})')
+
+
+REFRESH_STATION_DAILY = f"""
+    INSERT INTO "StationDailyRollup" ("WeatherStationId", "Date", {', '.join(f'"{c}"' for c in ROLLUP_COLUMNS)})
+    SELECT t.station_id, t.day,
+           min(h."temperature_2m"), max(h."temperature_2m"), avg(h."temperature_2m"),
+           sum(h."precipitation"::float8), max(h."wind_gusts_10m"), count(*)
+    FROM (SELECT DISTINCT station_id, day FROM {TOUCHED}) t
+    JOIN "WeatherHourly" h ON h."WeatherStationId" = t.station_id
+        AND h."Timestamp" >= t.day::timestamp AT TIME ZONE 'UTC'
+        AND h."Timestamp" < (t.day + 1)::timestamp AT TIME ZONE 'UTC'
+    GROUP BY t.station_id, t.day
+    {_upsert("StationDailyRollup", ("WeatherStationId", "Date"))};
+"""
+
+REFRESH_STATION_WEEKLY = f"""
+    INSERT INTO "StationWeeklyRollup" ("WeatherStationId", "Week", {', '.join(f'"{c}"' for c in ROLLUP_COLUMNS)})
+    SELECT t.station_id, t.week, {_COMBINE.format(precipitation='sum')}
+    FROM (SELECT DISTINCT station_id, date_trunc('week', day)::date AS week FROM {TOUCHED}) t
+    JOIN "StationDailyRollup" r ON r."WeatherStationId" = t.station_id
+        AND r."Date" >= t.week AND r."Date" < t.week + 7
+    GROUP BY t.station_id, t.week
+    {_upsert("StationWeeklyRollup", ("WeatherStationId", "Week"))};
+"""
+
+REFRESH_DEPARTEMENT_DAILY = f"""
+    INSERT INTO "DepartementDailyRollup" ("DepartementId", "Date", {', '.join(f'"{c}"' for c in ROLLUP_COLUMNS)})
+    SELECT b."DepartementId", b.day, {_COMBINE.format(precipitation='avg')}
+    FROM (
+        SELECT DISTINCT m."DepartementId", t.day
+        FROM {TOUCHED}
+        JOIN "DepartementNearestStation" m ON m."WeatherStationId" = t.station_id
+    ) b
+    JOIN "DepartementNearestStation" m ON m."DepartementId" = b."DepartementId"
+    JOIN "StationDailyRollup" r ON r."WeatherStationId" = m."WeatherStationId" AND r."Date" = b.day
+    GROUP BY b."DepartementId", b.day
+    {_upsert("DepartementDailyRollup", ("DepartementId", "Date"))};
+"""
+
+REFRESH_DEPARTEMENT_WEEKLY = f"""
+    INSERT INTO "DepartementWeeklyRollup" ("DepartementId", "Week", {', '.join(f'"{c}"' for c in ROLLUP_COLUMNS)})
+    SELECT b."DepartementId", b.week, {_COMBINE.format(precipitation='sum')}
+    FROM (
+        SELECT DISTINCT m."DepartementId", date_trunc('week', t.day)::date AS week
+        FROM {TOUCHED}
+        JOIN "DepartementNearestStation" m ON m."WeatherStationId" = t.station_id
+    ) b
+    JOIN "DepartementDailyRollup" r ON r."DepartementId" = b."DepartementId"
+        AND r."Date" >= b.week AND r."Date" < b.week + 7
+    GROUP BY b."DepartementId", b.week
+    {_upsert("DepartementWeeklyRollup", ("DepartementId", "Week"))};
+"""
+
+# Finer rollups first: each level is computed from the one before it
+REFRESH_QUERIES = (
+    ("StationDailyRollup", REFRESH_STATION_DAILY),
+    ("StationWeeklyRollup", REFRESH_STATION_WEEKLY),
+    ("DepartementDailyRollup", REFRESH_DEPARTEMENT_DAILY),
+    ("DepartementWeeklyRollup", REFRESH_DEPARTEMENT_WEEKLY),
+)
+
+
+def refresh_rollups(cur, touched):
+    """Recompute the rollup buckets covering the touched (station Id, UTC day) pairs.
+
+    Only the days, weeks and departments those pairs fall in are rewritten,
+    and a bucket whose aggregates did not change is left as is.
+    Returns {rollup table: rows written}.
+
+    Department buckets mix stations written by other transactions, so their
+    refresh takes a transaction-level advisory lock: the last writer to
+    commit always aggregates every committed row.
+    """
+    touched = list(touched)
+    counts = {table: 0 for table, _ in REFRESH_QUERIES}
+    if not touched:
+        return counts
+    params = {'stations': [station_id for station_id, _ in touched], 'days': [day for _, day in touched]}
+    for table, query in REFRESH_QUERIES:
+        if table == "DepartementDailyRollup":
+            cur.execute('SELECT pg_advisory_xact_lock(%s);', (DEPARTEMENT_ROLLUP_LOCK_KEY,))
+        cur.execute(query, params)
+        counts[table] = cur.rowcount
+    return counts
+
+
+def all_buckets(cur):
+    """Return every (station Id, UTC day) pair present in WeatherHourly."""
+    cur.execute("""
+        SELECT DISTINCT "WeatherStationId", ("Timestamp" AT TIME ZONE 'UTC')::date
+        FROM "WeatherHourly";
+    """)
+    return cur.fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the weather rollups from WeatherHourly.")
+    parser.parse_args()
+
+    try:
+        with transaction() as cur:
+            for table, count in refresh_rollups(cur, all_buckets(cur)).items():
+                print(f"{count} rows written to {table}.")
+    except Exception as e:
+        print("Error refreshing weather rollups:", e)
+        sys.exit(1)
+    finally:
+        close_all()
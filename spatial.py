@@ -0,0 +1,178 @@
+from dotenv import load_dotenv
+import os
+import argparse
+import heapq
+import math
+import sys
+from bulk import copy_rows
+from db import close_all, transaction
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Mean Earth radius used for great-circle distances
+EARTH_RADIUS_KM = 6371.0088
+
+# Stations recorded per city and per department in the mapping tables
+STATION_NEIGHBOURS = int(os.getenv('STATION_NEIGHBOURS', '3'))
+
+# Mapping table refreshed for each reference table: (source table, mapping table, id column)
+STATION_MAPPINGS = (
+    ("Cities", "CityNearestStation", "CityId"),
+    ("Departements", "DepartementNearestStation", "DepartementId"),
+)
+
+
+def to_xyz(latitude, longitude):
+    """Project a coordinate onto the unit sphere."""
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def chord_to_km(chord):
+    """Convert a straight-line distance between unit vectors to a great-circle distance."""
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+
+def km_to_chord(km):
+    """Convert a great-circle distance to the matching straight-line distance on the unit sphere."""
+    return 2 * math.sin(min(km / (2 * EARTH_RADIUS_KM), math.pi / 2))
+
+
+def _squared(a, b):
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2
+
+
+class KDTree:
+    """Static 3-d tree over coordinates projected on the unit sphere.
+
+    Straight-line distance between unit vectors grows monotonically with
+    great-circle distance, so nearest neighbours in 3-d are nearest on Earth
+    and queries need no trigonometry per visited node.
+    """
+
+    def __init__(self, points):
+        """Build the tree from an iterable of (item, latitude, longitude)."""
+        nodes = [(to_xyz(lat, lon), item) for item, lat, lon in points]
+        self.size = len(nodes)
+        self._root = self._build(nodes, 0)
+
+    def _build(self, nodes, depth):
+        if not nodes:
+            return None
+        axis = depth % 3
+        nodes.sort(key=lambda node: node[0][axis])
+        middle = len(nodes) // 2
+        point, item = nodes[middle]
+        return (point, item, axis,
+                self._build(nodes[:middle], depth + 1),
+                self._build(nodes[middle + 1:], depth + 1))
+
+    def nearest(self, latitude, longitude, k=1):
+        """Return the k nearest items as a list of (distance_km, item), closest first."""
+        target = to_xyz(latitude, longitude)
+        best = []  # max-heap of (-squared distance, counter, item)
+        counter = 0
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            point, item, axis, left, right = node
+            distance = _squared(point, target)
+            if len(best) < k:
+                heapq.heappush(best, (-distance, counter, item))
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, (-distance, counter, item))
+            counter += 1
+            delta = target[axis] - point[axis]
+            near, far = (left, right) if delta < 0 else (right, left)
+            # Only visit the far side when the splitting plane is closer than the current k-th best
+            if len(best) < k or delta * delta < -best[0][0]:
+                stack.append(far)
+            stack.append(near)
+        return [(chord_to_km(math.sqrt(-distance)), item) for distance, _, item in sorted(best, reverse=True)]
+
+    def within(self, latitude, longitude, radius_km):
+        """Return the items within radius_km as a list of (distance_km, item), closest first."""
+        target = to_xyz(latitude, longitude)
+        limit = km_to_chord(radius_km) ** 2
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            point, item, axis, left, right = node
+            distance = _squared(point, target)
+            if distance <= limit:
+                found.append((chord_to_km(math.sqrt(distance)), item))
+            delta = target[axis] - point[axis]
+            if delta <= 0 or delta * delta <= limit:
+                stack.append(left)
+            if delta >= 0 or delta * delta <= limit:
+                stack.append(right)
+        return sorted(found, key=lambda result: result[0])
+
+
+def load_station_index(cur):
+    """Build a KDTree of weather station Ids from the database."""
+    cur.execute('SELECT "Id", "Latitude", "Longitude" FROM "WeatherStation";')
+    return KDTree(cur.fetchall())
+
+
+def refresh_station_mappings(cur, k=STATION_NEIGHBOURS, index=None):
+    """Recompute the k nearest stations of every city and department.
+
+    The mapping tables are rewritten in the caller's transaction, so readers
+    keep seeing the previous mapping until it commits. Returns {mapping table: rows}.
+    """
+    index = index or load_station_index(cur)
+    counts = {}
+    for source, mapping, id_column in STATION_MAPPINGS:
+        cur.execute(f'DELETE FROM "{mapping}";')
+        if not index.size:
+            counts[mapping] = 0
+            continue
+        cur.execute(f'SELECT "Id", "Latitude", "Longitude" FROM "{source}";')
+        rows = (
+            (row_id, rank, station_id, round(distance, 3))
+            for row_id, lat, lon in cur.fetchall()
+            for rank, (distance, station_id) in enumerate(index.nearest(lat, lon, k), start=1)
+        )
+        counts[mapping] = copy_rows(cur, mapping, (id_column, "Rank", "WeatherStationId", "DistanceKm"), rows)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nearest weather station lookups.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("refresh", help="recompute the city and department to station mappings")
+    nearest = subparsers.add_parser("nearest", help="list the stations nearest to a coordinate")
+    nearest.add_argument("latitude", type=float)
+    nearest.add_argument("longitude", type=float)
+    nearest.add_argument("-k", type=int, default=1, help="number of stations (default: %(default)s)")
+    within = subparsers.add_parser("within", help="list the stations within a radius of a coordinate")
+    within.add_argument("latitude", type=float)
+    within.add_argument("longitude", type=float)
+    within.add_argument("radius_km", type=float)
+    args = parser.parse_args()
+
+    try:
+        with transaction() as cur:
+            if args.command == "refresh":
+                for mapping, count in refresh_station_mappings(cur).items():
+                    print(f"{count} rows written to {mapping}.")
+            else:
+                index = load_station_index(cur)
+                if args.command == "nearest":
+                    results = index.nearest(args.latitude, args.longitude, args.k)
+                else:
+                    results = index.within(args.latitude, args.longitude, args.radius_km)
+                for distance, station_id in results:
+                    print(f"{station_id}\t{distance:.3f} km")
+    except Exception as e:
+        print("Error resolving weather stations:", e)
+        sys.exit(1)
+    finally:
+        close_all()
@@ -0,0 +1,153 @@
+from psycopg2 import errors, sql
+from dotenv import load_dotenv
+import os
+from collections import namedtuple
+import argparse
+import sys
+import time
+from db import close_all, connection
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Rows deleted per transaction; each chunk holds its row locks only this long
+SWEEP_CHUNK_SIZE = int(os.getenv('SWEEP_CHUNK_SIZE', '500'))
+
+# Seconds of deleting allowed per cycle, and seconds between cycles of the daemon
+SWEEP_TIME_BUDGET = float(os.getenv('SWEEP_TIME_BUDGET', '2'))
+SWEEP_INTERVAL = float(os.getenv('SWEEP_INTERVAL', '60'))
+
+# Give up on a chunk rather than queue behind a lock held by DDL
+SWEEP_LOCK_TIMEOUT = os.getenv('SWEEP_LOCK_TIMEOUT', '100ms')
+
+# Lifetimes shared with the Laravel application, in minutes
+SESSION_LIFETIME = int(os.getenv('SESSION_LIFETIME', '120'))
+PASSWORD_RESET_EXPIRE = int(os.getenv('PASSWORD_RESET_EXPIRE', '60'))
+
+# table: keyset column (the primary key) and the condition selecting expired rows
+Target = namedtuple('Target', 'table key expired')
+
+TARGETS = (
+    Target("sessions", "id",
+           sql.SQL('"last_activity" < extract(epoch FROM now()) - {}').format(sql.Literal(SESSION_LIFETIME * 60))),
+    Target("invites", "id", sql.SQL('"expires_at" < LOCALTIMESTAMP')),
+    Target("password_reset_tokens", "email",
+           sql.SQL('"created_at" < LOCALTIMESTAMP - {} * interval \'1 minute\'').format(sql.Literal(PASSWORD_RESET_EXPIRE))),
+    Target("cache", "key", sql.SQL('"expiration" < extract(epoch FROM now())')),
+    Target("cache_locks", "key", sql.SQL('"expiration" < extract(epoch FROM now())')),
+)
+
+
+def delete_chunk(cur, target, after, chunk_size=SWEEP_CHUNK_SIZE):
+    """Delete up to chunk_size expired rows with a key above after; return (rows deleted, last key).
+
+    Rows locked by live traffic are skipped rather than waited for, and get
+    picked up by a later pass.
+    """
+    key = sql.Identifier(target.key)
+    condition = target.expired
+    if after is not None:
+        condition = sql.SQL('{key} > {after} AND {condition}').format(key=key, after=sql.Literal(after), condition=condition)
+    # The last key is taken by the server so that it follows the column's collation
+    cur.execute(sql.SQL("""
+        WITH deleted AS (
+            DELETE FROM {table} WHERE {key} IN (
+                SELECT {key} FROM {table} WHERE {condition}
+                ORDER BY {key} LIMIT {limit}
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING {key}
+        )
+        SELECT count(*), max({key}) FROM deleted;
+    """).format(table=sql.Identifier(target.table), key=key, condition=condition, limit=sql.Literal(chunk_size)))
+    return cur.fetchone()
+
+
+class Sweeper:
+    """Deletes expired rows of the invites database in short chunks within a time budget per cycle.
+
+    Each table is walked in primary key order; when the budget runs out the
+    position is kept and the next cycle resumes from it.
+    """
+
+    def __init__(self, targets=TARGETS, chunk_size=SWEEP_CHUNK_SIZE, budget=SWEEP_TIME_BUDGET, database="invites"):
+        self.targets = list(targets)
+        self.chunk_size = chunk_size
+        self.budget = budget
+        self.database = database
+        self._positions = {target.table: None for target in self.targets}
+        self._next = 0
+
+    def cycle(self):
+        """Run one cycle and return {table: {'rows', 'chunks', 'lock_ms', 'max_lock_ms', 'done', 'skipped'}}."""
+        deadline = time.monotonic() + self.budget
+        report = {}
+        with connection(self.database) as conn:
+            for step in range(len(self.targets)):
+                target = self.targets[(self._next + step) % len(self.targets)]
+                stats = report.setdefault(target.table, {'rows': 0, 'chunks': 0, 'lock_ms': 0.0,
+                                                         'max_lock_ms': 0.0, 'done': False, 'skipped': False})
+                while time.monotonic() < deadline:
+                    start = time.monotonic()
+                    try:
+                        with conn.cursor() as cur:
+                            cur.execute('SET LOCAL lock_timeout = %s;', (SWEEP_LOCK_TIMEOUT,))
+                            deleted, last = delete_chunk(cur, target, self._positions[target.table], self.chunk_size)
+                        conn.commit()
+                    except errors.LockNotAvailable:
+                        # The table is locked by DDL: leave it for a later cycle
+                        conn.rollback()
+                        stats['skipped'] = True
+                        break
+                    # Row locks are held from the DELETE until the commit
+                    held = (time.monotonic() - start) * 1000
+                    stats['rows'] += deleted
+                    stats['chunks'] += 1
+                    stats['lock_ms'] += held
+                    stats['max_lock_ms'] = max(stats['max_lock_ms'], held)
+                    if deleted < self.chunk_size:
+                        # End of the table: start from the beginning next time
+                        self._positions[target.table] = None
+                        stats['done'] = True
+                        break
+                    self._positions[target.table] = last
+                else:
+                    # Out of budget: resume with this table next cycle
+                    self._next = (self._next + step) % len(self.targets)
+                    break
+            else:
+                self._next = 0
+        return report
+
+
+def print_report(report):
+    for table, stats in report.items():
+        state = "done" if stats['done'] else "locked, skipped" if stats['skipped'] else "resumes next cycle"
+        print(f"{table}: {stats['rows']} rows removed in {stats['chunks']} chunks, "
+              f"locks held {stats['lock_ms']:.1f} ms (longest {stats['max_lock_ms']:.1f} ms), {state}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Purge expired sessions, invites, reset tokens and cache entries.")
+    parser.add_argument("--once", action="store_true", help="run a single cycle and exit")
+    parser.add_argument("--chunk", type=int, default=SWEEP_CHUNK_SIZE, help="rows per chunk (default: %(default)s)")
+    parser.add_argument("--budget", type=float, default=SWEEP_TIME_BUDGET,
+                        help="seconds of deleting per cycle (default: %(default)s)")
+    parser.add_argument("--interval", type=float, default=SWEEP_INTERVAL,
+                        help="seconds between cycles (default: %(default)s)")
+    args = parser.parse_args()
+
+    sweeper = Sweeper(chunk_size=args.chunk, budget=args.budget)
+    try:
+        while True:
+            print_report(sweeper.cycle())
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print("Error sweeping expired rows:", e)
+        sys.exit(1)
+    finally:
+        close_all()
@@ -0,0 +1,113 @@
+from psycopg2 import sql
+from datetime import timezone
+import argparse
+import sys
+from db import close_all, transaction
+from partitions import ensure_partitions
+
+# Compact store for each "WeatherDatas" column family and the key columns it adds
+STORES = {
+    "WeatherCurrent": ("Current_", ("WeatherStationId", "Timestamp")),
+    "WeatherHourly": ("Hourly_", ("WeatherStationId", "Timestamp")),
+    "WeatherDaily": ("Daily_", ("WeatherStationId", "Date")),
+}
+
+
+def store_columns(cur, table):
+    """Return the measurement columns of a store, without its key columns."""
+    keys = STORES[table][1]
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+        ORDER BY ordinal_position;
+    """, (table,))
+    return [name for (name,) in cur.fetchall() if name not in keys]
+
+
+def _family_selects(cur, table):
+    """Build the target column list, source expressions and non-null filter for a store."""
+    prefix = STORES[table][0]
+    columns = store_columns(cur, table)
+    target = sql.SQL(', ').join(sql.Identifier(column) for column in columns)
+    source = sql.SQL(', ').join(sql.Identifier(prefix + column) for column in columns)
+    return target, source, sql.SQL("num_nonnulls({}) > 0").format(source)
+
+
+def migrate_weather_datas(cur, keep=False):
+    """Move the rows of the wide "WeatherDatas" table into the compact stores.
+
+    Hourly values keep one row per station and hour, daily values are collapsed
+    to one row per station and UTC day, and the current snapshot keeps the latest
+    row of each station. Rows already present in a store are left untouched.
+    "WeatherDatas" is truncated afterwards unless keep is set.
+    Returns {store: rows copied}; all zero on databases created without
+    "WeatherDatas".
+    """
+    counts = dict.fromkeys(STORES, 0)
+    cur.execute("""SELECT to_regclass('"WeatherDatas"');""")
+    if cur.fetchone()[0] is None:
+        return counts
+    cur.execute('SELECT min("Timestamp"), max("Timestamp") FROM "WeatherDatas";')
+    first, last = cur.fetchone()
+    if first is None:
+        return counts
+
+    # Hourly rows need a partition for every day they cover
+    ensure_partitions(cur, "WeatherHourly", first.astimezone(timezone.utc).date(),
+                      last.astimezone(timezone.utc).date())
+    target, source, has_values = _family_selects(cur, "WeatherHourly")
+    cur.execute(sql.SQL("""
+        INSERT INTO "WeatherHourly" ("WeatherStationId", "Timestamp", {target})
+        SELECT "WeatherStationId", "Timestamp", {source}
+        FROM "WeatherDatas"
+        WHERE {has_values}
+        ON CONFLICT DO NOTHING;
+    """).format(target=target, source=source, has_values=has_values))
+    counts["WeatherHourly"] = cur.rowcount
+
+    # Daily values are repeated on every hour of the day; keep the latest copy
+    target, source, has_values = _family_selects(cur, "WeatherDaily")
+    cur.execute(sql.SQL("""
+        INSERT INTO "WeatherDaily" ("WeatherStationId", "Date", {target})
+        SELECT DISTINCT ON ("WeatherStationId", ("Timestamp" AT TIME ZONE 'UTC')::date)
+            "WeatherStationId", ("Timestamp" AT TIME ZONE 'UTC')::date, {source}
+        FROM "WeatherDatas"
+        WHERE {has_values}
+        ORDER BY "WeatherStationId", ("Timestamp" AT TIME ZONE 'UTC')::date, "Timestamp" DESC
+        ON CONFLICT DO NOTHING;
+    """).format(target=target, source=source, has_values=has_values))
+    counts["WeatherDaily"] = cur.rowcount
+
+    target, source, has_values = _family_selects(cur, "WeatherCurrent")
+    cur.execute(sql.SQL("""
+        INSERT INTO "WeatherCurrent" ("WeatherStationId", "Timestamp", {target})
+        SELECT DISTINCT ON ("WeatherStationId") "WeatherStationId", "Timestamp", {source}
+        FROM "WeatherDatas"
+        WHERE {has_values}
+        ORDER BY "WeatherStationId", "Timestamp" DESC
+        ON CONFLICT DO NOTHING;
+    """).format(target=target, source=source, has_values=has_values))
+    counts["WeatherCurrent"] = cur.rowcount
+
+    if not keep:
+        cur.execute('TRUNCATE "WeatherDatas";')
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the compact weather stores.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help='move "WeatherDatas" rows into the compact stores')
+    migrate.add_argument("--keep", action="store_true", help='do not truncate "WeatherDatas" afterwards')
+    args = parser.parse_args()
+
+    try:
+        with transaction() as cur:
+            counts = migrate_weather_datas(cur, keep=args.keep)
+        for table, count in counts.items():
+            print(f"{count} rows moved into {table}.")
+    except Exception as e:
+        print("Error migrating weather data:", e)
+        sys.exit(1)
+    finally:
+        close_all()